@@ -1,6 +1,8 @@
 # app.py (with Test Scrape support + Fall 2025 filters + sequential queue)
 import os
 import signal
+import atexit
+import asyncio
 from zoneinfo import ZoneInfo  # stdlib IANA time zone support
 from dotenv import load_dotenv
 
@@ -9,22 +11,30 @@ load_dotenv(".env.local")
 
 import re
 import json
-import uuid
+import secrets
 import time
 import math
+import mmap
 import shutil
 import threading
+import multiprocessing
 import logging
 import traceback
 import contextlib
 import tempfile
 import datetime
-from typing import List, Dict, Tuple, Optional
+import functools
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List, Dict, Tuple, Optional
 from flask import Flask, request, redirect, url_for, session, jsonify, render_template
-from flask import send_file
+from jinja2 import FileSystemBytecodeCache
+from flask import send_file, Response, stream_with_context
 import logging
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import create_engine, text as sql_text
+from sqlalchemy import create_engine, bindparam, or_, select, union_all, text as sql_text
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.exc import PendingRollbackError
 from logging.handlers import RotatingFileHandler
@@ -36,13 +46,72 @@ try:
     import tiktoken
 except Exception:
     tiktoken = None
+import numpy as np
+# Optional ANN index for chunk retrieval (falls back to a linear cosine scan)
+try:
+    import faiss
+except Exception:
+    faiss = None
+# Optional SIMD distance kernels for ranking chunk embeddings (falls back to a NumPy matvec)
+try:
+    import simsimd
+except Exception:
+    simsimd = None
+# Optional SIMD JSON parser/encoder for large payloads (API responses, embeddings, extension blobs)
+try:
+    import orjson
+    _json_loads = orjson.loads
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+except Exception:
+    orjson = None
+    _json_loads = json.loads
+    def _json_dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+def _json_response(payload, status: int = 200) -> Response:
+    """
+    Build a JSON response with _json_dumps (orjson when installed, NumPy values included).
+
+    Args:
+        payload: JSON-serializable object
+        status (int): HTTP status code
+
+    Returns:
+        Response: application/json response
+    """
+    return Response(_json_dumps(payload), status=status, mimetype="application/json")
 # HTTP for OpenAI; mirrors local compress_text.py / canvas.py style
 import requests
+import httpx
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 # -----------------------------------------------------------------------------
 # Flask and config
 # -----------------------------------------------------------------------------
 app = Flask(__name__)
 app.secret_key = os.environ["SECRET_KEY"]
+# Let browsers cache /static assets (pollers) instead of re-downloading inline scripts per page
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = int(os.environ.get("STATIC_MAX_AGE", "3600"))
+# Compiled templates survive restarts and are shared across worker processes
+JINJA_CACHE_DIR = os.environ.get("JINJA_CACHE_DIR", os.path.join(tempfile.gettempdir(), "chanvas", "jinja_cache"))
+try:
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_CACHE_DIR)
+except OSError:
+    pass
+# Optional response compression for the layout HTML and static scripts. Polling JSON is
+# left alone: it is small and its ETag/304 handling must see the tags it issued.
+try:
+    from flask_compress import Compress
+    app.config.update(
+        COMPRESS_MIMETYPES=["text/html", "text/css", "application/javascript", "text/javascript"],
+        COMPRESS_ALGORITHM=["br", "gzip"],
+        COMPRESS_LEVEL=4,
+        COMPRESS_BR_LEVEL=4,
+    )
+    Compress(app)
+except Exception:
+    Compress = None
 
 # OAuth setup
 from authlib.integrations.flask_client import OAuth
@@ -77,7 +146,15 @@ if DATABASE_URL.startswith("postgres://"):
 if DATABASE_URL.startswith("postgresql://") and "sslmode=" not in DATABASE_URL and "localhost" not in DATABASE_URL:
     sep = "&" if "?" in DATABASE_URL else "?"
     DATABASE_URL = f"{DATABASE_URL}{sep}sslmode=require"
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# LIFO pooling keeps a hot subset of PG connections and lets idle overflow time out;
+# SQLite's default pool class (NullPool/SingletonThreadPool) rejects sizing args.
+_ENGINE_POOL_KW = {} if DATABASE_URL.startswith("sqlite") else {
+    "pool_use_lifo": True,
+    "pool_size": int(os.environ.get("DB_POOL_SIZE", "10")),
+    "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", "20")),
+    "pool_recycle": 1800,
+}
+engine = create_engine(DATABASE_URL, pool_pre_ping=True, **_ENGINE_POOL_KW)
 Base.metadata.create_all(engine)
 # --- Auto-scrape model & simple encryption -----------------------------------
 from sqlalchemy import Column, Integer, String, Boolean, DateTime
@@ -92,7 +169,7 @@ app.logger.handlers = gunicorn_error_logger.handlers
 app.logger.setLevel(gunicorn_error_logger.level)
 class AutoScrape(Base):
     __tablename__ = "auto_scrapes"
-    id = Column(String(32), primary_key=True)           # uuid hex for record
+    id = Column(String(32), primary_key=True)           # random hex id for record
     user_id = Column(Integer, unique=True, index=True)  # one-per-user
     enabled = Column(Boolean, default=False, nullable=False)
     username = Column(String(255))                      # last Canvas username used
@@ -106,6 +183,31 @@ class AutoScrape(Base):
 
 # ensure table exists even if this file loads before the earlier create_all
 Base.metadata.create_all(engine)
+# Partial index for "does this user have an active job?" probes (PG and SQLite both support WHERE)
+try:
+    with engine.begin() as _conn:
+        _conn.execute(sql_text("""
+            CREATE INDEX IF NOT EXISTS jobs_active_uid ON jobs (user_id)
+            WHERE status IN ('queued', 'starting', 'logging_in', 'compressing')
+        """))
+except Exception as _e:
+    logging.getLogger(__name__).warning("Could not create jobs_active_uid index: %s", _e)
+# Newest-first listing of extension session jobs (temp user ids are all > 100000)
+try:
+    with engine.begin() as _conn:
+        _conn.execute(sql_text("""
+            CREATE INDEX IF NOT EXISTS jobs_session_created ON jobs (created_at DESC)
+            WHERE user_id > 100000
+        """))
+except Exception as _e:
+    logging.getLogger(__name__).warning("Could not create jobs_session_created index: %s", _e)
+# Indexes declared on models after their tables already existed (create_all skips those)
+for _ix in list(Job.__table__.indexes) + list(Base.metadata.tables["embedding_cache"].indexes):
+    if _ix.name in ("ix_job_user_created", "ix_embedding_cache_created_at"):
+        try:
+            _ix.create(bind=engine, checkfirst=True)
+        except Exception as _e:
+            logging.getLogger(__name__).warning("Could not create %s index: %s", _ix.name, _e)
 
 def _fernet_key_from_secret(secret: bytes) -> bytes:
     """
@@ -131,6 +233,26 @@ try:
 except Exception:
     _FERNET = None
 
+_TEMP_UID_KEY = hashlib.sha256(b"temp-user-id|" + (
+    app.secret_key if isinstance(app.secret_key, (bytes, bytearray)) else str(app.secret_key).encode("utf-8")
+)).digest()
+def _temp_user_id(session_token: str) -> int:
+    """
+    Map a Canvas session token to a stable temporary user id.
+
+    Uses a keyed BLAKE2s digest instead of hash(), whose per-process salt gave the
+    same session a different id after every restart (and ids under 100000 that the
+    session-job queries didn't treat as temporary).
+
+    Args:
+        session_token (str): Canvas session cookie value
+
+    Returns:
+        int: Temporary user id in 100001..1000000
+    """
+    digest = hashlib.blake2s(session_token.encode("utf-8"), digest_size=4, key=_TEMP_UID_KEY).digest()
+    return int.from_bytes(digest, "big") % 900000 + 100001
+
 def _encrypt_pw(s: str) -> str:
     """
     Encrypt a password string for secure storage.
@@ -180,6 +302,9 @@ def _decrypt_pw(s: str) -> str:
     return ""
 
 SessionLocal = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
+# Read-only pollers (/latest_duo, /job_state) share the pool but run in AUTOCOMMIT,
+# so each 1.5s poll is a bare SELECT with no BEGIN/COMMIT round-trips.
+ReadSession = scoped_session(sessionmaker(bind=engine.execution_options(isolation_level="AUTOCOMMIT"), expire_on_commit=False))
 # Logging
 LOG_PATH = os.environ.get("ERROR_LOG_PATH", "server_errors.log")
 logger = logging.getLogger("app")
@@ -205,6 +330,7 @@ def log_exception(where: str, exc: Exception):
 @app.teardown_appcontext
 def remove_session(exception=None):
     SessionLocal.remove()
+    ReadSession.remove()
 def sanitize_db_text(s: str) -> str:
     """
     Remove problematic control characters from text before database insertion.
@@ -222,6 +348,8 @@ def sanitize_db_text(s: str) -> str:
         return s
     s = s.replace("\x00", "")
     return re.sub(r"[\x01-\x08\x0B\x0C\x0E-\x1F]", "", s)
+# How long a login_required existence check stays valid in the session cookie
+USER_RECHECK_SECONDS = int(os.environ.get("USER_RECHECK_SECONDS", "60"))
 def current_user(db):
     """
     Get the currently logged-in user from the Flask session.
@@ -252,21 +380,24 @@ def login_required(fn):
     Returns:
         function: Wrapped function that enforces authentication
     """
-    import functools
     @functools.wraps(fn)
     def wrapper(*args, **kwargs):
         uid = session.get("user_id")
         if not uid:
             return redirect(url_for("login"))
-        # Verify the user still exists; if not, clear session.
-        db = SessionLocal()
-        try:
-            exists = db.query(User.id).filter(User.id == uid).first()
-        finally:
-            db.close()
-        if not exists:
-            session.clear()
-            return redirect(url_for("login"))
+        # Verify the user still exists; if not, clear session. The (signed) session
+        # remembers the last check so 1.5s pollers don't hit the users table each time.
+        now = int(time.time())
+        if now - session.get("user_checked_at", 0) >= USER_RECHECK_SECONDS:
+            db = SessionLocal()
+            try:
+                exists = db.query(User.id).filter(User.id == uid).first()
+            finally:
+                db.close()
+            if not exists:
+                session.clear()
+                return redirect(url_for("login"))
+            session["user_checked_at"] = now
         return fn(*args, **kwargs)
     return wrapper
 # -----------------------------------------------------------------------------
@@ -279,20 +410,35 @@ if not OPENAI_API_KEY:
 CHAT_MODEL = os.environ.get("CHAT_MODEL", "gpt-4.1-mini")
 COMPRESSION_MODEL = os.environ.get("COMPRESSION_MODEL", os.environ.get("OPENAI_MODEL", "gpt-4.1-mini"))
 EMBED_MODEL = os.environ.get("EMBED_MODEL", "text-embedding-3-small")
+EMBED_DIM = int(os.environ.get("EMBED_DIM", "1536"))  # text-embedding-3-small
 # Context budgeting aligned to local scripts
 MODEL_CONTEXT_TOKENS = int(os.environ.get("MODEL_CONTEXT_TOKENS", "128000"))  # ~4o-mini window
 DEFAULT_CHUNK_TOKENS = int(os.environ.get("DEFAULT_CHUNK_TOKENS", "30000"))   # compress_text.py default
 RESERVED_TOKENS = int(os.environ.get("RESERVED_TOKENS", "4000"))              # compress step overhead
 MAX_OUTPUT_TOKENS = int(os.environ.get("MAX_OUTPUT_TOKENS", "1500"))          # legacy cap; dynamic per-chunk below
 CHAT_CONTEXT_TOKENS = int(os.environ.get("CHAT_CONTEXT_TOKENS", "120000"))    # chat-side context budget
+STUDY_CONTEXT_TOKENS = int(os.environ.get("STUDY_CONTEXT_TOKENS", "30000"))   # practice test / flashcards corpus cap
 MAX_CONTEXT_CHARS = int(os.environ.get("MAX_CONTEXT_CHARS", "180000"))
 RETRIEVAL_CHUNK_TOKENS = int(os.environ.get("RETRIEVAL_CHUNK_TOKENS", "1200"))  # embedding chunk size
+EMBED_MIN_CHUNK_TOKENS = int(os.environ.get("EMBED_MIN_CHUNK_TOKENS", "20"))    # shorter tails merge into the previous chunk
 TOP_K = int(os.environ.get("TOP_K", "12"))
 CHAT_COMPLETIONS_URL = "https://api.openai.com/v1/chat/completions"
 EMBEDDINGS_URL = "https://api.openai.com/v1/embeddings"
 SUMMARIZE_CHUNK_TOKENS = int(os.environ.get("SUMMARIZE_CHUNK_TOKENS", "110000"))
 SUMMARIZE_MAX_OUTPUT_TOKENS = int(os.environ.get("SUMMARIZE_MAX_OUTPUT_TOKENS", "16000"))
 STREAM_OUT_DIR = os.environ.get("STREAM_OUT_DIR", "stream_out")
+# Internal nginx location aliased to STREAM_OUT_DIR; when set, downloads are handed off via X-Accel-Redirect
+STREAM_ACCEL_PREFIX = os.environ.get("STREAM_ACCEL_PREFIX", "")
+ANN_MIN_ROWS = int(os.environ.get("ANN_MIN_ROWS", "5000"))        # reused matrices this big get a FAISS index
+HNSW_MIN_ROWS = int(os.environ.get("HNSW_MIN_ROWS", "100000"))    # below this, exact IndexFlatIP
+# Keep cached extension RAG matrices as int8 (x127) when SimSIMD's int8 kernels are available
+EMBED_INT8 = os.environ.get("EMBED_INT8", "1") == "1"
+OPENAI_ASYNC_CONCURRENCY = int(os.environ.get("OPENAI_ASYNC_CONCURRENCY", "8"))    # in-flight async chat calls
+COMPRESS_BLOCK_TOKENS = int(os.environ.get("COMPRESS_BLOCK_TOKENS", "100000"))      # input tokens per compression request
+COURSE_CONCURRENCY = int(os.environ.get("COURSE_CONCURRENCY", "4"))                # courses compressed in parallel
+COMPRESS_API_CONCURRENCY = int(os.environ.get("COMPRESS_API_CONCURRENCY", "4"))    # in-flight compression calls
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "chanvas", "llm_cache"))
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", str(24 * 3600)))              # seconds; 0 disables
 def _stream_file_path(user_id: int, job_id: str) -> str:
     """
     Generate the file path for storing streaming output from a job.
@@ -307,9 +453,29 @@ def _stream_file_path(user_id: int, job_id: str) -> str:
     Returns:
         str: Full path to the stream output file
     """
-    out_dir = os.path.abspath(STREAM_OUT_DIR)
-    os.makedirs(out_dir, exist_ok=True)
-    return os.path.join(out_dir, f"stream_{user_id}_{job_id}.txt")
+    return os.path.join(_ensure_dir(STREAM_OUT_DIR), f"stream_{user_id}_{job_id}.txt")
+
+# (user_id, job_id) pairs whose stream file is known to exist; stream files are never
+# deleted, so a positive answer stays valid and the dashboard can skip the stat
+_STREAM_READY: "OrderedDict[Tuple[int, str], None]" = OrderedDict()
+_STREAM_READY_MAX = 4096
+_STREAM_READY_LOCK = threading.Lock()
+
+def _stream_file_ready(user_id: int, job_id: str) -> bool:
+    """
+    Return True once a job's stream file exists (positive results are cached).
+    """
+    key = (user_id, job_id)
+    with _STREAM_READY_LOCK:
+        if key in _STREAM_READY:
+            return True
+    if not os.path.exists(_stream_file_path(user_id, job_id)):
+        return False
+    with _STREAM_READY_LOCK:
+        _STREAM_READY[key] = None
+        while len(_STREAM_READY) > _STREAM_READY_MAX:
+            _STREAM_READY.popitem(last=False)
+    return True
 # Live scrape stream (distinct from logs and compressed stream)
 SCRAPE_STREAM_DIR = os.environ.get("SCRAPE_STREAM_DIR", "scrape_stream")
 
@@ -331,6 +497,33 @@ def _scrape_stream_file_path(user_id: int, job_id: str) -> str:
     os.makedirs(out_dir, exist_ok=True)
     return os.path.join(out_dir, f"scrape_{user_id}_{job_id}.txt")
 
+def _atomic_write_text(path: str, text: str, fsync: bool = True) -> None:
+    """
+    Replace a file's contents atomically.
+
+    Writes to a temp file in the same directory, optionally fsyncs it, then
+    os.replace()s it over `path`, so a crash never leaves a truncated file and
+    concurrent readers always see either the old or the new contents.
+
+    Args:
+        path (str): Destination file path
+        text (str): Full file contents
+        fsync (bool): Force the temp file to disk before the rename (default: True)
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp",
+                                    dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        with contextlib.suppress(Exception):
+            os.remove(tmp_path)
+        raise
+
 def _append_scrape_stream_file(path: str, text: str) -> None:
     """
     Append text to a scrape stream file with immediate disk flush.
@@ -369,6 +562,36 @@ def _session_dir(user_id: int) -> str:
     os.makedirs(d, exist_ok=True)
     return d
 
+# user_id -> (session dir mtime_ns, non-empty?); entries only change when the dir's mtime does
+_SESSION_CACHE: Dict[int, Tuple[int, bool]] = {}
+
+def _has_warm_session(user_id: int) -> bool:
+    """
+    Check whether a user's persistent session directory has any entries.
+
+    Re-lists the directory only when its mtime changed since the last check,
+    so steady-state scheduler passes cost a single stat().
+
+    Args:
+        user_id (int): The user's unique identifier
+
+    Returns:
+        bool: True if a saved session/profile is present
+    """
+    sess_dir = os.path.join(os.path.abspath(SESSION_ROOT), f"user_{user_id}")
+    try:
+        mtime = os.stat(sess_dir).st_mtime_ns
+    except OSError:
+        _SESSION_CACHE.pop(user_id, None)
+        return False
+    cached = _SESSION_CACHE.get(user_id)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with os.scandir(sess_dir) as it:
+        has = any(True for _ in it)
+    _SESSION_CACHE[user_id] = (mtime, has)
+    return has
+
 def _copytree(src: str, dst: str):
     """
     Recursively copy a directory tree with Python <3.8 compatibility.
@@ -416,8 +639,18 @@ def _persist_session(tmp_root: str, dest: str):
     except Exception as e:
         log_exception("_persist_session", e)
 
+@functools.lru_cache(maxsize=None)
+def _ensure_dir(path: str) -> str:
+    """
+    Create a directory once per process and return its absolute path.
+    """
+    out_dir = os.path.abspath(path)
+    os.makedirs(out_dir, exist_ok=True)
+    return out_dir
+
 # File-based job logs (one file per job)
 JOB_LOG_DIR = os.environ.get("JOB_LOG_DIR", "job_logs")
+JOB_LOG_TAIL_BYTES = int(os.environ.get("JOB_LOG_TAIL_BYTES", "262144"))  # max new log bytes per /job_state poll
 def _job_log_path(job_id: str) -> str:
     """
     Generate the file path for a job's log file.
@@ -431,9 +664,27 @@ def _job_log_path(job_id: str) -> str:
     Returns:
         str: Full path to the job's log file
     """
-    out_dir = os.path.abspath(JOB_LOG_DIR)
-    os.makedirs(out_dir, exist_ok=True)
-    return os.path.join(out_dir, f"job_{job_id}.log")
+    return os.path.join(_ensure_dir(JOB_LOG_DIR), f"job_{job_id}.log")
+
+def _format_job_log_line(message: str) -> str:
+    """
+    Prefix a log message with the current UTC time, as written to job log files.
+    """
+    ts = datetime.datetime.utcnow().strftime("%H:%M:%S")
+    return f"{ts} {message}\n"
+
+def _append_job_log_lines(job_id: str, lines: List[str]):
+    """
+    Append already-formatted lines to a job's log file with a single write.
+
+    Args:
+        job_id (str): The unique job identifier
+        lines (List[str]): Lines from _format_job_log_line()
+    """
+    if not lines:
+        return
+    with open(_job_log_path(job_id), "a", encoding="utf-8") as f:
+        f.writelines(lines)
 
 def _append_job_log_file(job_id: str, message: str):
     """
@@ -446,13 +697,77 @@ def _append_job_log_file(job_id: str, message: str):
         job_id (str): The unique job identifier
         message (str): The log message to append
     """
-    ts = datetime.datetime.utcnow().strftime("%H:%M:%S")
-    line = f"{ts} {message}\n"
-    with open(_job_log_path(job_id), "a", encoding="utf-8") as f:
-        f.write(line)
+    _append_job_log_lines(job_id, [_format_job_log_line(message)])
+
+def _read_job_log(job_id: str, legacy_log: Optional[str] = None) -> str:
+    """
+    Read a job's log file, falling back to the legacy Job.log column.
+
+    Args:
+        job_id (str): The unique job identifier
+        legacy_log (Optional[str]): Job.log value for jobs logged before file logs
+
+    Returns:
+        str: The job's log text
+    """
+    try:
+        with open(_job_log_path(job_id), "r", encoding="utf-8", errors="ignore") as f:
+            return f.read()
+    except Exception:
+        return sanitize_db_text(legacy_log or "")
+
+
+def _utf8_complete_len(data: bytes) -> int:
+    """
+    Length of the longest prefix of data that doesn't end partway through a UTF-8 sequence.
+    """
+    n = len(data)
+    for back in range(1, min(4, n) + 1):
+        b = data[n - back]
+        if b & 0xC0 != 0x80:  # ASCII or lead byte: how long is its sequence?
+            need = 1 if b < 0x80 else 2 if b < 0xE0 else 3 if b < 0xF0 else 4
+            return n if back >= need else n - back
+    return n
+
+
+def _read_job_log_since(job_id: str, since: int = 0, limit: Optional[int] = None) -> Optional[Tuple[str, int, int]]:
+    """
+    Read a job's log file from a byte offset, for pollers that append deltas.
+
+    Job logs are append-only, so a client that remembers the returned offset only
+    ever fetches new bytes. A window cut by `limit` ends at the last complete line,
+    and no window ends inside a multi-byte UTF-8 character.
+
+    Args:
+        job_id (str): The unique job identifier
+        since (int): Byte offset the caller has already seen (past-EOF restarts at 0)
+        limit (Optional[int]): Max bytes to read, or None for everything
+
+    Returns:
+        Optional[Tuple[str, int, int]]: (text, next offset, file size), or None when
+        the job has no log file (legacy Job.log rows)
+    """
+    try:
+        with open(_job_log_path(job_id), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if since < 0 or since > size:
+                since = 0
+            f.seek(since)
+            data = f.read(-1 if limit is None else limit)
+    except OSError:
+        return None
+    if limit is not None and since + len(data) < size:
+        cut = data.rfind(b"\n")
+        if cut >= 0:
+            data = data[:cut + 1]
+    # Never stop inside a UTF-8 sequence (a newline-free window, or a line still being
+    # written); the split bytes are re-read whole by the next poll instead of dropped
+    data = data[:_utf8_complete_len(data)]
+    return data.decode("utf-8", errors="ignore"), since + len(data), size
 # -----------------------------------------------------------------------------
 # Token helpers (ported from local)
 # -----------------------------------------------------------------------------
+@functools.lru_cache(maxsize=None)
 def get_encoder(model: str):
     """
     Get the appropriate tokenizer encoder for a given model.
@@ -465,6 +780,7 @@ def get_encoder(model: str):
 
     Returns:
         tiktoken.Encoding or None: The tokenizer encoder, or None if unavailable
+        (cached per model so repeated lookups are free)
     """
     if tiktoken is None:
         return None
@@ -568,6 +884,16 @@ def truncate_to_tokens(text: str, max_tokens: int, model: str) -> str:
 # -----------------------------------------------------------------------------
 # OpenAI helpers (shape-robust like local)
 # -----------------------------------------------------------------------------
+# One pooled keep-alive session for all OpenAI calls so worker threads reuse
+# TLS connections. Pool is sized above COURSE_CONCURRENCY/COMPRESS_API_CONCURRENCY.
+# Adapter retries cover connection errors; HTTP status retries for POST stay in
+# openai_chat's own backoff loop (urllib3 does not retry POST on status).
+_HTTP_SESSION = requests.Session()
+_HTTP_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+))
 def _flatten_blocks(x) -> str:
     """
     Recursively extract text content from nested data structures.
@@ -659,11 +985,11 @@ def openai_chat(payload: dict, timeout: int = 180) -> str:
     backoff = 2.0
     for attempt in range(1, 6):
         try:
-            resp = requests.post(CHAT_COMPLETIONS_URL, headers=headers, json=payload, timeout=timeout)
+            resp = _HTTP_SESSION.post(CHAT_COMPLETIONS_URL, headers=headers, json=payload, timeout=timeout)
             if resp.status_code == 400:
                 logger.warning("400 from API: %s", resp.text[:400])
             resp.raise_for_status()
-            data = resp.json()
+            data = _json_loads(resp.content)
             txt = extract_assistant_text(data)
             return txt.strip() if txt else "[No content returned]"
         except requests.exceptions.HTTPError as e:
@@ -680,32 +1006,201 @@ def openai_chat(payload: dict, timeout: int = 180) -> str:
                 continue
             raise
 
-        except requests.exceptions.RequestException:
+        except (requests.exceptions.RequestException, ValueError):
+            # ValueError: truncated/malformed JSON body (resp.json() raised a RequestException here)
             time.sleep(backoff)
             backoff = min(30.0, backoff * 1.7)
     return "[Error: retries exhausted]"
-def openai_embed(texts: List[str]) -> List[List[float]]:
+def openai_chat_stream(payload: dict, timeout: int = 180):
     """
-    Generate embeddings for a list of texts using OpenAI's embeddings API.
+    Stream a chat completion, yielding text deltas as they arrive.
 
-    Sends text to OpenAI's embeddings endpoint and returns the vector
-    representations for similarity search and retrieval.
+    Retries 429/5xx (with the same backoff as openai_chat) only before the
+    first delta; once text has been yielded, errors propagate to the caller.
 
     Args:
-        texts (List[str]): List of text strings to embed
+        payload (dict): The request payload for the OpenAI API (stream is forced on)
+        timeout (int): Connect/read timeout in seconds (default: 180)
+
+    Yields:
+        str: Successive pieces of the assistant's reply
+    """
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+    body = dict(payload, stream=True)
+    backoff = 2.0
+    for attempt in range(1, 6):
+        resp = _HTTP_SESSION.post(CHAT_COMPLETIONS_URL, headers=headers, json=body, timeout=timeout, stream=True)
+        if resp.status_code in (429, 500, 502, 503, 504) and attempt < 5:
+            resp.close()
+            time.sleep(backoff)
+            backoff = min(30.0, backoff * 1.7)
+            continue
+        if resp.status_code == 400:
+            logger.warning("400 from API: %s", resp.text[:400])
+        resp.raise_for_status()
+        break
+    with resp:
+        for line in resp.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            data = line[6:]
+            if data == b"[DONE]":
+                break
+            choices = _json_loads(data).get("choices") or []
+            delta = (choices[0].get("delta") or {}).get("content") if choices else None
+            if delta:
+                yield delta
+async def openai_chat_async(client: "httpx.AsyncClient", payload: dict, timeout: int = 180) -> str:
+    """
+    Async counterpart of openai_chat() for fan-out pipelines.
+
+    Same endpoint, response extraction and retry/backoff policy as openai_chat(),
+    but sends the request through a shared httpx.AsyncClient.
+
+    Args:
+        client (httpx.AsyncClient): Client whose connection pool is reused
+        payload (dict): The request payload for the OpenAI API
+        timeout (int): Request timeout in seconds (default: 180)
 
     Returns:
-        List[List[float]]: List of embedding vectors, one per input text
+        str: The extracted response text, or error message on failure
+    """
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+    backoff = 2.0
+    for attempt in range(1, 6):
+        try:
+            resp = await client.post(CHAT_COMPLETIONS_URL, headers=headers, json=payload, timeout=timeout)
+            if resp.status_code == 400:
+                logger.warning("400 from API: %s", resp.text[:400])
+            resp.raise_for_status()
+            data = _json_loads(resp.content)
+            txt = extract_assistant_text(data)
+            return txt.strip() if txt else "[No content returned]"
+        except httpx.HTTPStatusError as e:
+            code = e.response.status_code
+            body = ""
+            try:
+                body = e.response.text[:800]
+            except Exception:
+                pass
+            logger.error("OpenAI API HTTP %s: %s", code, body)
+            if code in (429, 500, 502, 503, 504):
+                await asyncio.sleep(backoff)
+                backoff = min(30.0, backoff * 1.7)
+                continue
+            raise
+        except httpx.TransportError:
+            await asyncio.sleep(backoff)
+            backoff = min(30.0, backoff * 1.7)
+    return "[Error: retries exhausted]"
 
-    Raises:
-        RuntimeError: If the number of returned embeddings doesn't match input
-        requests.HTTPError: If the API request fails
+async def _openai_chat_many_async(payloads: List[dict]) -> List[str]:
+    """
+    Run chat payloads concurrently and return outputs in payload order.
+
+    Used for the small independent fan-outs (class-list chunks in
+    extract_classes_list, test + flashcards in generate_bundle). In-flight
+    requests are capped by OPENAI_ASYNC_CONCURRENCY.
+    """
+    sem = asyncio.Semaphore(max(1, OPENAI_ASYNC_CONCURRENCY))
+
+    async def _one(client, payload):
+        async with sem:
+            return (await openai_chat_async(client, payload)).strip()
+
+    limits = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+    async with httpx.AsyncClient(limits=limits) as client:
+        return await asyncio.gather(*[_one(client, p) for p in payloads])
+
+# Embedding cache: in-process LRU in front of the embedding_cache table, keyed by sha256(model, text)
+EMBED_BATCH = int(os.environ.get("EMBED_BATCH", "512"))        # inputs per embeddings request (API max 2048)
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "4"))  # embeddings requests in flight per call
+_EMBED_MEMO: "OrderedDict[str, List[float]]" = OrderedDict()
+_EMBED_MEMO_MAX = 4096
+_EMBED_MEMO_LOCK = threading.Lock()
+EMBED_CACHE_MAX_AGE_DAYS = int(os.environ.get("EMBED_CACHE_MAX_AGE_DAYS", "30"))  # embedding_cache row lifetime; 0 keeps forever
+_EMBED_CACHE_PRUNE_SECS = 3600  # at most one age sweep per process per hour
+_embed_cache_pruned_at = 0.0
+def _embed_cache_key(text: str) -> str:
+    return hashlib.sha256(f"{EMBED_MODEL}\x00{text}".encode("utf-8", "ignore")).hexdigest()
+def _embed_memo_put(items: Dict[str, List[float]]):
+    with _EMBED_MEMO_LOCK:
+        for key, vec in items.items():
+            _EMBED_MEMO[key] = vec
+            _EMBED_MEMO.move_to_end(key)
+        while len(_EMBED_MEMO) > _EMBED_MEMO_MAX:
+            _EMBED_MEMO.popitem(last=False)
+def _embed_cache_load(keys: List[str]) -> Dict[str, List[float]]:
+    """
+    Fetch cached vectors for the given keys from the embedding_cache table.
+    """
+    found: Dict[str, List[float]] = {}
+    stmt = sql_text("SELECT key, embedding FROM embedding_cache WHERE key IN :keys").bindparams(
+        bindparam("keys", expanding=True))
+    try:
+        with engine.connect() as conn:
+            for start in range(0, len(keys), 500):
+                for key, stored in conn.execute(stmt, {"keys": keys[start:start + 500]}):
+                    found[key] = _decode_embedding(stored).tolist()
+    except Exception as e:
+        log_exception("embed_cache_load", e)
+    return found
+def _embed_cache_store(items: Dict[str, List[float]]):
+    """
+    Persist new vectors to the embedding_cache table (existing keys are left alone).
+    """
+    if not items:
+        return
+    now = datetime.datetime.utcnow()
+    params = [{"key": k, "emb": _encode_embedding(v), "now": now} for k, v in items.items()]
+    try:
+        with engine.begin() as conn:
+            conn.execute(sql_text("""
+                INSERT INTO embedding_cache (key, embedding, created_at)
+                VALUES (:key, :emb, :now)
+                ON CONFLICT (key) DO NOTHING
+            """), params)
+    except Exception as e:
+        log_exception("embed_cache_store", e)
+    _embed_cache_prune()
+def _embed_cache_prune():
+    """
+    Delete embedding_cache rows older than EMBED_CACHE_MAX_AGE_DAYS (throttled to one sweep per hour).
+    """
+    global _embed_cache_pruned_at
+    if EMBED_CACHE_MAX_AGE_DAYS <= 0:
+        return
+    now = time.time()
+    with _EMBED_MEMO_LOCK:
+        if now - _embed_cache_pruned_at < _EMBED_CACHE_PRUNE_SECS:
+            return
+        _embed_cache_pruned_at = now
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=EMBED_CACHE_MAX_AGE_DAYS)
+    try:
+        with engine.begin() as conn:
+            conn.execute(sql_text("DELETE FROM embedding_cache WHERE created_at < :cutoff"), {"cutoff": cutoff})
+    except Exception as e:
+        log_exception("embed_cache_prune", e)
+def _openai_embed_batch(texts: List[str]) -> List[List[float]]:
+    """
+    One embeddings API request for up to EMBED_BATCH texts (no caching).
+
+    Retries 429s with exponential backoff (honoring Retry-After); the shared
+    session's urllib3 retries don't cover POST.
     """
     headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
     payload = {"model": EMBED_MODEL, "input": texts}
-    resp = requests.post(EMBEDDINGS_URL, headers=headers, json=payload, timeout=120)
+    for attempt in range(5):
+        resp = _HTTP_SESSION.post(EMBEDDINGS_URL, headers=headers, json=payload, timeout=120)
+        if resp.status_code != 429:
+            break
+        try:
+            delay = float(resp.headers.get("Retry-After", ""))
+        except ValueError:
+            delay = 0.5 * (2 ** attempt)
+        time.sleep(min(delay, 20.0))
     resp.raise_for_status()
-    data = resp.json()
+    data = _json_loads(resp.content)
     vectors = []
     for item in data.get("data", []):
         vec = item.get("embedding", [])
@@ -713,6 +1208,56 @@ def openai_embed(texts: List[str]) -> List[List[float]]:
     if len(vectors) != len(texts):
         raise RuntimeError("Embedding count mismatch: got %d for %d texts" % (len(vectors), len(texts)))
     return vectors
+def openai_embed(texts: List[str]) -> List[List[float]]:
+    """
+    Generate embeddings for a list of texts using OpenAI's embeddings API.
+
+    Sends text to OpenAI's embeddings endpoint and returns the vector
+    representations for similarity search and retrieval. Vectors are looked
+    up in the in-process LRU, then the embedding_cache table; only misses
+    (deduplicated) go to the API, in batches of EMBED_BATCH.
+
+    Args:
+        texts (List[str]): List of text strings to embed
+
+    Returns:
+        List[List[float]]: List of embedding vectors, one per input text
+
+    Raises:
+        RuntimeError: If the number of returned embeddings doesn't match input
+        requests.HTTPError: If the API request fails
+    """
+    keys = [_embed_cache_key(t) for t in texts]
+    found: Dict[str, List[float]] = {}
+    with _EMBED_MEMO_LOCK:
+        for key in keys:
+            vec = _EMBED_MEMO.get(key)
+            if vec is not None:
+                found[key] = vec
+    missing = [k for k in dict.fromkeys(keys) if k not in found]
+    if missing:
+        from_db = _embed_cache_load(missing)
+        found.update(from_db)
+        _embed_memo_put(from_db)
+    # unique texts still without a vector, in first-seen order
+    todo = {k: t for k, t in zip(keys, texts) if k not in found}
+    if todo:
+        todo_keys = list(todo)
+        batches = [todo_keys[s:s + EMBED_BATCH] for s in range(0, len(todo_keys), EMBED_BATCH)]
+        fresh: Dict[str, List[float]] = {}
+        if len(batches) == 1:
+            fresh.update(zip(batches[0], _openai_embed_batch([todo[k] for k in batches[0]])))
+        else:
+            # Requests are I/O-bound; keep a few in flight
+            with ThreadPoolExecutor(max_workers=max(1, min(EMBED_CONCURRENCY, len(batches))),
+                                    thread_name_prefix="embed") as pool:
+                results = pool.map(lambda b: _openai_embed_batch([todo[k] for k in b]), batches)
+                for batch, vectors in zip(batches, results):
+                    fresh.update(zip(batch, vectors))
+        _embed_cache_store(fresh)
+        _embed_memo_put(fresh)
+        found.update(fresh)
+    return [found[k] for k in keys]
 def progressive_summarize_corpus(raw: str, job_id: str, db, 
                                  chunk_tokens: int = SUMMARIZE_CHUNK_TOKENS, 
                                  max_out_tokens: int = SUMMARIZE_MAX_OUTPUT_TOKENS) -> str:
@@ -793,209 +1338,283 @@ def progressive_summarize_corpus(raw: str, job_id: str, db,
 # Compression (mirrors compress_text.py system+prompt and chunking)
 #   Updated: dynamic per-chunk budget to keep final <= CHAT_CONTEXT_TOKENS
 # -----------------------------------------------------------------------------
-def compress_raw_text(raw: str, logger_prefix: str = "") -> str:
-    if not raw.strip():
-        return ""
-    # Calculate token size of entire corpus
-    toks, enc = encode_text(raw, COMPRESSION_MODEL)
-    token_size_corpus = len(toks)
-    # Base threshold
-    MAX_CORPUS_TOKENS = 126000
-    # Calculate compression ratio
-    compression_ratio = 0.5
-    # Calculate chunk number (rounded up + 1)
-    import math
-    chunk_number = math.ceil(compression_ratio) + 1
-    # Calculate chunk input size
-    chunk_input_size = math.ceil(token_size_corpus / chunk_number)
-    # Calculate compression percentage for each chunk
-    compression_percentage_small = 1 / chunk_number
-    # Logging
-    logger.info(
-        f"{logger_prefix}Compression: total tokens={token_size_corpus}, chunk_number={chunk_number}, "
-        f"chunk_input_size={chunk_input_size}, compression_percentage={compression_percentage_small:.4f}"
-    )
-    compressed_out_parts = []
-    # System prompt for compression
-    system = (
-        "You are a high-fidelity cleaner for Canvas course materials. "
-        f"Compress the input text segment down to approximately "
-        f"{int(compression_percentage_small * 100)}% of its original size, preserving important academic info such as times, grading policies, assignment problems, and crucial student info. "
-        "For notes or less critical info, higher compression is allowed. Label the class at the start of the output."
-        "Summarize the following course materials (Just because the beginning of the block you're summarizing starts with a particular course, doesn't mean it will end with it. Keep in mind that if the course information changes to a different course mid-way, you need to output a second course description for the information summarized for that course.) into a compact but detailed brief that preserves:\n"
-            "- exact problem set questions and subparts when present\n"
-            "- schedules, due dates, times, locations, exam windows\n"
-            "- grading breakdowns, late policies, and rubrics\n"
-            "- instructor/TAs, contact info, and office hours\n"
-            "- assignment instructions and submission requirements\n"
-            "- modules/units coverage and required readings\n"
-            "- announcements, policy changes, datasets/links\n\n"
-            "Keep technical notation and numbering; do not omit details that affect studying or deadlines. "
-            "Prefer bullet points and short paragraphs, and end with a brief checklist of actionable next steps.\n\n"
-            "For each block you're summarizing, detect which class it's most relevant to, and at the top of your summary you should output 'The user is enrolled in the following class:' along with the class number and name. then say you're starting the summary for that class.\n"
-            "At the end of your summary you should say 'End of summary for the class that the user is enrolled in,' and then the class name slash number."
-            "Text to summarize:\n"
-
-    )
-    # Process each chunk
-    for i in range(chunk_number):
-        start = i * chunk_input_size
-        end = min(token_size_corpus, (i + 1) * chunk_input_size)
-        chunk_tokens = toks[start:end]
-        chunk_text = decode_tokens(chunk_tokens, enc)
-        if not chunk_text.strip():
-            continue
-        # User message for compression
-        user_msg = (
-            f"Compress the following raw scrape segment as specified, targeting approximately "
-            f"{int(compression_percentage_small * 100)}% of the original tokens. "
-            f"Preserve all problem sets with questions, times, grading, instructors, and assignment details. "
-            "Summarize the following course materials (Just because the beginning of the block you're summarizing starts with a particular course, doesn't mean it will end with it. Keep in mind that if the course information changes to a different course mid-way, you need to output a second course description for the information summarized for that course.) into a compact but detailed brief that preserves:\n"
-            "- exact problem set questions and subparts when present\n"
-            "- schedules, due dates, times, locations, exam windows\n"
-            "- grading breakdowns, late policies, and rubrics\n"
-            "- instructor/TAs, contact info, and office hours\n"
-            "- assignment instructions and submission requirements\n"
-            "- modules/units coverage and required readings\n"
-            "- announcements, policy changes, datasets/links\n\n"
-            "Keep technical notation and numbering; do not omit details that affect studying or deadlines. "
-            "Prefer bullet points and short paragraphs, and end with a brief checklist of actionable next steps.\n\n"
-            "For each block you're summarizing, detect which class it's most relevant to, and at the top of your summary you should output 'The user is enrolled in the following class:' along with the class number and name. then say you're starting the summary for that class.\n"
-            "At the end of your summary you should say 'End of summary for the class that the user is enrolled in,' and then the class name slash number."
-            "Text to summarize:\n" +
-            chunk_text
-        )
-        # Create payload
-        payload = {
-            "model": COMPRESSION_MODEL,
-            "messages": [
-                {"role": "system", "content": system},
-                {"role": "user", "content": user_msg},
-            ],
-            "temperature": 0.0,
-            "max_tokens": min(16384, int(chunk_input_size * compression_percentage_small * 1.2)),  # Use model's actual max output limit
-        }
-        compressed_chunk = openai_chat(payload).strip()
-        # If output too long, re-run with explicit max length
-        try:
-            est_len = estimate_tokens(compressed_chunk, COMPRESSION_MODEL)
-        except Exception:
-            est_len = 0
-        max_out_tokens = int(chunk_input_size * compression_percentage_small * 1.2)
-        if est_len > max_out_tokens:
-            payload["messages"].append({
-                "role": "user",
-                "content": f"The previous output exceeded the max token limit. Rewrite it to at most {max_out_tokens} tokens while preserving all key content."
-            })
-            compressed_chunk = openai_chat(payload).strip()
-        compressed_out_parts.append(compressed_chunk)
-    # Join all compressed chunks
-    compressed = "\n".join(compressed_out_parts).strip()
-    # Optional final truncation (gate by env var)
-    if os.environ.get("COMPRESS_FINAL_TRUNCATE", "1") == "1":
-        final_token_count = estimate_tokens(compressed, CHAT_MODEL)
-        if final_token_count > MAX_CORPUS_TOKENS:
-            logger.info(f"{logger_prefix}Final compressed text over token budget, truncating to {MAX_CORPUS_TOKENS} tokens.")
-            compressed = truncate_to_tokens(compressed, MAX_CORPUS_TOKENS, CHAT_MODEL)
-    return compressed
-    
-def _split_stream_by_course(raw: str):
+def _fit_output_budget(payload: dict, text: str, max_out_tokens: int, sem=None) -> str:
     """
-    Returns a list of dicts:
-      {"course_id": "<id|GLOBAL>", "course_name": "<name|GLOBAL>", "text": "<segment>"}
-    Splits when:
-      - a different /courses/<id> URL is seen,
-      - or a '[log] [course done] <id>' line is seen.
-    Also captures the bracketed course label immediately before 'PAGE', e.g.:
-      ... [MATH 4220_5220 Complex Analysis _2025FA_] PAGE https://canvas.cornell.edu/courses/80348 ...
+    Bring a compressed chunk back within its output budget.
+
+    Output up to 15% over budget is kept as-is; up to 50% over is truncated
+    locally with the tokenizer; beyond that the model is asked once to rewrite
+    its own output. The original payload is never mutated.
+
+    Args:
+        payload (dict): The request payload that produced `text`
+        text (str): The model output to check
+        max_out_tokens (int): The output token budget
+        sem: Optional semaphore held around the re-ask API call
+
+    Returns:
+        str: Output within (or near) the budget
     """
-    parts = []
-    cur_id = None
-    cur_name = None
-    buf = []
+    try:
+        out_est = estimate_tokens(text, COMPRESSION_MODEL)
+    except Exception:
+        return text
+    if out_est <= max_out_tokens * 1.15:
+        return text
+    if out_est <= max_out_tokens * 1.5:
+        return truncate_to_tokens(text, max_out_tokens, COMPRESSION_MODEL)
+    retry = dict(payload)
+    retry["messages"] = list(payload["messages"]) + [
+        {"role": "assistant", "content": text},
+        {"role": "user", "content": f"The previous output exceeded the max token limit. Rewrite it to at most {max_out_tokens} tokens while preserving all key content."},
+    ]
+    with (sem or contextlib.nullcontext()):
+        return openai_chat(retry).strip()
 
-    course_url_re = re.compile(r"https?://[^\s)]+/courses/(\d+)")
-    course_done_re = re.compile(r"\[log\]\s*\[course done\]\s*(\d+)")
-    # capture the bracketed label that appears immediately before 'PAGE'
-    snippet_name_re = re.compile(r"\[([^\]]+?)\]\s+PAGE\s+https?://")
+_PARAGRAPH_SPLIT_RE = re.compile(r"\n[^\S\n]*\n")
 
-    for line in raw.splitlines():
-        # capture human-readable course label if present (the one right before 'PAGE')
-        mname = snippet_name_re.search(line)
-        if mname:
-            cur_name = mname.group(1).strip()
+def _dedup_paragraphs(text: str, window: int = 50_000) -> str:
+    """
+    Drop repeated paragraphs (Canvas nav menus, footers, syllabus links) before tokenizing.
+
+    Splits on blank lines and hashes each paragraph with an 8-byte BLAKE2b digest.
+    A paragraph is suppressed if the same digest was seen within the previous
+    `window` characters of input; every sighting refreshes the digest's position
+    so recurring boilerplate stays suppressed. Disable with COMPRESS_DEDUP=0.
+
+    Args:
+        text (str): The raw scrape text
+        window (int): Look-back distance in characters (default: 50,000)
+
+    Returns:
+        str: Text with duplicate paragraphs removed
+    """
+    if not text or os.environ.get("COMPRESS_DEDUP", "1") != "1":
+        return text
+    seen: "OrderedDict[bytes, int]" = OrderedDict()  # digest -> last offset seen
+    out = []
+    pos = 0
+    for p in _PARAGRAPH_SPLIT_RE.split(text):
+        stripped = p.strip()
+        if stripped:
+            h = hashlib.blake2b(stripped.encode("utf-8"), digest_size=8).digest()
+            while seen and next(iter(seen.values())) < pos - window:
+                seen.popitem(last=False)
+            dup = h in seen
+            seen[h] = pos
+            seen.move_to_end(h)
+            if not dup:
+                out.append(p)
+        pos += len(p) + 2
+    return "\n\n".join(out)
+
+# Course boundary markers in the live scrape stream, folded into one pattern so
+# the whole buffer is scanned once. Whitespace classes exclude "\n" so every
+# match stays on a single line, and the label alternative only looks ahead at
+# the URL so the URL alternative can still match it.
+_COURSE_STREAM_RE = re.compile(
+    r"\[(?P<name>[^\]\n]+?)\][^\S\n]+PAGE[^\S\n]+(?=https?://)"
+    r"|https?://[^\s)]+/courses/(?P<cid>\d+)"
+    r"|\[log\][^\S\n]*\[course done\][^\S\n]*(?P<dcid>\d+)"
+)
+
+def _course_marker_lines(raw: str):
+    """
+    Yield (line_start, line_end, name, cid, dcid) for each line of `raw` holding
+    at least one course marker. Only the first match of each kind per line is
+    kept, mirroring a per-line re.search.
+    """
+    line_start = line_end = -1
+    name = cid = dcid = None
+    for m in _COURSE_STREAM_RE.finditer(raw):
+        pos = m.start()
+        if pos > line_end:
+            if line_start >= 0:
+                yield line_start, line_end, name, cid, dcid
+            line_start = raw.rfind("\n", 0, pos) + 1
+            line_end = raw.find("\n", pos)
+            if line_end == -1:
+                line_end = len(raw)
+            name = cid = dcid = None
+        if name is None and m.group("name") is not None:
+            name = m.group("name")
+        elif cid is None and m.group("cid") is not None:
+            cid = m.group("cid")
+        elif dcid is None and m.group("dcid") is not None:
+            dcid = m.group("dcid")
+    if line_start >= 0:
+        yield line_start, line_end, name, cid, dcid
+
+def _split_stream_by_course(raw: str):
+    """
+    Returns a list of dicts:
+      {"course_id": "<id|GLOBAL>", "course_name": "<name|GLOBAL>", "text": "<segment>"}
+    Splits when:
+      - a different /courses/<id> URL is seen,
+      - or a '[log] [course done] <id>' line is seen.
+    Also captures the bracketed course label immediately before 'PAGE', e.g.:
+      ... [MATH 4220_5220 Complex Analysis _2025FA_] PAGE https://canvas.cornell.edu/courses/80348 ...
+    Segments are sliced straight out of `raw` at line boundaries of marker hits.
+    """
+    parts = []
+    cur_id = None
+    cur_name = None
+    seg_start = 0
+
+    for line_start, line_end, name, cid, dcid in _course_marker_lines(raw):
+        # capture human-readable course label if present (the one right before 'PAGE')
+        if name is not None:
+            cur_name = name.strip()
 
         # detect course id from URL
-        mid = course_url_re.search(line)
-        if mid:
-            cid = mid.group(1)
+        if cid is not None:
             if cur_id is None:
                 cur_id = cid
             elif cid != cur_id:
                 # flush previous course segment on course switch
-                if buf:
+                if line_start > seg_start:
                     parts.append({
                         "course_id": cur_id,
                         "course_name": cur_name or f"course {cur_id}",
-                        "text": "\n".join(buf).strip()
+                        "text": raw[seg_start:line_start].strip()
                     })
-                    buf = []
+                    seg_start = line_start
                 cur_id = cid
 
-        # accumulate
-        buf.append(line)
-
-        # explicit course end marker in logs
-        mdone = course_done_re.search(line)
-        if mdone and cur_id and mdone.group(1) == cur_id:
+        # explicit course end marker in logs (segment includes the marker line)
+        if dcid is not None and cur_id and dcid == cur_id:
             parts.append({
                 "course_id": cur_id,
                 "course_name": cur_name or f"course {cur_id}",
-                "text": "\n".join(buf).strip()
+                "text": raw[seg_start:line_end].strip()
             })
-            buf = []
+            seg_start = line_end + 1
             cur_id = None
             cur_name = None
 
     # flush trailing buffer
-    if buf:
+    if seg_start < len(raw):
         parts.append({
             "course_id": cur_id or "GLOBAL",
             "course_name": cur_name or "GLOBAL",
-            "text": "\n".join(buf).strip()
+            "text": raw[seg_start:].strip()
         })
     return parts
 
+# Caps concurrent compression requests across all course workers (rate limits)
+_COMPRESS_API_SEM = threading.BoundedSemaphore(max(1, COMPRESS_API_CONCURRENCY))
+
+def _seg_tok_cache_path(user_id: int, job_id: str) -> str:
+    """
+    Generate the file path for a job's segment token-count cache.
+
+    The sidecar is a JSON-lines log keyed by "<course_id>:<sha256 of segment
+    text>": one record per segment token count and one per compressed block,
+    so a retried or resumed job can skip tokenization and API calls for
+    unchanged segments. It is deleted once the job's compression completes.
+
+    Args:
+        user_id (int): The ID of the user running the job
+        job_id (str): The unique job identifier
+
+    Returns:
+        str: Full path to the cache file
+    """
+    out_dir = os.path.abspath(STREAM_OUT_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    return os.path.join(out_dir, f"tok_cache_{user_id}_{job_id}.jsonl")
+
+def _load_seg_tok_cache(path: str) -> dict:
+    """
+    Load a segment token-count cache into {key: {"tokens": n, "blocks": {...}}},
+    returning an empty dict if it is missing. Unparseable lines (e.g. a record
+    torn by a crash mid-append) are skipped.
+    """
+    cache = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(rec, dict) or not isinstance(rec.get("key"), str):
+                    continue
+                entry = cache.setdefault(rec["key"], {"tokens": None, "blocks": {}})
+                if isinstance(rec.get("tokens"), int):
+                    entry["tokens"] = rec["tokens"]
+                elif isinstance(rec.get("block"), str) and isinstance(rec.get("text"), str):
+                    entry["blocks"][rec["block"]] = rec["text"]
+    except Exception:
+        return {}
+    return cache
+
+def _append_seg_tok_cache(path: str, records: List[dict]) -> None:
+    """
+    Append records to a segment token-count cache, one JSON object per line,
+    so each finished block costs a single small write. Failures are non-fatal.
+    """
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            for rec in records:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            f.flush()
+    except Exception as e:
+        log_exception("_append_seg_tok_cache", e)
+
 def stream_compress_corpus_blocks(raw: str, user_id: int, job_id: str, db=None,
-                                  block_tokens: int = 20000,
+                                  block_tokens: int = COMPRESS_BLOCK_TOKENS,
                                   target_ratio: float = 0.5) -> str:
     """
     Course-aware streaming compression:
       - First split the live stream by Canvas course boundaries (URL /courses/<id> and [log] markers).
       - Compute a single global target ratio from total tokens across all courses (to cap ~126k).
-      - Compress each course segment independently in ~block_tokens chunks, writing sequentially to the same stream file.
+      - Compress each course segment independently in ~block_tokens chunks (halved as needed to fit
+        the context window together with the prompt and output budget). Courses run concurrently
+        (COURSE_CONCURRENCY) into per-course temp files that are appended to the stream file in order;
+        in-flight API calls are capped by COMPRESS_API_CONCURRENCY.
+      - Token counts and finished blocks are cached per job (see _seg_tok_cache_path) so retries skip repeated work.
     Returns the absolute path to the stream file.
     """
-    # Prepare output file (truncate if exists)
+    # Prepare output file (atomically replace any previous contents)
     stream_path = _stream_file_path(user_id, job_id)
-    with open(stream_path, "w", encoding="utf-8") as f:
-        f.write("")
+    _atomic_write_text(stream_path, "")
 
-    # Split by course
+    # Split by course, then drop repeated boilerplate within each course
     segments = _split_stream_by_course(raw)  # [{"course_id","course_name","text"}]
     if not segments:
         return stream_path
+    before = sum(len(seg["text"]) for seg in segments)
+    for seg in segments:
+        seg["text"] = _dedup_paragraphs(seg["text"])
+    after = sum(len(seg["text"]) for seg in segments)
+    if db is not None:
+        _update_job(db, job_id, log_line=f"Deduplicated course text: {before} -> {after} chars")
 
-    # Tokenize all segments to compute a global ratio
+    # Tokenize all segments to compute a global ratio; unchanged segments reuse
+    # the token count cached by an earlier attempt of this job and defer encoding
+    tok_cache_path = _seg_tok_cache_path(user_id, job_id)
+    tok_cache = _load_seg_tok_cache(tok_cache_path)
     seg_infos = []
+    new_records = []
     total_tokens = 0
     for seg in segments:
+        h = hashlib.sha256(seg["text"].encode("utf-8")).hexdigest()
+        key = f"{seg['course_id']}:{h}"
+        entry = tok_cache.get(key)
+        if isinstance(entry, dict) and isinstance(entry.get("tokens"), int):
+            seg_infos.append({"seg": seg, "toks": None, "enc": None, "n_tokens": entry["tokens"], "key": key})
+            total_tokens += entry["tokens"]
+            continue
         stoks, s_enc = encode_text(seg["text"], COMPRESSION_MODEL)
-        seg_infos.append({"seg": seg, "toks": stoks, "enc": s_enc})
+        tok_cache.setdefault(key, {"blocks": {}})["tokens"] = len(stoks)
+        new_records.append({"key": key, "tokens": len(stoks)})
+        seg_infos.append({"seg": seg, "toks": stoks, "enc": s_enc, "n_tokens": len(stoks), "key": key})
         total_tokens += len(stoks)
-
     if total_tokens <= 0:
         return stream_path
+    if new_records:
+        _append_seg_tok_cache(tok_cache_path, new_records)
 
     # Global ratio to target ~126k final across all courses
     target_ratio_global = min(1.0, 126000 / float(total_tokens))
@@ -1024,97 +1643,166 @@ def stream_compress_corpus_blocks(raw: str, user_id: int, job_id: str, db=None,
                     log_line=f"Streaming compression (course-aware): segments={len(segments)}, total_tokens≈{total_tokens}, target≈{target_percent}%")
 
     MODEL_MAX_OUT = 16384
+    # Largest input that still fits the window next to the system prompt and output budget
+    context_limit = MODEL_CONTEXT_TOKENS - 4096
+    system_tokens = estimate_tokens(system, COMPRESSION_MODEL)
 
-    # Process each course segment independently
-    for idx, info in enumerate(seg_infos, 1):
+    def _block_ranges(n_tokens: int) -> List[Tuple[int, int]]:
+        """
+        Split [0, n_tokens) into ~block_tokens ranges, halving any range whose
+        prompt + input + output budget would overflow the context window.
+        """
+        def _split(start: int, end: int) -> List[Tuple[int, int]]:
+            n = end - start
+            out_budget = min(MODEL_MAX_OUT, max(2048, int(n * target_ratio_global)))
+            if n > 1 and system_tokens + n + out_budget > context_limit:
+                mid = start + n // 2
+                return _split(start, mid) + _split(mid, end)
+            return [(start, end)]
+        ranges: List[Tuple[int, int]] = []
+        for start in range(0, n_tokens, block_tokens):
+            ranges.extend(_split(start, min(n_tokens, start + block_tokens)))
+        return ranges
+
+    cache_lock = threading.Lock()
+    out_dir = os.path.dirname(stream_path)
+
+    def _compress_one_course(idx: int, info: dict) -> str:
+        """
+        Compress one course segment into its own temp file (header + blocks + footer)
+        and return the temp file path. Runs on a worker thread with its own DB session.
+        """
         seg = info["seg"]
         toks = info["toks"]
         enc = info["enc"]
+        with cache_lock:
+            done_blocks = tok_cache[info["key"]].setdefault("blocks", {})
         cid = seg["course_id"]
         cname = seg["course_name"]
+        wdb = SessionLocal() if db is not None else None
+        jlog = _JobLogger(wdb, job_id) if wdb is not None else None
+        fd, course_path = tempfile.mkstemp(prefix=f"course_{job_id}_{idx}_", suffix=".txt", dir=out_dir)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as out:
+                # Write a visible course header into the stream for downstream clarity
+                out.write(f"\n--- COURSE START [{cname}] (courses/{cid}) ---\n")
+
+                # Chunk this course segment by tokens
+                ranges = _block_ranges(info["n_tokens"])
+                num_blocks = len(ranges)
+                if jlog is not None:
+                    jlog.status("compressing",
+                                log_line=f"[{idx}/{len(seg_infos)}] Course {cid or 'GLOBAL'} '{cname}': {num_blocks} block(s) at ≈{block_tokens} tokens; target≈{target_percent}%")
+
+                for i, (start, end) in enumerate(ranges):
+                    # Blocks already compressed by an earlier attempt are replayed from the cache
+                    block_key = f"{start}:{end}:{target_percent}"
+                    with cache_lock:
+                        cached_chunk = done_blocks.get(block_key)
+                    if cached_chunk is not None:
+                        out.write(cached_chunk + "\n\n")
+                        continue
+                    if toks is None:
+                        toks, enc = encode_text(seg["text"], COMPRESSION_MODEL)
+                    part_tokens = toks[start:end]
+                    part_text = decode_tokens(part_tokens, enc)
+                    if not part_text.strip():
+                        continue
+
+                    in_tokens_est = estimate_tokens(part_text, COMPRESSION_MODEL)
+                    target_out = int(in_tokens_est * target_ratio_global)
+                    max_out_tokens = min(MODEL_MAX_OUT, max(2048, target_out))
+
+                    user_msg = (
+                        f"The following text is from course [{cname}] (courses/{cid}). "
+                        f"Compress this segment to ~{target_percent}% of its original tokens while preserving assignments, dates, policies, instructors, and problem statements. "
+                        "Summarize the following course materials (Just because the beginning of the block you're summarizing starts with a particular course, doesn't mean it will end with it. Keep in mind that if the course information changes to a different course mid-way, you need to output a second course description for the information summarized for that course.) into a compact but detailed brief that preserves:\n"
+                        "- exact problem set questions and subparts when present\n"
+                        "- schedules, due dates, times, locations, exam windows\n"
+                        "- grading breakdowns, late policies, and rubrics\n"
+                        "- instructor/TAs, contact info, and office hours\n"
+                        "- assignment instructions and submission requirements\n"
+                        "- modules/units coverage and required readings\n"
+                        "- announcements, policy changes, datasets/links\n\n"
+                        "Keep technical notation and numbering; do not omit details that affect studying or deadlines. "
+                        "Prefer bullet points and short paragraphs, and end with a brief checklist of actionable next steps.\n\n"
+                        "For each block you're summarizing, detect which class it's most relevant to, and at the top of your summary you should output 'The user is enrolled in the following class:' along with the class number and name. then say you're starting the summary for that class.\n"
+                        "At the end of your summary you should say 'End of summary for the class that the user is enrolled in,' and then the class name slash number."
+                        "Text to summarize:\n"
+                        f"Use up to {max_out_tokens} tokens to maximize retention.\n\n" + part_text
+                    )
 
-        # Write a visible course header into the stream for downstream clarity
-        header = f"\n--- COURSE START [{cname}] (courses/{cid}) ---\n"
-        with open(stream_path, "a", encoding="utf-8", buffering=1) as f:
-            f.write(header)
-            f.flush()
-            os.fsync(f.fileno())
-
-        # Chunk this course segment by tokens
-        num_blocks = math.ceil(len(toks) / block_tokens)
-        if db is not None:
-            _update_job(db, job_id, status="compressing",
-                        log_line=f"[{idx}/{len(seg_infos)}] Course {cid or 'GLOBAL'} '{cname}': {num_blocks} block(s) at ≈{block_tokens} tokens; target≈{target_percent}%")
-
-        for i in range(num_blocks):
-            start = i * block_tokens
-            end = min(len(toks), (i + 1) * block_tokens)
-            part_tokens = toks[start:end]
-            part_text = decode_tokens(part_tokens, enc)
-            if not part_text.strip():
-                continue
-
-            in_tokens_est = estimate_tokens(part_text, COMPRESSION_MODEL)
-            target_out = int(in_tokens_est * target_ratio_global)
-            max_out_tokens = min(MODEL_MAX_OUT, max(512, target_out))
-
-            user_msg = (
-                f"The following text is from course [{cname}] (courses/{cid}). "
-                f"Compress this segment to ~{target_percent}% of its original tokens while preserving assignments, dates, policies, instructors, and problem statements. "
-                "Summarize the following course materials (Just because the beginning of the block you're summarizing starts with a particular course, doesn't mean it will end with it. Keep in mind that if the course information changes to a different course mid-way, you need to output a second course description for the information summarized for that course.) into a compact but detailed brief that preserves:\n"
-                "- exact problem set questions and subparts when present\n"
-                "- schedules, due dates, times, locations, exam windows\n"
-                "- grading breakdowns, late policies, and rubrics\n"
-                "- instructor/TAs, contact info, and office hours\n"
-                "- assignment instructions and submission requirements\n"
-                "- modules/units coverage and required readings\n"
-                "- announcements, policy changes, datasets/links\n\n"
-                "Keep technical notation and numbering; do not omit details that affect studying or deadlines. "
-                "Prefer bullet points and short paragraphs, and end with a brief checklist of actionable next steps.\n\n"
-                "For each block you're summarizing, detect which class it's most relevant to, and at the top of your summary you should output 'The user is enrolled in the following class:' along with the class number and name. then say you're starting the summary for that class.\n"
-                "At the end of your summary you should say 'End of summary for the class that the user is enrolled in,' and then the class name slash number."
-                "Text to summarize:\n"
-                f"Use up to {max_out_tokens} tokens to maximize retention.\n\n" + part_text
-            )
-
-            payload = {
-                "model": COMPRESSION_MODEL,
-                "messages": [
-                    {"role": "system", "content": system},
-                    {"role": "user", "content": user_msg},
-                ],
-                "temperature": 0.0,
-                "max_tokens": int(max_out_tokens),
-            }
-
-            if db is not None:
-                _update_job(db, job_id, status="compressing",
-                            log_line=f"[{idx}/{len(seg_infos)}] Course {cid or 'GLOBAL'} block {i+1}/{num_blocks}: ~{in_tokens_est} in → budget {max_out_tokens} out (target≈{target_percent}%)")
-
-            compressed_chunk = openai_chat(payload).strip()
-
-            # Guard: re-ask if output exceeds cap (rare)
-            try:
-                out_est = estimate_tokens(compressed_chunk, COMPRESSION_MODEL)
-            except Exception:
-                out_est = 0
-            if out_est > max_out_tokens:
-                payload["messages"].append({
-                    "role": "user",
-                    "content": f"The previous output exceeded the max token limit. Rewrite it to at most {max_out_tokens} tokens while preserving all key content."
-                })
-                compressed_chunk = openai_chat(payload).strip()
-
-            with open(stream_path, "a", encoding="utf-8", buffering=1) as f:
-                f.write(compressed_chunk + "\n\n")
-                f.flush()
-                os.fsync(f.fileno())
+                    payload = {
+                        "model": COMPRESSION_MODEL,
+                        "messages": [
+                            {"role": "system", "content": system},
+                            {"role": "user", "content": user_msg},
+                        ],
+                        "temperature": 0.0,
+                        "max_tokens": int(max_out_tokens),
+                    }
+
+                    if jlog is not None:
+                        jlog.status("compressing",
+                                    log_line=f"[{idx}/{len(seg_infos)}] Course {cid or 'GLOBAL'} block {i+1}/{num_blocks}: ~{in_tokens_est} in → budget {max_out_tokens} out (target≈{target_percent}%)")
+
+                    with _COMPRESS_API_SEM:
+                        compressed_chunk = openai_chat(payload).strip()
+
+                    # Guard: trim locally if output exceeds cap; re-ask only when far over (rare)
+                    compressed_chunk = _fit_output_budget(payload, compressed_chunk, max_out_tokens, sem=_COMPRESS_API_SEM)
+
+                    out.write(compressed_chunk + "\n\n")
+                    out.flush()
+                    with cache_lock:
+                        done_blocks[block_key] = compressed_chunk
+                        _append_seg_tok_cache(tok_cache_path, [{"key": info["key"], "block": block_key, "text": compressed_chunk}])
+
+                # Optional course end marker
+                out.write(f"--- COURSE END [{cname}] (courses/{cid}) ---\n\n")
+            return course_path
+        except Exception:
+            with contextlib.suppress(Exception):
+                os.remove(course_path)
+            raise
+        finally:
+            if jlog is not None:
+                with contextlib.suppress(Exception):
+                    jlog.flush()
+            if wdb is not None:
+                wdb.close()
+
+    # Compress courses concurrently; append finished courses to the stream in
+    # original order so the file keeps growing as leading courses complete
+    with ThreadPoolExecutor(max_workers=max(1, COURSE_CONCURRENCY), thread_name_prefix=f"compress-{job_id}") as pool:
+        futures = [pool.submit(_compress_one_course, idx, info) for idx, info in enumerate(seg_infos, 1)]
+        try:
+            for fut in futures:
+                course_path = fut.result()
+                try:
+                    with open(stream_path, "a", encoding="utf-8") as f, \
+                            open(course_path, "r", encoding="utf-8") as src_f:
+                        shutil.copyfileobj(src_f, f, length=64 * 1024)
+                        f.flush()
+                        os.fsync(f.fileno())
+                finally:
+                    with contextlib.suppress(Exception):
+                        os.remove(course_path)
+        except BaseException:
+            # One course failed: stop queued courses, wait out running ones and
+            # delete the temp files of every course that still finished
+            for fut in futures:
+                fut.cancel()
+            for fut in futures:
+                if fut.cancelled():
+                    continue
+                with contextlib.suppress(BaseException):
+                    os.remove(fut.result())
+            raise
 
-        # Optional course end marker
-        with open(stream_path, "a", encoding="utf-8", buffering=1) as f:
-            f.write(f"--- COURSE END [{cname}] (courses/{cid}) ---\n\n")
-            f.flush()
-            os.fsync(f.fileno())
+    # Every block made it into the stream; the resume cache has served its purpose
+    with contextlib.suppress(OSError):
+        os.remove(tok_cache_path)
 
     if db is not None:
         _update_job(db, job_id, log_line=f"Streaming compression complete (course-aware): {stream_path}")
@@ -1125,26 +1813,324 @@ def stream_compress_corpus_blocks(raw: str, user_id: int, job_id: str, db=None,
 # Indexing: store compressed doc + chunk into embedding rows
 # -----------------------------------------------------------------------------
 def chunk_for_embeddings(text: str, model: str, chunk_tokens: int) -> List[str]:
+    """
+    Split text into fixed-size token windows for embedding.
+
+    Every chunk is billed per token, so whitespace-only windows and exact repeats
+    (navigation/boilerplate that scrapes back-to-back) are dropped, and a tail shorter
+    than EMBED_MIN_CHUNK_TOKENS is folded into the window just before it (when that
+    window was kept) instead of being embedded on its own.
+
+    Args:
+        text (str): Text to split
+        model (str): The model name for tokenizer selection
+        chunk_tokens (int): Tokens per chunk
+
+    Returns:
+        List[str]: Non-empty, distinct chunk texts in document order
+    """
     if not text.strip():
         return []
     toks, enc = encode_text(text, model)
     chunks: List[str] = []
+    seen = set()
+    prev_kept = False  # was the window right before this one kept as chunks[-1]?
     for start in range(0, len(toks), chunk_tokens):
         sub = toks[start:start+chunk_tokens]
-        chunks.append(decode_tokens(sub, enc))
+        piece = decode_tokens(sub, enc)
+        kept, prev_kept = prev_kept, False
+        if not piece.strip():
+            continue
+        if len(sub) < EMBED_MIN_CHUNK_TOKENS and kept:
+            chunks[-1] += piece
+            continue
+        digest = hashlib.blake2b(piece.encode("utf-8", "ignore"), digest_size=16).digest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+        chunks.append(piece)
+        prev_kept = True
     return chunks
-def cosine_sim(a: List[float], b: List[float]) -> float:
-    import math
-    dot = 0.0
-    na = 0.0
-    nb = 0.0
-    for x, y in zip(a, b):
-        dot += x * y
-        na += x * x
-        nb += y * y
-    if na == 0.0 or nb == 0.0:
-        return 0.0
-    return dot / (math.sqrt(na) * math.sqrt(nb))
+
+
+def _unit_vector(vec) -> np.ndarray:
+    """
+    L2-normalize one embedding (float32) so stored rows rank by plain dot product.
+    """
+    v = np.asarray(vec, dtype=np.float32)
+    return v / (float(np.linalg.norm(v)) + 1e-12)
+
+
+def _encode_embedding(vec: List[float]) -> str:
+    """
+    Serialize an embedding as base64 of its raw float32 bytes.
+
+    Args:
+        vec (List[float]): Embedding vector
+
+    Returns:
+        str: Text-safe encoding for the chunks.embedding column
+    """
+    return base64.b64encode(np.asarray(vec, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def _decode_embedding(stored: str) -> np.ndarray:
+    """
+    Decode a stored embedding into a float32 vector.
+
+    Accepts both the base64 float32 encoding and legacy JSON list rows. Base64
+    rows are written unit-norm; JSON rows (older writes, or the Makefile
+    combine-docs target before it switched encodings) are L2-normalized here so
+    every decoded row ranks correctly by plain dot product.
+
+    Args:
+        stored (str): Value of the chunks.embedding column
+
+    Returns:
+        np.ndarray: 1-D float32 vector
+    """
+    if stored.lstrip().startswith("["):
+        return _unit_vector(_json_loads(stored))
+    return np.frombuffer(base64.b64decode(stored), dtype=np.float32)
+
+
+def _normalize_rows(mat: np.ndarray) -> np.ndarray:
+    """
+    L2-normalize each row of a float32 matrix; all-zero rows stay zero.
+    """
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+_INT8_SCALE = 127.0
+
+
+def _quantize_rows(unit_rows: np.ndarray) -> np.ndarray:
+    """
+    Quantize L2-normalized rows to int8 with the constant scale 127 (components lie in [-1, 1]).
+    """
+    return np.round(unit_rows * _INT8_SCALE).astype(np.int8)
+
+
+def _int8_sims(q: np.ndarray, rows8: np.ndarray) -> np.ndarray:
+    """
+    Approximate cosine similarities between a unit query and int8-quantized unit rows.
+    """
+    if simsimd is not None:
+        try:
+            q8 = np.round(q * _INT8_SCALE).astype(np.int8)
+            dots = np.asarray(simsimd.cdist(q8[None, :], rows8, metric="dot"), dtype=np.float32).ravel()
+            return dots / (_INT8_SCALE * _INT8_SCALE)
+        except Exception:
+            pass
+    # Dequantize block by block so the float copy stays small
+    sims = np.empty(rows8.shape[0], dtype=np.float32)
+    for start in range(0, rows8.shape[0], 4096):
+        sims[start:start + 4096] = rows8[start:start + 4096].astype(np.float32) @ q
+    return sims / _INT8_SCALE
+
+
+def _top_k_cosine(qvec, unit_rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rank rows by cosine similarity to a query with one matrix-vector product.
+
+    Args:
+        qvec: Query embedding (any length-D sequence)
+        unit_rows (np.ndarray): (N, D) matrix of L2-normalized rows, float32 or
+            int8 from _quantize_rows
+        k (int): Number of results wanted
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Row indices and their similarities, best first
+    """
+    if unit_rows.shape[0] == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+    q = np.asarray(qvec, dtype=np.float32)
+    q_norm = float(np.linalg.norm(q)) or 1.0
+    q = q / q_norm
+    ann = _ANN_BY_ROWS.get(id(unit_rows))
+    if ann is not None:
+        scores, ids = ann.search(q[None, :], min(max(1, k), unit_rows.shape[0]))
+        keep = ids[0] >= 0
+        return ids[0][keep].astype(np.intp), scores[0][keep]
+    if unit_rows.dtype == np.int8:
+        sims = _int8_sims(q, unit_rows)
+    elif simsimd is not None:
+        try:
+            # rows are unit-norm, so the inner product is the cosine similarity
+            sims = np.asarray(simsimd.cdist(q[None, :], np.ascontiguousarray(unit_rows), metric="dot"),
+                              dtype=np.float32).ravel()
+        except Exception:
+            sims = unit_rows @ q
+    else:
+        sims = unit_rows @ q
+    k = min(max(1, k), sims.shape[0])
+    best = np.argpartition(-sims, k - 1)[:k]
+    best = best[np.argsort(-sims[best])]
+    return best, sims[best]
+# Parsed + normalized extension RAG indexes keyed by the sha256 hex of the posted JSON, so repeat
+# questions against the same index skip the JSON parse and the normalization. The chat page
+# computes the same key and, on /chat/stream, posts only the key while the server still holds it.
+_RAG_INDEX_CACHE: "OrderedDict[str, Tuple[List[str], np.ndarray]]" = OrderedDict()
+_RAG_INDEX_CACHE_MAX = 8
+_RAG_INDEX_CACHE_LOCK = threading.Lock()
+def _cached_rag_index(key: str) -> Optional[Tuple[List[str], np.ndarray]]:
+    """
+    Return the parsed RAG index previously posted with this sha256 key, or None.
+    """
+    with _RAG_INDEX_CACHE_LOCK:
+        hit = _RAG_INDEX_CACHE.get(key)
+        if hit is not None:
+            _RAG_INDEX_CACHE.move_to_end(key)
+        return hit
+def _load_rag_index(rag_index_json: str) -> Tuple[List[str], np.ndarray]:
+    """
+    Parse an extension-provided RAG index into chunk texts and a normalized embedding matrix.
+
+    Args:
+        rag_index_json (str): JSON with 'chunks' (list of str) plus either 'embeddings_b64'
+            (base64 of row-major float32 bytes) and 'dim', or legacy 'embeddings' (list of vectors)
+
+    Returns:
+        Tuple[List[str], np.ndarray]: Chunk texts and their (N, D) unit-norm rows
+        (int8 via _quantize_rows when EMBED_INT8 and simsimd are available, else float32)
+    """
+    key = hashlib.sha256(rag_index_json.encode("utf-8")).hexdigest()
+    hit = _cached_rag_index(key)
+    if hit is not None:
+        return hit
+    rag_index = _json_loads(rag_index_json)
+    chunks = rag_index.get('chunks', [])
+    if rag_index.get('embeddings_b64'):
+        # Packed form: a zero-copy view over the decoded bytes, no per-float Python objects
+        dim = int(rag_index.get('dim') or EMBED_DIM)
+        mat = np.frombuffer(base64.b64decode(rag_index['embeddings_b64']), dtype=np.float32).reshape(-1, dim)
+    else:
+        mat = np.asarray(rag_index.get('embeddings', []), dtype=np.float32)
+    n = min(len(chunks), mat.shape[0] if mat.ndim == 2 else 0)
+    return _cache_rag_matrix(key, chunks[:n], _normalize_rows(mat[:n].reshape(n, -1)))
+def _cache_rag_matrix(key: str, chunks: List[str], unit_rows: np.ndarray) -> Tuple[List[str], np.ndarray]:
+    """
+    Store chunk texts and their normalized rows in the RAG index LRU.
+
+    Returns:
+        Tuple[List[str], np.ndarray]: The cached pair (rows possibly int8, see _load_rag_index)
+    """
+    # int8 rows are 4x smaller to hold and scan; only worth it with SIMD int8 dot products
+    stored = _quantize_rows(unit_rows) if EMBED_INT8 and simsimd is not None else unit_rows
+    try:
+        _register_ann_index(unit_rows, key_rows=stored)
+    except Exception as e:
+        log_exception("rag_index_faiss", e)
+    with _RAG_INDEX_CACHE_LOCK:
+        _RAG_INDEX_CACHE[key] = (chunks, stored)
+        while len(_RAG_INDEX_CACHE) > _RAG_INDEX_CACHE_MAX:
+            _RAG_INDEX_CACHE.popitem(last=False)
+    return chunks, stored
+# On-disk chunk/embedding sets for the /chat fallback path, content-addressed by the context text
+CONTEXT_INDEX_DIR = os.environ.get("CONTEXT_INDEX_DIR", os.path.join(tempfile.gettempdir(), "chanvas", "ctx_index"))
+CONTEXT_INDEX_MAX = int(os.environ.get("CONTEXT_INDEX_MAX", "64"))  # contexts kept on disk; oldest by use evicted
+def _prune_context_index_dir():
+    """
+    Keep at most CONTEXT_INDEX_MAX context indexes on disk, evicting the least recently used
+    (file mtime, refreshed on every disk hit) .npy/.json pairs.
+    """
+    try:
+        with os.scandir(CONTEXT_INDEX_DIR) as it:
+            entries = [(e.stat().st_mtime, e.path[:-4]) for e in it if e.name.endswith(".npy") and ".tmp." not in e.name]
+    except OSError:
+        return
+    if len(entries) <= CONTEXT_INDEX_MAX:
+        return
+    entries.sort()
+    for _mtime, base in entries[:len(entries) - CONTEXT_INDEX_MAX]:
+        for ext in (".npy", ".json"):
+            with contextlib.suppress(OSError):
+                os.remove(base + ext)
+def _context_rag_index(full_context: str) -> Tuple[List[str], np.ndarray]:
+    """
+    Chunk and embed a full course context once per distinct text.
+
+    The split is deterministic in (text, EMBED_MODEL, chunk sizes), so the
+    chunks and normalized float32 rows are kept in the RAG index LRU and on disk
+    ({hash}.json + {hash}.npy under CONTEXT_INDEX_DIR, capped at CONTEXT_INDEX_MAX);
+    only a new context is re-split and re-embedded.
+
+    Returns:
+        Tuple[List[str], np.ndarray]: Chunk texts and their normalized rows
+    """
+    digest = hashlib.sha256(f"{EMBED_MODEL}|{RETRIEVAL_CHUNK_TOKENS}|{EMBED_MIN_CHUNK_TOKENS}|".encode("utf-8") +
+                            full_context.encode("utf-8", "ignore")).hexdigest()
+    key = f"ctx:{digest}"
+    hit = _cached_rag_index(key)
+    if hit is not None:
+        return hit
+    base = os.path.join(_ensure_dir(CONTEXT_INDEX_DIR), digest)
+    try:
+        with open(base + ".json", "rb") as f:
+            chunks = _json_loads(f.read())
+        unit_rows = np.load(base + ".npy")
+        if isinstance(chunks, list) and unit_rows.ndim == 2 and unit_rows.shape[0] == len(chunks):
+            logger.info(f"[CHAT] Loaded {len(chunks)} chunk embeddings from context cache")
+            with contextlib.suppress(OSError):
+                os.utime(base + ".npy")  # mark as recently used for _prune_context_index_dir
+            return _cache_rag_matrix(key, chunks, unit_rows)
+    except (OSError, ValueError):
+        pass
+
+    # 1. Split full context into chunks for embedding
+    text_chunks = chunk_for_embeddings(full_context, EMBED_MODEL, RETRIEVAL_CHUNK_TOKENS)
+    logger.info(f"[CHAT] Split into {len(text_chunks)} chunks")
+    if not text_chunks:
+        return [], np.empty((0, EMBED_DIM), dtype=np.float32)
+
+    # 2. Embed all chunks (expensive on a cold cache!)
+    logger.info(f"[CHAT] Generating embeddings for {len(text_chunks)} chunks...")
+    chunk_embeddings = openai_embed(text_chunks)
+    n = min(len(text_chunks), len(chunk_embeddings))
+    text_chunks = text_chunks[:n]
+    unit_rows = _normalize_rows(np.asarray(chunk_embeddings[:n], dtype=np.float32).reshape(n, -1))
+    try:
+        tmp = f"{base}.{os.getpid()}.tmp.npy"
+        np.save(tmp, unit_rows)
+        os.replace(tmp, base + ".npy")
+        _atomic_write_text(base + ".json", json.dumps(text_chunks, ensure_ascii=False), fsync=False)
+    except Exception as e:
+        log_exception("context_index_write", e)
+    _prune_context_index_dir()
+    return _cache_rag_matrix(key, text_chunks, unit_rows)
+def _new_faiss_index(unit_rows: np.ndarray):
+    """
+    Build an inner-product FAISS index over L2-normalized rows: exact IndexFlatIP
+    (SIMD brute force) up to HNSW_MIN_ROWS, HNSW approximate search beyond.
+    """
+    dim = unit_rows.shape[1]
+    if unit_rows.shape[0] >= HNSW_MIN_ROWS:
+        index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexFlatIP(dim)
+    index.add(np.ascontiguousarray(unit_rows, dtype=np.float32))
+    return index
+
+# FAISS indexes for long-lived in-memory matrices (cached extension RAG indexes), keyed by
+# id(matrix) and dropped when the matrix is garbage-collected; consulted by _top_k_cosine
+_ANN_BY_ROWS: Dict[int, Any] = {}
+
+def _register_ann_index(unit_rows: np.ndarray, key_rows: Optional[np.ndarray] = None):
+    """
+    Attach a FAISS index to a reused normalized matrix once it exceeds ANN_MIN_ROWS.
+
+    The index is built from the float32 unit_rows and keyed on key_rows (the matrix
+    actually cached, e.g. its int8 form), defaulting to unit_rows itself.
+    """
+    if faiss is None or unit_rows.ndim != 2 or unit_rows.shape[0] < ANN_MIN_ROWS:
+        return
+    owner = unit_rows if key_rows is None else key_rows
+    key = id(owner)
+    _ANN_BY_ROWS[key] = _new_faiss_index(unit_rows)
+    weakref.finalize(owner, _ANN_BY_ROWS.pop, key, None)
+
 def persist_compressed_and_index(db, user_id: int, job_id: str, compressed_text: str) -> str:
     """
     Store compressed document and create chunks with embeddings for retrieval.
@@ -1171,13 +2157,12 @@ def persist_compressed_and_index(db, user_id: int, job_id: str, compressed_text:
     # Ensure output dir exists
     out_dir = os.path.abspath(os.environ.get("COMPRESSED_OUT_DIR", "compressed_out"))
     os.makedirs(out_dir, exist_ok=True)
-    # Write artifact to disk
+    # Write artifact to disk (atomically, so readers never see a partial file)
     filename = f"compressed_{user_id}_{job_id}.txt"
     out_path = os.path.join(out_dir, filename)
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(compressed_text or "")
+    _atomic_write_text(out_path, compressed_text or "")
     # Store in Document for chat stuffing
-    doc_id = uuid.uuid4().hex
+    doc_id = secrets.token_hex(16)
     doc = Document(id=doc_id, user_id=user_id, job_id=job_id, content=sanitize_db_text(compressed_text))
     db.add(doc)
     db.commit()
@@ -1194,16 +2179,18 @@ def persist_compressed_and_index(db, user_id: int, job_id: str, compressed_text:
                 # Generate embeddings for all chunks
                 embeddings = openai_embed(text_chunks)
 
-                # Store chunks with embeddings in database
-                for i, (chunk_text, embedding) in enumerate(zip(text_chunks, embeddings)):
-                    chunk = Chunk(
-                        id=uuid.uuid4().hex,
-                        document_id=doc_id,
-                        text=sanitize_db_text(chunk_text),
-                        embedding=json.dumps(embedding)
-                    )
-                    db.add(chunk)
-
+                # Store chunks with embeddings in one bulk INSERT (skips per-object unit-of-work)
+                rows = [
+                    {
+                        "id": secrets.token_hex(16),
+                        "document_id": doc_id,
+                        "chunk_index": i,
+                        "text": sanitize_db_text(chunk_text),
+                        "embedding": _encode_embedding(_unit_vector(embedding)),
+                    }
+                    for i, (chunk_text, embedding) in enumerate(zip(text_chunks, embeddings))
+                ]
+                db.bulk_insert_mappings(Chunk, rows)
                 db.commit()
                 _update_job(db, job_id, log_line=f"Created {len(text_chunks)} chunks with embeddings")
             else:
@@ -1212,6 +2199,7 @@ def persist_compressed_and_index(db, user_id: int, job_id: str, compressed_text:
         except Exception as e:
             log_exception("chunk_creation", e)
             _update_job(db, job_id, log_line="WARNING: Failed to create chunks, falling back to full document search")
+    _answer_cache_clear(user_id)
 
     # Log artifact path for convenience
     _update_job(db, job_id, log_line=f"Final compressed artifact saved: {out_path}")
@@ -1246,6 +2234,64 @@ def _update_job(db, job_id: str, *, status: Optional[str] = None, duo: Optional[
     job.updated_at = datetime.datetime.utcnow()
     db.add(job)
     db.commit()
+class _JobLogger:
+    """
+    Buffer job log lines and write them in batches.
+
+    Lines are timestamped when logged and flushed with one file write plus one
+    job touch (updated_at) once 16 lines are pending, or by a 0.5s timer after
+    the first pending line. status() flushes pending lines before applying the
+    transition so the log stays in order. Explicit flushes and status() use the
+    owner's DB session; timer flushes open their own.
+    """
+    MAX_PENDING = 16
+    MAX_DELAY = 0.5
+
+    def __init__(self, db, job_id: str):
+        self.db = db
+        self.job_id = job_id
+        self._lines: List[str] = []
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+
+    def log(self, message: str):
+        with self._lock:
+            self._lines.append(_format_job_log_line(message))
+            full = len(self._lines) >= self.MAX_PENDING
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.MAX_DELAY, self._flush_from_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def status(self, status: str, log_line: Optional[str] = None):
+        self.flush()
+        _update_job(self.db, self.job_id, status=status, log_line=log_line)
+
+    def flush(self):
+        self._flush(self.db)
+
+    def _flush_from_timer(self):
+        db = SessionLocal()
+        try:
+            self._flush(db)
+        except Exception as e:
+            log_exception("_JobLogger.flush", e)
+        finally:
+            db.close()
+
+    def _flush(self, db):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            lines, self._lines = self._lines, []
+            # write under the lock so concurrent flushes can't reorder lines
+            _append_job_log_lines(self.job_id, lines)
+        if lines and db is not None:
+            _update_job(db, self.job_id)
+
 def _status_callback_factory(job_id: str):
     """
     Create a callback function for updating job status during scraping.
@@ -1278,46 +2324,87 @@ def _status_callback_factory(job_id: str):
         finally:
             db.close()
     return cb
-# Global single-worker lock: ensures only one scrape runs at a time
-JOB_LOCK = threading.Lock()
-def _wait_for_job_slot(job_id: str, poll_seconds: float = 2.5):
-    """
-    Wait for a job execution slot using a global lock.
 
-    Ensures only one scraping job runs at a time by acquiring a global lock.
-    Updates job status to show queue position and wait time.
 
-    Args:
-        job_id (str): The unique job identifier
-        poll_seconds (float): Polling interval while waiting (default: 2.5)
+# Persistent job pool: bounds concurrent scrapes (default one at a time) and reuses worker threads
+MAX_CONCURRENT_JOBS = max(1, int(os.environ.get("MAX_CONCURRENT_JOBS", "1")))
+_JOB_POOL = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, thread_name_prefix="job")
+_JOB_INFLIGHT = 0
+_JOB_INFLIGHT_LOCK = threading.Lock()
+# Job bodies run in-thread by default. JOB_USE_PROCESSES=1 moves them (Selenium driver, compression,
+# indexing) into spawned worker processes so a heavy scrape can't hold the GIL against request
+# threads; each worker re-imports this module, so only enable it where the import side effects
+# (table creation, backfills, maintenance threads) are safe to repeat.
+JOB_USE_PROCESSES = os.environ.get("JOB_USE_PROCESSES", "0") == "1"
+_JOB_PROCS: Optional[ProcessPoolExecutor] = None
+_JOB_PROCS_LOCK = threading.Lock()
+# Set whenever an autoscrape schedule changes so the scheduler re-evaluates immediately
+_scheduler_wakeup = threading.Event()
+def _run_job_body(fn: Callable, *args, **kwargs):
     """
-    db = SessionLocal()
+    Run a job body on the worker process pool (or inline when JOB_USE_PROCESSES is off).
+
+    fn must be a module-level function with picklable arguments. Blocks until the
+    body finishes; its exception, if any, is re-raised here. In process mode the
+    body runs in a spawned child, so the in-process caches it fills (embedding memo,
+    stream-ready and classes caches, ...) stay in that child and are lost to the web
+    process; only what it writes to the database or disk is shared.
+    """
+    global _JOB_PROCS
+    if not JOB_USE_PROCESSES:
+        return fn(*args, **kwargs)
+    with _JOB_PROCS_LOCK:
+        if _JOB_PROCS is None:
+            _JOB_PROCS = ProcessPoolExecutor(max_workers=MAX_CONCURRENT_JOBS,
+                                             mp_context=multiprocessing.get_context("spawn"))
+        pool = _JOB_PROCS
     try:
-        # Try fast-path acquire
-        if JOB_LOCK.acquire(blocking=False):
-            _update_job(db, job_id, status="starting", log_line="Acquired worker slot")
-            return
-        # Otherwise, let the user know we are waiting
-        _update_job(db, job_id, status="queued (waiting for another user's scrape to complete)", log_line="Waiting for previous job to finish")
-        while True:
-            got = JOB_LOCK.acquire(timeout=poll_seconds)
-            if got:
-                _update_job(db, job_id, status="starting", log_line="Acquired worker slot")
-                return
-            # Periodic status refresh
-            _update_job(db, job_id, status="queued (waiting for another user's scrape to complete)", log_line="Still waiting for previous job to finish")
-    finally:
-        db.close()
-def _release_job_slot():
+        return pool.submit(fn, *args, **kwargs).result()
+    except BrokenProcessPool:
+        # a worker died (e.g. OOM-killed with Chrome); the next job gets a fresh pool
+        with _JOB_PROCS_LOCK:
+            if _JOB_PROCS is pool:
+                _JOB_PROCS = None
+        raise
+def _submit_job(job_id: str, fn: Callable, *args, **kwargs):
     """
-    Release the global job execution slot.
+    Queue a job on the shared worker pool.
+
+    Marks the job as waiting when all workers are busy, and as starting once a
+    worker picks it up. The body itself runs through _run_job_body.
 
-    Safely releases the job lock to allow the next queued job to start.
-    Suppresses any exceptions during release to avoid blocking cleanup.
+    Args:
+        job_id (str): The unique job identifier
+        fn (Callable): Module-level job body (must be picklable)
+        *args: Positional arguments for fn
+        **kwargs: Keyword arguments for fn
     """
-    with contextlib.suppress(Exception):
-        if JOB_LOCK.locked():
-            JOB_LOCK.release()
+    global _JOB_INFLIGHT
+    with _JOB_INFLIGHT_LOCK:
+        busy = _JOB_INFLIGHT >= MAX_CONCURRENT_JOBS
+        _JOB_INFLIGHT += 1
+    if busy:
+        db = SessionLocal()
+        try:
+            _update_job(db, job_id, status="queued (waiting for another user's scrape to complete)", log_line="Waiting for previous job to finish")
+        finally:
+            db.close()
+
+    def run():
+        global _JOB_INFLIGHT
+        try:
+            db = SessionLocal()
+            try:
+                _update_job(db, job_id, status="starting", log_line="Acquired worker slot")
+            finally:
+                db.close()
+            _run_job_body(fn, *args, **kwargs)
+        except Exception as e:
+            log_exception(f"job {job_id}", e)
+        finally:
+            with _JOB_INFLIGHT_LOCK:
+                _JOB_INFLIGHT -= 1
+    _JOB_POOL.submit(run)
 def _now_utc():
     return datetime.datetime.utcnow()
 
@@ -1325,17 +2412,39 @@ def _get_or_create_auto(db, user_id: int) -> AutoScrape:
     rec = db.query(AutoScrape).filter(AutoScrape.user_id == user_id).first()
     if rec:
         return rec
-    rec = AutoScrape(id=uuid.uuid4().hex[:32], user_id=user_id, enabled=False,
-                     headless=True, created_at=_now_utc(), updated_at=_now_utc())
+    now = _now_utc()
+    rec = AutoScrape(id=secrets.token_hex(16), user_id=user_id, enabled=False,
+                     headless=True, created_at=now, updated_at=now)
     db.add(rec); db.commit()
     return rec
 
+def _upsert_auto_schedule(db, user_id: int, next_run_at: datetime.datetime,
+                          last_run_at: Optional[datetime.datetime] = None):
+    """
+    Create or update a user's autoscrape schedule in a single statement.
+
+    Args:
+        db: Database session (caller commits)
+        user_id (int): The user's unique identifier
+        next_run_at (datetime.datetime): UTC time of the next run
+        last_run_at (Optional[datetime.datetime]): UTC time of the last run; None keeps the stored value
+    """
+    now = _now_utc()
+    db.execute(sql_text("""
+        INSERT INTO auto_scrapes (id, user_id, enabled, headless, created_at, updated_at, next_run_at, last_run_at)
+        VALUES (:id, :uid, :enabled, :headless, :now, :now, :nxt, :lst)
+        ON CONFLICT (user_id) DO UPDATE SET
+            next_run_at = EXCLUDED.next_run_at,
+            last_run_at = COALESCE(EXCLUDED.last_run_at, auto_scrapes.last_run_at),
+            updated_at = EXCLUDED.updated_at
+    """), {"id": secrets.token_hex(16), "uid": user_id, "enabled": False, "headless": True,
+           "now": now, "nxt": next_run_at, "lst": last_run_at})
+
 def _schedule_next_24h(db, user_id: int):
-    rec = _get_or_create_auto(db, user_id)
-    rec.next_run_at = _now_utc() + datetime.timedelta(hours=24)
-    rec.last_run_at = _now_utc()
-    rec.updated_at = _now_utc()
-    db.add(rec); db.commit()
+    now = _now_utc()
+    _upsert_auto_schedule(db, user_id, now + datetime.timedelta(hours=24), now)
+    db.commit()
+    _scheduler_wakeup.set()
 
 def _has_active_job(db, user_id: int) -> bool:
     """
@@ -1351,11 +2460,13 @@ def _has_active_job(db, user_id: int) -> bool:
     Returns:
         bool: True if the user has any active jobs, False otherwise
     """
-    active = db.query(Job).filter(
-        Job.user_id == user_id,
-        Job.status.in_(["queued","starting","logging_in","compressing"])
-    ).first()
-    return bool(active)
+    # SELECT 1 avoids hydrating the Job row (and its potentially large log column)
+    active = db.execute(sql_text("""
+        SELECT 1 FROM jobs
+        WHERE user_id = :u AND status IN ('queued', 'starting', 'logging_in', 'compressing')
+        LIMIT 1
+    """), {"u": user_id}).scalar()
+    return active is not None
 
 def _enqueue_job_for_user(db, user_id: int, username: str, password: str, headless: bool, reuse_session_only: bool = False):
     """
@@ -1372,19 +2483,14 @@ def _enqueue_job_for_user(db, user_id: int, username: str, password: str, headle
         headless (bool): Whether to run browser in headless mode
         reuse_session_only (bool): Whether to only reuse existing sessions
     """
-    job_id = uuid.uuid4().hex[:16]
+    job_id = secrets.token_hex(8)
+    now = _now_utc()
     job = Job(id=job_id, user_id=user_id, status="queued", log="",
-              created_at=_now_utc(), updated_at=_now_utc())
+              created_at=now, updated_at=now)
     db.add(job); db.commit()
 
-    def worker():
-        _wait_for_job_slot(job_id)
-        try:
-            run_scrape_and_index(user_id, username, password, headless, job_id, reuse_session_only=reuse_session_only)
-        finally:
-            _release_job_slot()
-    t = threading.Thread(target=worker, name=f"auto-{job_id}", daemon=True)
-    t.start()
+    _submit_job(job_id, run_scrape_and_index, user_id, username, password, headless, job_id,
+                reuse_session_only=reuse_session_only)
 
 def _enqueue_session_job(db, user_id: int, cookies_json: str, job_id: str):
     """
@@ -1396,34 +2502,103 @@ def _enqueue_session_job(db, user_id: int, cookies_json: str, job_id: str):
         cookies_json (str): JSON string of Canvas session cookies
         job_id (str): The job ID to use
     """
-    print(f"🚀 Starting session job thread: user_id={user_id}, job_id={job_id}")
-    def worker():
-        print(f"🔄 Session job worker started: {job_id}")
-        _wait_for_job_slot(job_id)
-        try:
-            print(f"📋 Running session scrape and index: {job_id}")
-            run_session_scrape_and_index(user_id, cookies_json, job_id)
-            print(f"✅ Session scrape completed: {job_id}")
-        except Exception as e:
-            print(f"💥 Session job error: {job_id} - {str(e)}")
-        finally:
-            _release_job_slot()
-    t = threading.Thread(target=worker, name=f"session-{job_id}", daemon=True)
-    t.start()
-    print(f"🎯 Session job thread started: {job_id}")
+    logger.debug(f"Queueing session job: user_id={user_id}, job_id={job_id}")
+    # Submit the module-level function directly: the body may run in a worker process
+    _submit_job(job_id, run_session_scrape_and_index, user_id, cookies_json, job_id)
+    logger.debug(f"Session job queued: {job_id}")
+
+# Embedding jobs are short and I/O-bound (OpenAI calls); they get their own threads so an
+# upload never waits behind a Selenium scrape on the shared job pool.
+EMBED_JOB_WORKERS = max(1, int(os.environ.get("EMBED_JOB_WORKERS", "2")))
+_EMBED_JOB_POOL = ThreadPoolExecutor(max_workers=EMBED_JOB_WORKERS, thread_name_prefix="embed-job")
+# Embedding jobs share the jobs table but have their own statuses, so "latest job" lookups
+# (dashboard stream link, chat context, Duo polling) only ever see scrape jobs
+EMBED_JOB_STATUSES = ("embedding_queued", "embedding", "embedded", "embedding_failed")
+
+def _scrape_jobs_only():
+    """
+    SQL filter excluding embedding jobs (status NULL counts as a scrape job).
+    """
+    return or_(Job.status.is_(None), Job.status.notin_(EMBED_JOB_STATUSES))
+
+def run_embed_documents(job_id: str, doc_ids: List[str]):
+    """
+    Chunk, embed and store retrieval chunks for documents saved by /api/upload-courses.
+
+    Args:
+        job_id (str): The embedding job's ID (status/log target)
+        doc_ids (List[str]): Document IDs to index
+    """
+    db = SessionLocal()
+    try:
+        _update_job(db, job_id, status="embedding", log_line=f"Indexing {len(doc_ids)} course document(s)")
+        docs = db.query(Document.id, Document.user_id, Document.content).filter(Document.id.in_(doc_ids)).all()
+        # Tokenize/split every course in parallel (tiktoken releases the GIL)
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(docs))), thread_name_prefix="upload") as pool:
+            doc_chunks = list(pool.map(
+                lambda d: chunk_for_embeddings(d.content or "", EMBED_MODEL, RETRIEVAL_CHUNK_TOKENS), docs))
+
+        # Generate embeddings for every course's chunks together (cache hits skip the API)
+        all_texts = [t for text_chunks in doc_chunks for t in text_chunks]
+        embeddings = openai_embed(all_texts) if all_texts else []
+        # Store chunks with embeddings in one bulk INSERT (skips per-object unit-of-work)
+        rows = []
+        pos = 0
+        for doc, text_chunks in zip(docs, doc_chunks):
+            rows.extend(
+                {
+                    "id": secrets.token_hex(16),
+                    "document_id": doc.id,
+                    "chunk_index": i,
+                    "text": sanitize_db_text(chunk_text),
+                    "embedding": _encode_embedding(_unit_vector(embeddings[pos + i])),
+                }
+                for i, chunk_text in enumerate(text_chunks)
+            )
+            pos += len(text_chunks)
+        if rows:
+            db.bulk_insert_mappings(Chunk, rows)
+            db.commit()
+        for user_id in {d.user_id for d in docs}:
+            _answer_cache_clear(user_id)
+        _update_job(db, job_id, status="embedded", log_line=f"Created {len(rows)} chunks with embeddings")
+    except Exception as e:
+        db.rollback()
+        log_exception(f"embed job {job_id}", e)
+        _update_job(db, job_id, status="embedding_failed", log_line=f"Embedding failed: {e}")
+    finally:
+        db.close()
+
+def _enqueue_embed_job(job_id: str, doc_ids: List[str]):
+    """
+    Queue run_embed_documents for an existing job row.
+
+    Args:
+        job_id (str): The embedding job's ID
+        doc_ids (List[str]): Document IDs to index
+    """
+    _EMBED_JOB_POOL.submit(run_embed_documents, job_id, doc_ids)
 
 def _resume_interrupted_jobs():
     db = SessionLocal()
     try:
-        stuck = db.query(Job).filter(Job.status.in_([
-            "queued", "starting", "logging_in", "compressing"
-        ])).all()
-        for j in stuck:
-            # mark as queued again; scheduler/locks will manage ordering
-            j.status = "queued"
-            j.updated_at = _now_utc()
-            db.add(j)
+        # mark as queued again in one statement; scheduler/locks will manage ordering
+        db.execute(sql_text("""
+            UPDATE jobs SET status = 'queued', updated_at = :now
+            WHERE status IN ('queued', 'starting', 'logging_in', 'compressing')
+        """), {"now": _now_utc()})
         db.commit()
+
+        # Embedding jobs cut off by the restart: index whatever documents still have no chunks
+        embed_jobs = [r.id for r in db.query(Job.id).filter(Job.status.in_(("embedding_queued", "embedding"))).all()]
+        for job_id in embed_jobs:
+            has_chunks = db.query(Chunk.id).filter(Chunk.document_id == Document.id).exists()
+            doc_ids = [r.id for r in db.query(Document.id).filter(Document.job_id == job_id, ~has_chunks).all()]
+            if doc_ids:
+                _update_job(db, job_id, status="embedding_queued", log_line="Re-queued after restart")
+                _enqueue_embed_job(job_id, doc_ids)
+            else:
+                _update_job(db, job_id, status="embedded", log_line="Nothing left to index after restart")
     except Exception as e:
         log_exception("_resume_interrupted_jobs", e)
     finally:
@@ -1437,50 +2612,193 @@ def _classes_file_path(user_id: int) -> str:
     os.makedirs(base, exist_ok=True)
     return os.path.join(base, "classes.json")
 
+def _chat_history_path(user_id: int) -> str:
+    """
+    Per-user JSON file holding recent chat questions (kept server-side, not in the cookie).
+    """
+    return os.path.join(_ensure_dir(os.path.join(tempfile.gettempdir(), "chanvas", f"user-{user_id}")), "chat_history.json")
+
+def _read_text_mmap(path: str, head_chars: int) -> Tuple[str, str]:
+    """
+    Decode a UTF-8 file straight from a read-only mapping (no intermediate bytes copy).
+
+    Newlines are normalized the way text-mode open() would.
+
+    Args:
+        path (str): File to read
+        head_chars (int): Length of the leading slice to return separately
+
+    Returns:
+        Tuple[str, str]: (first head_chars characters, full text)
+    """
+    if os.path.getsize(path) == 0:
+        return "", ""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            text = str(view, "utf-8", "ignore")
+        finally:
+            view.release()
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text[:head_chars], text
+
+def _file_has_text(path: str, block_size: int = 1 << 16) -> bool:
+    """
+    Check whether a file contains any non-whitespace content without loading it whole.
+
+    Args:
+        path (str): File to inspect
+        block_size (int): Bytes read per step
+
+    Returns:
+        bool: True as soon as a non-whitespace byte is seen
+    """
+    with open(path, "rb") as f:
+        while True:
+            buf = f.read(block_size)
+            if not buf:
+                return False
+            if buf.strip():
+                return True
+
+def _scheduler_next_delay(db, now: datetime.datetime) -> float:
+    """
+    Seconds until the next enabled autoscrape is due, clamped to [1, 60].
+
+    Args:
+        db: Database session
+        now (datetime.datetime): Reference time (UTC) of the current pass
+
+    Returns:
+        float: Delay to wait before the next scheduler pass
+    """
+    next_ts = db.execute(sql_text("""
+        SELECT MIN(next_run_at) FROM auto_scrapes
+        WHERE enabled = :enabled AND next_run_at > :now
+    """), {"enabled": True, "now": now}).scalar()
+    if isinstance(next_ts, str):
+        # SQLite hands raw DateTime columns back as ISO strings
+        with contextlib.suppress(ValueError):
+            next_ts = datetime.datetime.fromisoformat(next_ts)
+    if not isinstance(next_ts, datetime.datetime):
+        return 60.0
+    return max(1.0, min(60.0, (next_ts - now).total_seconds()))
+
+# Postgres advisory lock key guarding the scheduler (session-scoped, held on a dedicated connection)
+_SCHEDULER_LOCK_KEY = 0x5AFE5C4E
+_scheduler_lock_conn = None
+
+def _acquire_scheduler_lock() -> bool:
+    """
+    Try to become (or confirm we still are) the scheduler leader.
+
+    On Postgres this takes pg_try_advisory_lock on a connection kept out of the
+    pool for the life of the process, so the lock is released automatically if
+    the process dies. Other databases have a single writer and always succeed.
+
+    Returns:
+        bool: True if this process should run the scheduler tick
+    """
+    global _scheduler_lock_conn
+    if engine.dialect.name != "postgresql":
+        return True
+    if _scheduler_lock_conn is not None:
+        try:
+            _scheduler_lock_conn.execute(sql_text("SELECT 1"))
+            _scheduler_lock_conn.commit()
+            return True
+        except Exception:
+            # connection dropped; the server released the lock with it
+            with contextlib.suppress(Exception):
+                _scheduler_lock_conn.close()
+            _scheduler_lock_conn = None
+    conn = engine.connect()
+    try:
+        got = conn.execute(sql_text("SELECT pg_try_advisory_lock(:k)"), {"k": _SCHEDULER_LOCK_KEY}).scalar()
+        conn.commit()
+    except Exception:
+        conn.close()
+        raise
+    if got:
+        _scheduler_lock_conn = conn
+        return True
+    conn.close()
+    return False
+
+@atexit.register
+def _release_scheduler_lock():
+    global _scheduler_lock_conn
+    if _scheduler_lock_conn is None:
+        return
+    with contextlib.suppress(Exception):
+        _scheduler_lock_conn.execute(sql_text("SELECT pg_advisory_unlock(:k)"), {"k": _SCHEDULER_LOCK_KEY})
+        _scheduler_lock_conn.commit()
+    with contextlib.suppress(Exception):
+        _scheduler_lock_conn.close()
+    _scheduler_lock_conn = None
+
 def _scheduler_loop():
     # Only one scheduler in the formation: prefer web.1 or explicit RUN_SCHEDULER=1
     dyno = os.environ.get("DYNO", "")
     should_run = os.environ.get("RUN_SCHEDULER", "0") == "1" or dyno.endswith(".1")
     if not should_run:
         return
-    # attempt rescue of interrupted jobs at boot
-    _resume_interrupted_jobs()
+    resumed = False
     while True:
+        # Across replicas only the advisory-lock holder resumes jobs and scans schedules
+        try:
+            leader = _acquire_scheduler_lock()
+        except Exception as e:
+            log_exception("_acquire_scheduler_lock", e)
+            leader = False
+        if not leader:
+            _scheduler_wakeup.wait(60)
+            _scheduler_wakeup.clear()
+            continue
+        if not resumed:
+            # attempt rescue of interrupted jobs at boot
+            _resume_interrupted_jobs()
+            resumed = True
         db = SessionLocal()
         try:
             now = _now_utc()
-            due = db.query(AutoScrape).filter(
-                AutoScrape.enabled == True,
-                AutoScrape.next_run_at != None,
-                AutoScrape.next_run_at <= now
-            ).all()
-            for rec in due:
-                if _has_active_job(db, rec.user_id):
-                    # leave next_run_at as-is; loop will pick it up soon
-                    continue
-                # Reuse-only autoscrape: never auto-enter credentials
-                sess_dir = _session_dir(rec.user_id)
-                has_session = os.path.isdir(sess_dir) and any(os.scandir(sess_dir))
-                if not has_session:
-                    _update_job(db, job_id=str(rec.user_id), log_line="Autoscrape skipped: no warm session available")
-                    # keep 24h cadence; still schedule next attempt
-                    rec.next_run_at = now + datetime.timedelta(hours=24)
-                    rec.updated_at = now
-                    db.add(rec); db.commit()
-                    continue
-                
-                # Enqueue a reuse-only job (blank creds)
-                _enqueue_job_for_user(db, rec.user_id, "", "", bool(rec.headless), reuse_session_only=True)
-                # schedule the *next* run immediately upon queueing
-                rec.next_run_at = now + datetime.timedelta(hours=24)
-                rec.updated_at = now
-                db.add(rec); db.commit()
-
+            # Users with an active job are excluded in SQL; they stay due and are picked up
+            # on a later pass. Streamed on a dedicated connection so per-row commits on `db`
+            # don't close the cursor.
+            with engine.connect() as conn:
+                due = conn.execute(sql_text("""
+                    SELECT a.user_id, a.headless FROM auto_scrapes a
+                    WHERE a.enabled = :enabled AND a.next_run_at <= :now
+                      AND NOT EXISTS (
+                        SELECT 1 FROM jobs j
+                        WHERE j.user_id = a.user_id
+                          AND j.status IN ('queued', 'starting', 'logging_in', 'compressing')
+                      )
+                """), {"enabled": True, "now": now}).yield_per(100)
+                for user_id, headless in due:
+                    # Reuse-only autoscrape: never auto-enter credentials
+                    if not _has_warm_session(user_id):
+                        _update_job(db, job_id=str(user_id), log_line="Autoscrape skipped: no warm session available")
+                        # keep 24h cadence; still schedule next attempt
+                        _upsert_auto_schedule(db, user_id, now + datetime.timedelta(hours=24))
+                        db.commit()
+                        continue
+
+                    # Enqueue a reuse-only job (blank creds)
+                    _enqueue_job_for_user(db, user_id, "", "", bool(headless), reuse_session_only=True)
+                    # schedule the *next* run immediately upon queueing
+                    _upsert_auto_schedule(db, user_id, now + datetime.timedelta(hours=24))
+                    db.commit()
+
+            delay = _scheduler_next_delay(db, now)
         except Exception as e:
             log_exception("_scheduler_loop", e)
+            delay = 60.0
         finally:
             db.close()
-        time.sleep(60)
+        _scheduler_wakeup.wait(delay)
+        _scheduler_wakeup.clear()
 
 def _compute_current_term_label(now: Optional[datetime.datetime] = None) -> str:
     if not now:
@@ -1493,6 +2811,112 @@ def _compute_current_term_label(now: Optional[datetime.datetime] = None) -> str:
         return f"Spring {y}"
     return f"Summer {y}"
 
+# Current-term-only scraper filters; forced values always win, defaults yield to operator env
+_CANVAS_ENV_FORCED = {
+    "CANVAS_FETCH_ALL_COURSES": "1",
+    "CANVAS_FAVORITES_ONLY": "0",
+    "CANVAS_INCLUDE_PAST_COURSES": "0",
+    "CANVAS_INCLUDE_FUTURE_COURSES": "0",
+    "CANVAS_INCLUDE_UNPUBLISHED": "1",
+    "CANVAS_ENROLLMENT_STATES": "active,invited,completed",
+    "CANVAS_CURRENT_TERM_ONLY": "1",
+}
+_CANVAS_ENV_DEFAULTS = {
+    "CANVAS_PER_PAGE": "100",
+}
+_canvas_env_installed = False
+
+def _install_canvas_env():
+    """
+    Install the Canvas scraper filter env vars once per process.
+
+    Nothing else in the app mutates these keys, so later jobs see the same values
+    without re-writing os.environ. The term label is pinned on first install,
+    as before.
+    """
+    global _canvas_env_installed
+    if _canvas_env_installed:
+        return
+    os.environ.update(_CANVAS_ENV_FORCED)
+    for k, v in _CANVAS_ENV_DEFAULTS.items():
+        os.environ.setdefault(k, v)
+    os.environ.setdefault("CANVAS_TERM_LABEL", _compute_current_term_label())
+    os.environ.pop("CANVAS_COURSE_STATES", None)
+    _canvas_env_installed = True
+
+def _post_scrape_pipeline(db, jl: "_JobLogger", user_id: int, job_id: str, input_path: str) -> Optional[str]:
+    """
+    Shared post-scrape flow for credential and cookie-based scrapes.
+
+    Mirrors the scraper output into the job's live stream file, stream-compresses
+    it per course, extracts the class list and persists the document + chunks.
+    The job is marked completed only once the document is saved, failed otherwise.
+    Callers check that input_path has content first.
+
+    Args:
+        db: Database session
+        jl (_JobLogger): The job's log buffer
+        user_id (int): The user's unique identifier
+        job_id (str): The job ID for tracking
+        input_path (str): Path to the scraper's input.txt
+
+    Returns:
+        Optional[str]: The created document ID, or None if persisting failed
+    """
+    # Fallback: ensure live stream contains at least the full raw input (byte copy, no decode)
+    scrape_path = _scrape_stream_file_path(user_id, job_id)
+    try:
+        curr_size = os.path.getsize(scrape_path)
+    except Exception:
+        curr_size = 0
+    if curr_size < os.path.getsize(input_path):
+        with open(input_path, "rb") as src, open(scrape_path, "ab") as dst:
+            dst.write(b"\n")
+            shutil.copyfileobj(src, dst, length=1 << 20)
+            dst.flush()
+            os.fsync(dst.fileno())
+
+    jl.status("compressing",
+              log_line=f"Starting streaming compression: ~{COMPRESS_BLOCK_TOKENS:,}-token blocks with dynamic global ratio")
+    # Read the live scrape stream as the source for compression
+    with open(scrape_path, "r", encoding="utf-8", errors="ignore") as f:
+        raw_for_compress = f.read()
+    if not raw_for_compress.strip():
+        # fail-safe
+        with open(input_path, "r", encoding="utf-8", errors="ignore") as f:
+            raw_for_compress = f.read()
+    # Stream-compress and finish
+    stream_path = stream_compress_corpus_blocks(raw_for_compress, user_id, job_id, db=db, target_ratio=0.5)
+    jl.log(f"Streaming compression complete: {stream_path}")
+    # Read the rolling stream content and persist to Document to survive dyno restarts
+    try:
+        classes_head, compressed_text_final = _read_text_mmap(stream_path, head_chars=200_000)
+    except Exception:
+        compressed_text_final = raw_for_compress  # best-effort
+        classes_head = compressed_text_final[:200_000]
+
+    # NEW: Extract classes via gpt-4.1-mini and persist as JSON for the chat UI
+    try:
+        classes = extract_classes_list(classes_head)
+        with open(_classes_file_path(user_id), "w", encoding="utf-8") as f:
+            json.dump(classes, f, ensure_ascii=False, indent=2)
+        jl.log(f"Detected {len(classes)} course(s); saved classes.json")
+    except Exception as e:
+        log_exception("extract_classes_list", e)
+        jl.log("WARNING: Failed to extract classes")
+
+    # Create document and chunks for semantic retrieval
+    try:
+        jl.flush()  # keep buffered lines ahead of the indexer's own log lines
+        doc_id = persist_compressed_and_index(db, user_id, job_id, compressed_text_final)
+    except Exception as e:
+        log_exception("persist_chunks_real_scrape", e)
+        jl.status("failed", log_line=f"Failed to save the compressed document: {e}")
+        return None
+    # Only a persisted document makes the job complete
+    jl.status("completed", log_line=f"Created document and chunks for semantic retrieval: {doc_id}")
+    return doc_id
+
 def run_session_scrape_and_index(user_id: int, cookies_json: str, job_id: str):
     """
     Run scraping and indexing using session cookies from browser extension.
@@ -1503,25 +2927,14 @@ def run_session_scrape_and_index(user_id: int, cookies_json: str, job_id: str):
         job_id (str): The job ID for tracking
     """
     db = SessionLocal()
+    jl = _JobLogger(db, job_id)
     tmp_root = ""  # ensure defined for finally
     try:
         # Set Canvas environment variables
-        term_label_default = _compute_current_term_label()
-        os.environ["CANVAS_FETCH_ALL_COURSES"] = "1"
-        os.environ["CANVAS_FAVORITES_ONLY"] = "0"
-        os.environ["CANVAS_INCLUDE_PAST_COURSES"] = "0"
-        os.environ["CANVAS_INCLUDE_FUTURE_COURSES"] = "0"
-        os.environ["CANVAS_INCLUDE_UNPUBLISHED"] = "1"
-        os.environ["CANVAS_PER_PAGE"] = os.environ.get("CANVAS_PER_PAGE", "100")
-        os.environ["CANVAS_ENROLLMENT_STATES"] = "active,invited,completed"
-        os.environ["CANVAS_CURRENT_TERM_ONLY"] = "1"
-        os.environ["CANVAS_TERM_LABEL"] = os.environ.get("CANVAS_TERM_LABEL", term_label_default)
-
-        with contextlib.suppress(KeyError):
-            del os.environ["CANVAS_COURSE_STATES"]
-
-        _update_job(
-            db, job_id, status="starting",
+        _install_canvas_env()
+
+        jl.status(
+            "starting",
             log_line="Starting session-based Canvas scrape using browser extension cookies"
         )
 
@@ -1530,15 +2943,15 @@ def run_session_scrape_and_index(user_id: int, cookies_json: str, job_id: str):
         # Parse cookies for session-based scraping
         try:
             cookies = json.loads(cookies_json)
-            _update_job(db, job_id, status="session_scraping",
+            jl.status("session_scraping",
                        log_line=f"Using {len(cookies)} session cookies from browser extension")
         except json.JSONDecodeError:
-            _update_job(db, job_id, status="failed",
+            jl.status("failed",
                        log_line="Failed to parse session cookies")
             return
 
         # Call modified canvas scraper with cookies instead of credentials
-        _update_job(db, job_id, status="scraping", log_line="Starting Canvas scrape with session cookies")
+        jl.status("scraping", log_line="Starting Canvas scrape with session cookies")
 
         # For now, we'll use a simplified approach - in production you'd modify canvas_scraper.py
         # to accept cookies instead of username/password
@@ -1546,60 +2959,44 @@ def run_session_scrape_and_index(user_id: int, cookies_json: str, job_id: str):
             res = run_canvas_scrape_job_with_cookies(cookies=cookies, headless=True, status_callback=cb)
         except Exception as e:
             # Fallback: log error and mark job as failed
-            _update_job(db, job_id, status="failed",
+            jl.status("failed",
                        log_line=f"Session-based scraping failed: {str(e)}")
             return
 
         input_path = (res or {}).get("input_path") or ""
         if not input_path or not os.path.exists(input_path):
-            _update_job(db, job_id, status="failed", log_line="No scraping output found")
+            jl.status("failed", log_line="No scraping output found")
             return
 
-        # Continue with compression and indexing (same as regular flow)
-        _update_job(db, job_id, status="compressing", log_line="Starting compression")
-
-        with open(input_path, "r", encoding="utf-8", errors="ignore") as f:
-            raw_content = f.read()
-
-        if not raw_content.strip():
-            _update_job(db, job_id, status="failed", log_line="No content to process")
+        if not _file_has_text(input_path):
+            jl.status("failed", log_line="No content to process")
             return
 
-        # Compress and index the content
-        compressed = compress_raw_text(raw_content, f"Session job {job_id}: ")
-        doc_id = persist_compressed_and_index(db, user_id, job_id, compressed)
-
-        _update_job(db, job_id, status="completed",
-                   log_line=f"Session-based scrape completed successfully. Document ID: {doc_id}")
+        # Continue with compression and indexing (same flow as credential scrapes)
+        doc_id = _post_scrape_pipeline(db, jl, user_id, job_id, input_path)
+        if doc_id:
+            jl.log(f"Session-based scrape completed successfully. Document ID: {doc_id}")
 
     except Exception as e:
         log_exception(f"run_session_scrape_and_index({user_id}, {job_id})", e)
-        _update_job(db, job_id, status="failed", log_line=f"Session scrape failed: {str(e)}")
+        jl.status("failed", log_line=f"Session scrape failed: {str(e)}")
     finally:
         if tmp_root and os.path.exists(tmp_root):
             with contextlib.suppress(Exception):
                 shutil.rmtree(tmp_root)
+        with contextlib.suppress(Exception):
+            jl.flush()
         db.close()
 
 def run_scrape_and_index(user_id: int, username: str, password: str, headless: bool, job_id: str, reuse_session_only: bool = False):
     db = SessionLocal()
+    jl = _JobLogger(db, job_id)
     tmp_root = ""  # ensure defined for finally
     try:
         # Ensure current-term-only filters (as in your code above)...
-        term_label_default = _compute_current_term_label()
-        os.environ["CANVAS_FETCH_ALL_COURSES"] = "1"
-        os.environ["CANVAS_FAVORITES_ONLY"] = "0"
-        os.environ["CANVAS_INCLUDE_PAST_COURSES"] = "0"
-        os.environ["CANVAS_INCLUDE_FUTURE_COURSES"] = "0"
-        os.environ["CANVAS_INCLUDE_UNPUBLISHED"] = "1"
-        os.environ["CANVAS_PER_PAGE"] = os.environ.get("CANVAS_PER_PAGE", "100")
-        os.environ["CANVAS_ENROLLMENT_STATES"] = "active,invited,completed"
-        os.environ["CANVAS_CURRENT_TERM_ONLY"] = "1"
-        os.environ["CANVAS_TERM_LABEL"] = os.environ.get("CANVAS_TERM_LABEL", term_label_default)
-        with contextlib.suppress(KeyError):
-            del os.environ["CANVAS_COURSE_STATES"]
-        _update_job(
-            db, job_id, status="starting",
+        _install_canvas_env()
+        jl.status(
+            "starting",
             log_line=(f"Configured Canvas filters: term={os.environ.get('CANVAS_TERM_LABEL')}, "
                       f"current_only={os.environ.get('CANVAS_CURRENT_TERM_ONLY')}, "
                       f"enrollment_states={os.environ.get('CANVAS_ENROLLMENT_STATES')}, "
@@ -1608,14 +3005,14 @@ def run_scrape_and_index(user_id: int, username: str, password: str, headless: b
                       f"per_page={os.environ.get('CANVAS_PER_PAGE')}")
         )
         cb = _status_callback_factory(job_id)
-        _update_job(db, job_id, status="logging_in",
+        jl.status("logging_in",
                     log_line="Fetching all current-term courses (favorites off, per_page=100)")
         # Create a per-job live scrape stream file and expose to scraper
         scrape_path = _scrape_stream_file_path(user_id, job_id)
         with open(scrape_path, "w", encoding="utf-8") as f:
             f.write("")  # truncate/create
         os.environ["OCEAN_SCRAPE_STREAM_PATH"] = scrape_path
-        _update_job(db, job_id, log_line=f"Live scrape stream file: {scrape_path}")
+        jl.log(f"Live scrape stream file: {scrape_path}")
         # Point scraper to a persistent per-user session/profile
         sess_dir = _session_dir(user_id)
         os.environ["OCEAN_PERSIST_SESSION_DIR"] = sess_dir
@@ -1625,106 +3022,53 @@ def run_scrape_and_index(user_id: int, username: str, password: str, headless: b
         else:
             with contextlib.suppress(KeyError):
                 del os.environ["OCEAN_REUSE_SESSION_ONLY"]
-        _update_job(db, job_id, log_line=f"Session dir: {sess_dir} (reuse_only={bool(reuse_session_only)})")
+        jl.log(f"Session dir: {sess_dir} (reuse_only={bool(reuse_session_only)})")
 
 
         call_user = "" if reuse_session_only else username
         call_pass = "" if reuse_session_only else password
+        jl.flush()  # scraper callbacks log through their own sessions
         res = run_canvas_scrape_job(username=call_user, password=call_pass, headless=headless, status_callback=cb)
 
         input_path = (res or {}).get("input_path") or ""
         tmp_root = (res or {}).get("tmp_root") or ""
-        _update_job(db, job_id, log_line=f"Scrape finished. input_path={input_path}")
+        jl.log(f"Scrape finished. input_path={input_path}")
         # Save/refresh warm session for next autoscrape
         try:
             _persist_session(tmp_root, sess_dir)
-            _update_job(db, job_id, log_line="Session persisted for future reuse")
+            jl.log("Session persisted for future reuse")
         except Exception as _e:
             log_exception("persist_session", _e)
 
         if not input_path or not os.path.exists(input_path):
             if reuse_session_only:
-                _update_job(db, job_id, status="skipped", log_line="Autoscrape skipped: session expired / login required (no creds used)")
+                jl.status("skipped", log_line="Autoscrape skipped: session expired / login required (no creds used)")
                 return
-            _update_job(db, job_id, status="failed", log_line="input.txt missing; aborting")
+            jl.status("failed", log_line="input.txt missing; aborting")
             return
-        with open(input_path, "r", encoding="utf-8", errors="ignore") as f:
-            raw = f.read()
-        if not raw.strip():
-            _update_job(db, job_id, status="failed", log_line="input.txt empty; aborting")
+        if not _file_has_text(input_path):
+            jl.status("failed", log_line="input.txt empty; aborting")
             return
-        # Fallback: ensure live stream contains at least the full raw input
-        scrape_path = os.environ.get("OCEAN_SCRAPE_STREAM_PATH", _scrape_stream_file_path(user_id, job_id))
-        try:
-            curr_size = os.path.getsize(scrape_path)
-        except Exception:
-            curr_size = 0
-        if curr_size < len(raw.encode("utf-8")):
-            with open(scrape_path, "a", encoding="utf-8", buffering=1) as f:
-                f.write("\n" + raw)
-                f.flush()
-                os.fsync(f.fileno())
-
-        _update_job(db, job_id, status="compressing",
-                    log_line="Starting streaming compression: ~50,000-token blocks with dynamic global ratio")
-        # Read the live scrape stream as the source for compression
-        with open(scrape_path, "r", encoding="utf-8", errors="ignore") as f:
-            raw_for_compress = f.read()
-        if not raw_for_compress.strip():
-            raw_for_compress = raw  # fail-safe
-        # Stream-compress and finish
-        stream_path = stream_compress_corpus_blocks(raw_for_compress, user_id, job_id, db=db, block_tokens=20000, target_ratio=0.5)
-        _update_job(db, job_id, status="completed", log_line=f"Streaming compression complete: {stream_path}")
-        # Read the rolling stream content and persist to Document to survive dyno restarts
-        try:
-            with open(stream_path, "r", encoding="utf-8", errors="ignore") as f:
-                compressed_text_final = f.read()
-        except Exception:
-            compressed_text_final = raw_for_compress  # best-effort
-        
-                # NEW: Extract classes via gpt-4.1-mini and persist as JSON for the chat UI
-        try:
-            classes = extract_classes_list(compressed_text_final)
-            with open(_classes_file_path(user_id), "w", encoding="utf-8") as f:
-                json.dump(classes, f, ensure_ascii=False, indent=2)
-            _update_job(db, job_id, log_line=f"Detected {len(classes)} course(s); saved classes.json")
-        except Exception as e:
-            log_exception("extract_classes_list", e)
-            _update_job(db, job_id, log_line="WARNING: Failed to extract classes")
-
-        try:
-            classes = extract_classes_list(compressed_text_final)
-            with open(_classes_file_path(user_id), "w", encoding="utf-8") as f:
-                json.dump(classes, f, ensure_ascii=False, indent=2)
-            _update_job(db, job_id, log_line=f"Detected {len(classes)} course(s); saved classes.json")
-        except Exception as e:
-            log_exception("extract_classes_list", e)
-            _update_job(db, job_id, log_line="WARNING: Failed to extract classes")
-
-        # Create document and chunks for semantic retrieval
-        try:
-            doc_id = persist_compressed_and_index(db, user_id, job_id, compressed_text_final)
-            _update_job(db, job_id, log_line=f"Created document and chunks for semantic retrieval: {doc_id}")
-        except Exception as e:
-            log_exception("persist_chunks_real_scrape", e)
-            _update_job(db, job_id, log_line="WARNING: Failed to create chunks for retrieval")
+        _post_scrape_pipeline(db, jl, user_id, job_id, input_path)
 
         # If auto-scrape is enabled, schedule the next run in 24h
         try:
             rec = _get_or_create_auto(db, user_id)
             if rec.enabled:
                 _schedule_next_24h(db, user_id)
-                _update_job(db, job_id, log_line="Auto-scrape scheduled for +24h")
+                jl.log("Auto-scrape scheduled for +24h")
         except Exception as e:
             log_exception("_schedule_next_24h", e)
 
     except Exception as e:
         log_exception("run_scrape_and_index", e)
-        _update_job(db, job_id, status="failed", log_line=f"Exception: {e}")
+        jl.status("failed", log_line=f"Exception: {e}")
     finally:
         with contextlib.suppress(Exception):
             if tmp_root and os.path.exists(tmp_root):
                 shutil.rmtree(tmp_root, ignore_errors=True)
+        with contextlib.suppress(Exception):
+            jl.flush()
         db.close()
 
 # -----------------------------------------------------------------------------
@@ -1801,7 +3145,7 @@ def latest_document_id(db, user_id: int) -> Optional[str]:
     return row.id if row else None
 def latest_job_for_user(db, user_id: int) -> Optional[Job]:
     """
-    Get the user's most recently created job.
+    Get the user's most recently created scrape job (embedding jobs are skipped).
 
     Args:
         db: Database session
@@ -1810,7 +3154,7 @@ def latest_job_for_user(db, user_id: int) -> Optional[Job]:
     Returns:
         Optional[Job]: The latest job object, or None if no jobs exist
     """
-    return db.query(Job).filter(Job.user_id == user_id).order_by(Job.created_at.desc()).first()
+    return db.query(Job).filter(Job.user_id == user_id, _scrape_jobs_only()).order_by(Job.created_at.desc()).first()
 def retrieve_context(db, doc_id: str, question: str, top_k: int, token_budget: int) -> str:
     """
     Retrieve most relevant document chunks using semantic similarity search.
@@ -1831,7 +3175,7 @@ def retrieve_context(db, doc_id: str, question: str, top_k: int, token_budget: i
     Process:
         1. Embeds the question using OpenAI's embedding API
         2. Retrieves all chunks for the document from database
-        3. Calculates cosine similarity between question and each chunk
+        3. Calculates cosine similarity between question and all chunks in one matrix product
         4. Returns top-k most similar chunks, joined and truncated
     """
     qvec_list = openai_embed([question])
@@ -1841,22 +3185,42 @@ def retrieve_context(db, doc_id: str, question: str, top_k: int, token_budget: i
     rows = db.execute(sql_text("""
         SELECT id, text, embedding FROM chunks WHERE document_id = :doc
     """), {"doc": doc_id}).fetchall()
-    scored: List[Tuple[float, str]] = []
-    for _id, text_piece, emb_json in rows:
+    texts: List[str] = []
+    vecs: List[np.ndarray] = []
+    for _id, text_piece, stored in rows:
         try:
-            vec = json.loads(emb_json)
-            sim = cosine_sim(qvec, vec)
-            scored.append((sim, text_piece))
+            vec = _decode_embedding(stored)
         except Exception:
             continue
-    scored.sort(key=lambda t: t[0], reverse=True)
-    #TO DO: investigate if i should get top k 
-    top = [t[1] for t in scored[:max(1, top_k)]]
+        if vec.shape[0] != len(qvec):
+            continue
+        texts.append(text_piece)
+        vecs.append(vec)
+    if not vecs:
+        return ""
+    # Rows are stored unit-norm (normalized at ingest; OpenAI embeddings already are),
+    # so one BLAS matvec over them is the cosine ranking with no per-query norm pass
+    best, _ = _top_k_cosine(qvec, np.vstack(vecs), top_k)
+    top = [texts[i] for i in best]
     joined = "\n\n".join(top)
     packed = truncate_to_tokens(joined, token_budget, CHAT_MODEL)
     if not packed and joined:
         packed = joined[:MAX_CONTEXT_CHARS]
     return packed
+# Static parts of the chat system prompt, built once; only the time and prior questions vary
+_ANSWER_SYSTEM_HEAD = (
+    "You answer ONLY the final question using the provided course materials.\n"
+    "Math formatting rules (MANDATORY):\n"
+    "• Use LaTeX delimiters: inline math with \\( ... \\), display math with \\[ ... \\].\n"
+    "• Do NOT use Unicode subscripts/superscripts (e.g., T₀). Write T_{0}, S^{*}, etc.\n"
+    "• Use \\ln, \\exp, \\Delta, etc. Avoid plain 'ln', 'Δ' if they appear in math.\n"
+    "• Keep units and symbols inside math where appropriate.\n"
+    "Treat any earlier user questions as context only; do not answer them.\n"
+    "Current local time in Ithaca, NY: %s\n\n"
+)
+_ANSWER_SYSTEM_PREV = "Context-only (do NOT answer these):\n%s\n"
+_ANSWER_SYSTEM_TAIL = "Answer ONLY the text under '=== QUESTION ==='."
+
 def answer_with_context(question: str, context_text: str, prev_user_messages: Optional[List[str]] = None) -> str:
     """
     Generate an answer using the full document context and chat history.
@@ -1878,6 +3242,12 @@ def answer_with_context(question: str, context_text: str, prev_user_messages: Op
         3. Sends question + full document to OpenAI chat completion
         4. Returns the AI's response
     """
+    return openai_chat(_answer_payload(question, context_text, prev_user_messages))
+
+def _answer_system_prompt(prev_user_messages: Optional[List[str]] = None) -> str:
+    """
+    System message for a chat answer: fixed rules, the current Ithaca time and the last two prior questions.
+    """
     now_local = _ithaca_now_str()
     prev_blob = ""
     if prev_user_messages:
@@ -1885,18 +3255,16 @@ def answer_with_context(question: str, context_text: str, prev_user_messages: Op
         if items:
             prev_blob = "\n".join(f"- {x}" for x in items)
 
-    system = (
-        "You answer ONLY the final question using the provided course materials.\n"
-        "Math formatting rules (MANDATORY):\n"
-        "• Use LaTeX delimiters: inline math with \\( ... \\), display math with \\[ ... \\].\n"
-        "• Do NOT use Unicode subscripts/superscripts (e.g., T₀). Write T_{0}, S^{*}, etc.\n"
-        "• Use \\ln, \\exp, \\Delta, etc. Avoid plain 'ln', 'Δ' if they appear in math.\n"
-        "• Keep units and symbols inside math where appropriate.\n"
-        "Treat any earlier user questions as context only; do not answer them.\n"
-        f"Current local time in Ithaca, NY: {now_local}\n\n"
-        + (f"Context-only (do NOT answer these):\n{prev_blob}\n" if prev_blob else "")
-        + "Answer ONLY the text under '=== QUESTION ==='."
-    )
+    system = _ANSWER_SYSTEM_HEAD % now_local
+    if prev_blob:
+        system += _ANSWER_SYSTEM_PREV % prev_blob
+    return system + _ANSWER_SYSTEM_TAIL
+
+def _answer_payload(question: str, context_text: str, prev_user_messages: Optional[List[str]] = None) -> dict:
+    """
+    Build the chat completion payload for answer_with_context (and its streaming twin).
+    """
+    system = _answer_system_prompt(prev_user_messages)
 
     user_prompt = (
         "=== QUESTION ===\n"
@@ -1914,9 +3282,15 @@ def answer_with_context(question: str, context_text: str, prev_user_messages: Op
         "messages": messages,
         "temperature": 0.2,
     }
-    return openai_chat(payload)
+    return payload
 
 
+# A backslash plus (optionally) the char that makes it a valid JSON escape
+_BAD_BACKSLASH_RE = re.compile(r'\\(["\\/bfnrtu])?')
+
+def _repair_backslash_match(m: "re.Match") -> str:
+    return m.group(0) if m.group(1) else "\\\\"
+
 def _json_only_guard(text: str):
     r"""
     Try to parse JSON. If it fails, extract the first JSON object/array and
@@ -1924,7 +3298,7 @@ def _json_only_guard(text: str):
     while preserving valid JSON escapes like \n, \t, \\uXXXX, \\ and \\/.
     """
     try:
-        return json.loads(text)
+        return _json_loads(text)
     except Exception:
         pass
 
@@ -1940,174 +3314,296 @@ def _json_only_guard(text: str):
 
     # first retry
     try:
-        return json.loads(candidate)
+        return _json_loads(candidate)
     except Exception:
         pass
 
-    # repair phase: double non-JSON backslashes inside strings
-    def _repair_backslashes(s: str) -> str:
-        out = []
-        in_str = False
-        esc = False
-        quote = ""
-        i = 0
-        while i < len(s):
-            ch = s[i]
-            if not in_str:
-                if ch in ('"', "'"):
-                    in_str = True
-                    quote = ch
-                out.append(ch); i += 1; continue
-            # inside string
-            if esc:
-                out.append(ch); esc = False; i += 1; continue
-            if ch == "\\":
-                # peek next char
-                nxt = s[i+1] if i+1 < len(s) else ""
-                if nxt in ['"', "\\", "/", "b", "f", "n", "r", "t", "u"]:
-                    # valid JSON escape, keep as is; mark escaped
-                    out.append("\\"); esc = True; i += 1; continue
-                # otherwise likely LaTeX (\alpha, \(, \], etc.) -> double it
-                out.append("\\\\"); i += 1; continue
-            if ch == quote:
-                in_str = False; quote = ""
-                out.append(ch); i += 1; continue
-            out.append(ch); i += 1
-        return "".join(out)
-
-    repaired = _repair_backslashes(candidate)
+    # repair phase: double non-JSON backslashes (LaTeX like \alpha, \( ...);
+    # valid escape pairs such as \\ and \n are matched whole and kept
+    repaired = _BAD_BACKSLASH_RE.sub(_repair_backslash_match, candidate)
     try:
-        return json.loads(repaired)
+        return _json_loads(repaired)
     except Exception:
         return None
 
 
+# Memoized extract_classes_list results keyed by blake2b of the (truncated) corpus
+_CLASSES_CACHE: "OrderedDict[bytes, List[str]]" = OrderedDict()
+_CLASSES_CACHE_LOCK = threading.Lock()
+_CLASSES_CACHE_MAX = 64
+
+CLASSES_WINDOW_CHARS = int(os.environ.get("CLASSES_WINDOW_CHARS", "50000"))
+
+def _text_windows(text: str, max_chars: int) -> List[str]:
+    """
+    Split text into windows of at most max_chars, cutting at the last blank line
+    inside each window when there is one.
+    """
+    windows: List[str] = []
+    start, n = 0, len(text)
+    while start < n:
+        end = min(n, start + max_chars)
+        if end < n:
+            cut = text.rfind("\n\n", start, end)
+            if cut > start:
+                end = cut
+        windows.append(text[start:end])
+        start = end
+    return windows
+
 def extract_classes_list(corpus: str) -> List[str]:
     """
     Use gpt-4.1-mini to extract a JSON array of course names/codes.
-    Returns a de-duplicated list of strings.
+    Returns a de-duplicated list of strings; identical corpora are served from cache.
     """
+    cache_key = hashlib.blake2b(corpus[:200_000].encode("utf-8", "ignore"), digest_size=16).digest()
+    with _CLASSES_CACHE_LOCK:
+        hit = _CLASSES_CACHE.get(cache_key)
+        if hit is not None:
+            _CLASSES_CACHE.move_to_end(cache_key)
+            return list(hit)
     system = (
         "You extract course names from Canvas-like text. Courses that are very similar (i.e. GOVT 1111 COMBINED-XLIST Introduction to American Government and Politics (2025FA) as the first course and GOVT 1111 - Introduction to American Government and Politics as the second course should be grouped into the same course. Find ALL courses the user is taking."
         "Return a JSON array of strings (course titles/codes). Output JSON ONLY."
     )
-    user = f"Text (may be noisy):\n{corpus[:200_000]}"
-    payload = {
-        "model": "gpt-4.1-mini",
-        "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": user}
-        ],
-        "temperature": 0
-    }
-    out = openai_chat(payload) or "[]"
-    obj = _json_only_guard(out) or []
-    if not isinstance(obj, list):
-        return []
-    cleaned = []
-    seen = set()
-    for it in obj:
-        if isinstance(it, str):
-            s = it.strip()
-            key = s.lower()
-            if s and key not in seen:
-                seen.add(key); cleaned.append(s)
+    # Long corpora: one request per window, issued concurrently, results merged in order
+    windows = [w for w in _text_windows(corpus[:200_000], max(1, CLASSES_WINDOW_CHARS)) if w.strip()]
+    payloads = [
+        {
+            "model": "gpt-4.1-mini",
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": f"Text (may be noisy):\n{w}"}
+            ],
+            "temperature": 0
+        }
+        for w in windows
+    ]
+    if len(payloads) == 1:
+        outs = [openai_chat(payloads[0])]
+    else:
+        outs = asyncio.run(_openai_chat_many_async(payloads)) if payloads else []
+    names: List[str] = []
+    for out in outs:
+        obj = _json_only_guard(out or "[]") or []
+        if isinstance(obj, list):
+            names.extend(s for s in (it.strip() for it in obj if isinstance(it, str)) if s)
+    # Case-insensitive dedup, first spelling wins, order kept; the dict work runs in C
+    keys = [s.lower() for s in names]
+    first = dict(zip(reversed(keys), reversed(names)))
+    cleaned = [first[k] for k in dict.fromkeys(keys)]
+    if cleaned:
+        # empty results may be transient API failures; don't pin them
+        with _CLASSES_CACHE_LOCK:
+            _CLASSES_CACHE[cache_key] = list(cleaned)
+            _CLASSES_CACHE.move_to_end(cache_key)
+            while len(_CLASSES_CACHE) > _CLASSES_CACHE_MAX:
+                _CLASSES_CACHE.popitem(last=False)
     return cleaned
-def generate_practice_test(course: str, corpus: str) -> Dict[str, any]:
-    system = (
-        "You write focused practice tests with answer keys. Output JSON only. "
-        "Don't cover syllabus information; focus on class content (prefer recent). "
-        "Math formatting rules (MANDATORY): "
-        "Use LaTeX delimiters (\\( ... \\), \\[ ... \\]); no Unicode super/subscripts; "
-        "use \\ln, \\exp, \\Delta, etc."
-    )
+# Static instruction prefixes (no interpolation) so OpenAI's automatic prompt cache can reuse them
+_PRACTICE_TEST_SYSTEM = (
+    "You write focused practice tests with answer keys. Output JSON only. "
+    "Don't cover syllabus information; focus on class content (prefer recent). "
+    "Math formatting rules (MANDATORY): "
+    "Use LaTeX delimiters (\\( ... \\), \\[ ... \\]); no Unicode super/subscripts; "
+    "use \\ln, \\exp, \\Delta, etc.\n\n"
+    "Create a test for the course named at the end of the user message, using the CONTEXT.\n\n"
+    "Return JSON ONLY with exactly this shape:\n"
+    "{\n"
+    '  "title": "Practice Test — <course name>",\n'
+    '  "questions": [\n'
+    '    {"id":1,"question":"...","answer":"..."},\n'
+    '    {"id":2,"question":"...","answer":"..."}\n'
+    "  ]\n"
+    "}\n\n"
+    "Rules:\n"
+    "- 8–12 self-contained questions\n"
+    "- No markdown or commentary outside JSON."
+)
+_FLASHCARDS_SYSTEM = (
+    "You generate compact study flashcards. Output JSON only.\n\n"
+    "Create 100 high-yield flashcards for the course named at the end of the user message, "
+    "using the CONTEXT.\n\n"
+    "Return JSON ONLY with this shape:\n"
+    '{"flashcards":[{"front":"...","back":"..."}, ...]}\n\n'
+    "Rules:\n"
+    "- <= 30 words each side\n"
+    "- No markdown, no commentary beyond JSON."
+)
 
-    # Put instructions + context into one user message to reduce drift
-    user = f"""Create a test for "{course}".
+@functools.lru_cache(maxsize=8)
+def _study_corpus(corpus: str) -> str:
+    """
+    Cut the study corpus to STUDY_CONTEXT_TOKENS on a token boundary.
+
+    Memoized because the practice test, flashcards and their cache keys all slice
+    the same corpus.
+    """
+    # ~4 chars/token on average; 2x headroom keeps the encode bounded on huge corpora
+    head = corpus[:STUDY_CONTEXT_TOKENS * 8]
+    try:
+        toks, enc = encode_text(head, "gpt-4.1")
+    except Exception:
+        return corpus[:STUDY_CONTEXT_TOKENS * 4]
+    if len(toks) <= STUDY_CONTEXT_TOKENS:
+        return head
+    return decode_tokens(toks[:STUDY_CONTEXT_TOKENS], enc)
 
-Return JSON ONLY with exactly this shape:
-{{
-  "title": "Practice Test — {course}",
-  "questions": [
-    {{"id":1,"question":"...","answer":"..."}},
-    {{"id":2,"question":"...","answer":"..."}}
-  ]
-}}
+def _study_user_message(course: str, corpus: str) -> str:
+    # Corpus before course: the same user's corpus is shared across courses, so it stays in the cached prefix
+    return f"CONTEXT:\n{_study_corpus(corpus)}\n\nCourse: {course}"
 
-Rules:
-- 8–12 self-contained questions
-- No markdown or commentary outside JSON.
+def _llm_cache_path(kind: str, course: str, corpus: str) -> str:
+    """
+    Content-addressed cache file for a study artifact.
 
-CONTEXT:
-{corpus[:120_000]}
-"""
+    The key covers the generator kind, course and the exact corpus slice sent to
+    the model, so a new scrape (different corpus) never hits a stale entry.
+    """
+    key = hashlib.blake2b(f"{kind}|{course}|{_study_corpus(corpus)}".encode("utf-8", "ignore"), digest_size=20).hexdigest()
+    return os.path.join(LLM_CACHE_DIR, f"{kind}_{key}.json")
+
+def _llm_cache_get(kind: str, course: str, corpus: str):
+    """
+    Return a cached artifact younger than LLM_CACHE_TTL, or None.
+    """
+    if LLM_CACHE_TTL <= 0:
+        return None
+    path = _llm_cache_path(kind, course, corpus)
+    try:
+        if time.time() - os.path.getmtime(path) > LLM_CACHE_TTL:
+            return None
+        with open(path, "rb") as f:
+            return _json_loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+def _llm_cache_put(kind: str, course: str, corpus: str, value) -> None:
+    if LLM_CACHE_TTL <= 0:
+        return
+    try:
+        os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+        _atomic_write_text(_llm_cache_path(kind, course, corpus), json.dumps(value, ensure_ascii=False), fsync=False)
+    except Exception as e:
+        log_exception("llm_cache_put", e)
 
+def _practice_test_payload(course: str, corpus: str) -> dict:
     payload = {
         "model": "gpt-4.1",
         "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": user}
+            {"role": "system", "content": _PRACTICE_TEST_SYSTEM},
+            {"role": "user", "content": _study_user_message(course, corpus)}
         ],
         "temperature": 0.4,
         # Give the model room and force JSON
         "max_tokens": 3000,
         "response_format": {"type": "json_object"}
     }
+    return payload
 
-    out = openai_chat(payload) or "{}"
-    obj = _json_only_guard(out)
+def _parse_practice_test(course: str, out: str) -> Dict[str, any]:
+    obj = _json_only_guard(out or "{}")
     if isinstance(obj, dict) and "questions" in obj:
         return obj
     return {"title": f"Practice Test — {course}", "questions": []}
 
-def generate_flashcards(course: str, corpus: str) -> List[Dict[str, str]]:
-    system = "You generate compact study flashcards. Output JSON only."
-    user = f"""Create 100 high-yield flashcards for this course:
-Course: {course}
-
-Return JSON ONLY with this shape:
-{{"flashcards":[{{"front":"...","back":"..."}}, ...]}}
-
-Rules:
-- <= 30 words each side
-- No markdown, no commentary beyond JSON.
-
-CONTEXT:
-{corpus[:120_000]}
-"""
+def generate_practice_test(course: str, corpus: str) -> Dict[str, any]:
+    cached = _llm_cache_get("practice", course, corpus)
+    if cached is not None:
+        return cached
+    test = _parse_practice_test(course, openai_chat(_practice_test_payload(course, corpus)))
+    if test.get("questions"):
+        _llm_cache_put("practice", course, corpus, test)
+    return test
+
+def _flashcards_payload(course: str, corpus: str) -> dict:
     payload = {
         "model": "gpt-4.1",
         "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": user}
+            {"role": "system", "content": _FLASHCARDS_SYSTEM},
+            {"role": "user", "content": _study_user_message(course, corpus)}
         ],
         "temperature": 0.4,
         "max_tokens": 1800,
         "response_format": {"type": "json_object"}
     }
-    out = openai_chat(payload) or "{}"
-    obj = _json_only_guard(out) or {}
+    return payload
+
+def _parse_flashcards(out: str) -> List[Dict[str, str]]:
+    obj = _json_only_guard(out or "{}") or {}
     cards = obj.get("flashcards", []) if isinstance(obj, dict) else []
     return [c for c in cards if isinstance(c, dict) and "front" in c and "back" in c]
 
+def generate_flashcards(course: str, corpus: str) -> List[Dict[str, str]]:
+    cached = _llm_cache_get("flashcards", course, corpus)
+    if cached is not None:
+        return cached
+    cards = _parse_flashcards(openai_chat(_flashcards_payload(course, corpus)))
+    if cards:
+        _llm_cache_put("flashcards", course, corpus, cards)
+    return cards
+
+def generate_bundle(course: str, corpus: str) -> Tuple[Dict[str, any], List[Dict[str, str]]]:
+    """
+    Generate a practice test and flashcards for one course concurrently.
+
+    Both requests go out together through the shared async OpenAI path (same
+    concurrency cap, token bucket and 429 backoff as compression), so latency is
+    the slower of the two rather than their sum.
+
+    Args:
+        course (str): Course name the artifacts are for
+        corpus (str): Course materials used as context
+
+    Returns:
+        Tuple[Dict[str, any], List[Dict[str, str]]]: (practice test, flashcards)
+    """
+    test = _llm_cache_get("practice", course, corpus)
+    cards = _llm_cache_get("flashcards", course, corpus)
+    if test is None and cards is None:
+        test_out, cards_out = asyncio.run(_openai_chat_many_async([
+            _practice_test_payload(course, corpus),
+            _flashcards_payload(course, corpus),
+        ]))
+        test, cards = _parse_practice_test(course, test_out), _parse_flashcards(cards_out)
+        if test.get("questions"):
+            _llm_cache_put("practice", course, corpus, test)
+        if cards:
+            _llm_cache_put("flashcards", course, corpus, cards)
+        return test, cards
+    # partial hit: only the missing artifact needs a request
+    if test is None:
+        test = generate_practice_test(course, corpus)
+    if cards is None:
+        cards = generate_flashcards(course, corpus)
+    return test, cards
+
 
 # -----------------------------------------------------------------------------
 # Minimal HTML helpers
 # -----------------------------------------------------------------------------
 # 2) Add a helper (place near other helpers)
-def _ithaca_now_str() -> str:
+_ITHACA_TZ = ZoneInfo("America/New_York")
+
+@functools.lru_cache(maxsize=2)
+def _ithaca_time_str(epoch_min: int) -> str:
     """
-    Return current date/time in Ithaca, NY, e.g.
-    'Saturday, September 13, 2025, 03:32 PM EDT (UTC-04:00)'
+    Format the given epoch minute in Ithaca local time (memoized; the string has minute precision).
     """
-    tz = ZoneInfo("America/New_York")
-    now = datetime.datetime.now(tz)
+    now = datetime.datetime.fromtimestamp(epoch_min * 60, _ITHACA_TZ)
     off = now.strftime("%z")  # e.g. -0400
     off_fmt = f"{off[:3]}:{off[3:]}" if len(off) == 5 else off
     return now.strftime(f"%A, %B %d, %Y, %I:%M %p %Z (UTC{off_fmt})")
 
-def ocean_layout(title: str, body_html: str) -> str:
-    return f"""
+def _ithaca_now_str() -> str:
+    """
+    Return current date/time in Ithaca, NY, e.g.
+    'Saturday, September 13, 2025, 03:32 PM EDT (UTC-04:00)'
+    """
+    return _ithaca_time_str(int(time.time()) // 60)
+
+# Shared page shell (plain string, no f-string escaping); {title} and {body} are the only slots
+_OCEAN_TPL = """
 <!doctype html>
 <html>
 <head>
@@ -2117,26 +3613,26 @@ def ocean_layout(title: str, body_html: str) -> str:
 
 <!-- MathJax v3 config + loader -->
 <script>
-window.MathJax = {{
-  tex: {{
+window.MathJax = {
+  tex: {
     inlineMath: [['\\\\(','\\\\)'], ['$', '$']],
     displayMath: [['\\\\[','\\\\]'], ['$$','$$']],
     processEscapes: true
-  }},
-  options: {{
+  },
+  options: {
     // Only process elements with this class:
     processHtmlClass: 'mathjax-target',
     // Ignore things like code/pre automatically:
     skipHtmlTags: ['script','noscript','style','textarea','pre','code'],
     ignoreHtmlClass: 'tex2jax_ignore'
-  }}
-}};
+  }
+};
 </script>
 <script id="MathJax-script" async
   src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-chtml.js"></script>
 
 <style>
-:root {{
+:root {
   --ocean-bg1:#031a26;
   --ocean-bg2:#062a3f;
   --ocean-bg3:#0a3a52;
@@ -2146,9 +3642,9 @@ window.MathJax = {{
   --ocean-accent-2:#3dd6c6;
   --ocean-border:rgba(81,164,204,0.25);
   --glass:rgba(8,24,36,0.55);
-}}
-* {{ box-sizing: border-box; }}
-body {{
+}
+* { box-sizing: border-box; }
+body {
   font-family: system-ui, -apple-system, Segoe UI, Roboto, sans-serif;
   margin:0;
   color:var(--ocean-ink);
@@ -2157,11 +3653,11 @@ body {{
     radial-gradient(1000px 600px at 100% 0%, #0a3f5c 0%, rgba(10,63,92,0) 50%),
     linear-gradient(180deg, var(--ocean-bg1) 0%, var(--ocean-bg2) 45%, var(--ocean-bg3) 100%);
   background-attachment: fixed, fixed, fixed;
-}}
-a {{ color:var(--ocean-accent); text-decoration:none; }}
-a:hover {{ text-decoration:underline; }}
-.container {{ max-width: 980px; margin: 0 auto; padding: 28px; }}
-.card {{
+}
+a { color:var(--ocean-accent); text-decoration:none; }
+a:hover { text-decoration:underline; }
+.container { max-width: 980px; margin: 0 auto; padding: 28px; }
+.card {
   background: var(--glass);
   border: 1px solid var(--ocean-border);
   border-radius: 14px;
@@ -2170,8 +3666,8 @@ a:hover {{ text-decoration:underline; }}
   box-shadow: 0 10px 30px rgba(0,0,0,0.35), inset 0 1px 0 rgba(255,255,255,0.04);
   backdrop-filter: blur(10px);
   -webkit-backdrop-filter: blur(10px);
-}}
-.btn {{
+}
+.btn {
   display: inline-block;
   color: #fff;
   padding: 11px 16px;
@@ -2180,17 +3676,17 @@ a:hover {{ text-decoration:underline; }}
   background: linear-gradient(135deg, #1aa3ff 0%, #0fb0b5 100%);
   box-shadow: 0 8px 16px rgba(16, 136, 178, 0.35), inset 0 1px 0 rgba(255,255,255,0.12);
   transition: transform .12s ease, box-shadow .12s ease, filter .12s ease, background .12s ease;
-}}
-.btn:hover {{
+}
+.btn:hover {
   transform: translateY(-1px);
   box-shadow: 0 12px 22px rgba(16, 136, 178, 0.45), inset 0 1px 0 rgba(255,255,255,0.18);
   filter: brightness(1.04);
-}}
-.btn:active {{
+}
+.btn:active {
   transform: translateY(0);
   box-shadow: 0 6px 12px rgba(16,136,178,0.30);
-}}
-input, textarea {{
+}
+input, textarea {
   width: 100%;
   padding: 11px 12px;
   border-radius: 10px;
@@ -2199,18 +3695,18 @@ input, textarea {{
   color: var(--ocean-ink);
   outline: none;
   transition: border-color .15s ease, box-shadow .15s ease, background .15s ease;
-}}
-input::placeholder, textarea::placeholder {{ color: var(--ocean-muted); }}
-input:focus, textarea:focus {{
+}
+input::placeholder, textarea::placeholder { color: var(--ocean-muted); }
+input:focus, textarea:focus {
   border-color: var(--ocean-accent);
   box-shadow: 0 0 0 3px rgba(57,193,255,0.15);
   background: rgba(3,22,34,0.75);
-}}
-table {{ width:100%; border-collapse:collapse; }}
-th, td {{ text-align:left; padding:10px 8px; border-bottom:1px solid var(--ocean-border); vertical-align:top; }}
-tbody tr:nth-child(even) {{ background: rgba(255,255,255,0.02); }}
-.mono {{ font-family: ui-monospace, SFMono-Regular, Menlo, Consolas, monospace; }}
-.badge {{
+}
+table { width:100%; border-collapse:collapse; }
+th, td { text-align:left; padding:10px 8px; border-bottom:1px solid var(--ocean-border); vertical-align:top; }
+tbody tr:nth-child(even) { background: rgba(255,255,255,0.02); }
+.mono { font-family: ui-monospace, SFMono-Regular, Menlo, Consolas, monospace; }
+.badge {
   display:inline-block;
   padding:6px 10px;
   font-size:12px;
@@ -2218,9 +3714,9 @@ tbody tr:nth-child(even) {{ background: rgba(255,255,255,0.02); }}
   border-radius: 999px;
   border:1px solid rgba(255,255,255,0.12);
   background: linear-gradient(180deg, rgba(23,56,75,0.75) 0%, rgba(15,42,58,0.65) 100%);
-}}
-.duo {{ font-size:18px; font-weight:700; color:#ffe066; }}
-.duo-banner {{
+}
+.duo { font-size:18px; font-weight:700; color:#ffe066; }
+.duo-banner {
   font-size: 32px;
   font-weight: 900;
   color: #ffe066;
@@ -2230,29 +3726,37 @@ tbody tr:nth-child(even) {{ background: rgba(255,255,255,0.02); }}
   border: 1px solid rgba(255, 224, 102, 0.35);
   text-align: center;
   letter-spacing: 1px;
-}}
-h1, h2, h3 {{ margin: 6px 0 14px; }}
+}
+h1, h2, h3 { margin: 6px 0 14px; }
 
 /* Optional: make MathJax text inherit your color scheme a bit better */
-.MathJax, .mjx-chtml {{ color: var(--ocean-ink); }}
+.MathJax, .mjx-chtml { color: var(--ocean-ink); }
 </style>
 </head>
 <body>
   <div class="container mathjax-target">
-    {body_html}
+    {body}
   </div>
 
   <script>
-  document.addEventListener('DOMContentLoaded', function () {{
-    if (window.MathJax && MathJax.typesetPromise) {{
+  document.addEventListener('DOMContentLoaded', function () {
+    if (window.MathJax && MathJax.typesetPromise) {
       MathJax.typesetPromise();
-    }}
-  }});
+    }
+  });
   </script>
 </body>
 </html>
 """.strip()
 
+# Split the static shell once at its two insertion points
+_OCEAN_PREFIX, _ocean_rest = _OCEAN_TPL.split("{title}", 1)
+_OCEAN_MID, _OCEAN_SUFFIX = _ocean_rest.split("{body}", 1)
+del _ocean_rest
+
+def ocean_layout(title: str, body_html: str) -> str:
+    return _OCEAN_PREFIX + title + _OCEAN_MID + body_html + _OCEAN_SUFFIX
+
 
 # -----------------------------------------------------------------------------
 # Auth routes
@@ -2434,11 +3938,27 @@ def login_callback():
 
 @app.route("/logout")
 def logout():
+    # Chat history lives server-side now, so clearing the cookie alone would keep it
+    uid = session.get("user_id")
+    if uid is not None:
+        with contextlib.suppress(OSError):
+            os.remove(_chat_history_path(uid))
     session.clear()
     return redirect(url_for("login"))
 # -----------------------------------------------------------------------------
 # Dashboard and job control (adds Test Scrape button) + Live Duo banner
 # -----------------------------------------------------------------------------
+# One dashboard job row; filled with str.format_map so the template is parsed once
+_JOB_ROW_TPL = """
+<tr>
+  <td><span class="mono">{display_id}</span>{badge}</td>
+  <td>{status}{duo}</td>
+  <td><span class="mono">{updated}</span></td>
+  <td><a class="btn" href="/job/{id}">Open</a></td>
+</tr>
+"""
+_JOB_ROW_EXT_BADGE = "<span class='badge' style='background:#4CAF50;color:white;font-size:10px;padding:2px 6px;border-radius:10px;margin-left:6px;'>Extension</span>"
+
 @app.route("/")
 @login_required
 def dashboard():
@@ -2455,37 +3975,31 @@ def dashboard():
     db = SessionLocal()
     try:
         u = current_user(db)
-        # Get regular user jobs
-        user_jobs = db.query(Job).filter(Job.user_id == u.id).order_by(Job.created_at.desc()).limit(8).all()
-        # Get recent session-based jobs (temp user IDs > 100000)
-        session_jobs = db.query(Job).filter(Job.user_id > 100000).order_by(Job.created_at.desc()).limit(4).all()
-        # Combine and sort by creation time
-        all_jobs = sorted(user_jobs + session_jobs, key=lambda x: x.created_at or datetime.datetime.min, reverse=True)[:12]
-        jobs = all_jobs
+        # The user's 8 newest jobs plus the 4 newest session-based jobs (temp user IDs > 100000),
+        # combined with UNION ALL so other users' session jobs can't crowd out the user's own; one query
+        own_jobs = (select(Job.id).where(Job.user_id == u.id, _scrape_jobs_only())
+                    .order_by(Job.created_at.desc()).limit(8).subquery())
+        session_jobs = (select(Job.id).where(Job.user_id > 100000, _scrape_jobs_only())
+                        .order_by(Job.created_at.desc()).limit(4).subquery())
+        job_ids = union_all(select(own_jobs.c.id), select(session_jobs.c.id))
+        jobs = db.query(Job).filter(Job.id.in_(job_ids)).order_by(Job.created_at.desc()).limit(12).all()
         last_job = latest_job_for_user(db, u.id)
         stream_ready = False
         if last_job:
-            stream_ready = os.path.exists(_stream_file_path(u.id, last_job.id))
+            stream_ready = _stream_file_ready(u.id, last_job.id)
         rows = []
         for j in jobs:
             duo = (j.duo_code or "").strip()
-            duo_html = f"<div class='duo'>DUO CODE: {duo}</div>" if duo else ""
-
-            # Determine if this is a session-based job
-            is_session_job = j.user_id > 100000
-            job_type_badge = "<span class='badge' style='background:#4CAF50;color:white;font-size:10px;padding:2px 6px;border-radius:10px;margin-left:6px;'>Extension</span>" if is_session_job else ""
-
-            # Format job ID for display
-            display_id = j.id[:8] + "..." if len(j.id) > 12 else j.id
-
-            rows.append(f"""
-<tr>
-  <td><span class="mono">{display_id}</span>{job_type_badge}</td>
-  <td>{j.status or ''}{' ' + duo_html if duo_html else ''}</td>
-  <td><span class="mono">{(j.updated_at or j.created_at).strftime('%Y-%m-%d %H:%M:%S')}</span></td>
-  <td><a class="btn" href="/job/{j.id}">Open</a></td>
-</tr>
-""")
+            rows.append(_JOB_ROW_TPL.format_map({
+                "id": j.id,
+                # Format job ID for display
+                "display_id": j.id[:8] + "..." if len(j.id) > 12 else j.id,
+                # Session-based (extension) jobs get a badge
+                "badge": _JOB_ROW_EXT_BADGE if j.user_id > 100000 else "",
+                "status": j.status or "",
+                "duo": f" <div class='duo'>DUO CODE: {duo}</div>" if duo else "",
+                "updated": (j.updated_at or j.created_at).isoformat(" ", "seconds"),
+            }))
         jobs_html = f"""
 <div class="card">
   <h2>Jobs</h2>
@@ -2550,27 +4064,7 @@ def dashboard():
   </form>
 </div>
 {jobs_html}
-<script>
-(function() {{
-  const container = document.getElementById('duo-container');
-  const banner = document.getElementById('duo-banner');
-  async function poll() {{
-    try {{
-      const r = await fetch('/latest_duo', {{ headers: {{ 'Cache-Control': 'no-cache' }} }});
-      if (!r.ok) return;
-      const data = await r.json();
-      if (data && data.duo_code && data.duo_code.trim() !== '') {{
-        container.style.display = 'block';
-        banner.textContent = 'DUO CODE: ' + data.duo_code.trim();
-      }} else {{
-        container.style.display = 'none';
-      }}
-    }} catch (e) {{}}
-  }}
-  poll();
-  setInterval(poll, 1500);
-}})();
-</script>
+<script src="{url_for('static', filename='duo_poller.js')}" defer></script>
 """.strip()
 
         return ocean_layout("Dashboard • Ocean Canvas Assistant", body)
@@ -2578,9 +4072,8 @@ def dashboard():
         db.close()
 
 def _append_job_log(db, job: Job, kind: str, message: str):
-    now = datetime.datetime.utcnow().isoformat()
-    line = f"[{now}] {kind}: {message}\n"
-    job.log = (job.log or "") + line
+    # Append-only file write; never read-modify-write the Job.log column
+    _append_job_log_file(job.id, f"{kind}: {message}")
     job.updated_at = datetime.datetime.utcnow()
     db.add(job)
     db.commit()
@@ -2600,6 +4093,8 @@ def auto_toggle():
             rec.next_run_at = None
         rec.updated_at = _now_utc()
         db.add(rec); db.commit()
+        if enabled:
+            _scheduler_wakeup.set()
         return redirect(url_for("dashboard"))
     finally:
         db.close()
@@ -2615,7 +4110,7 @@ def start_job():
         headless = True if request.form.get("headless") else False
         if not username or not password:
             return ocean_layout("Start Job", "<div class='card'>NetID and password required.</div>"), 400
-        job_id = uuid.uuid4().hex[:16]
+        job_id = secrets.token_hex(8)
         job = Job(
             id=job_id,
             user_id=u.id,
@@ -2633,21 +4128,14 @@ def start_job():
             auto.username = username or auto.username
             auto.password_enc = ""  # purge any previously stored cred
             auto.headless = bool(headless)
-            auto.updated_at = _now_utc()
+            now = _now_utc()
+            auto.updated_at = now
             if not auto.next_run_at:
-                auto.next_run_at = _now_utc() + datetime.timedelta(hours=24)
+                auto.next_run_at = now + datetime.timedelta(hours=24)
             db.add(auto); db.commit()
 
 
-        def worker():
-            # Queue: wait for slot, then run; always release
-            _wait_for_job_slot(job_id)
-            try:
-                run_scrape_and_index(u.id, username, password, headless, job_id)
-            finally:
-                _release_job_slot()
-        t = threading.Thread(target=worker, name=f"scrape-{job_id}", daemon=True)
-        t.start()
+        _submit_job(job_id, run_scrape_and_index, u.id, username, password, headless, job_id)
         return redirect(url_for("dashboard"))
     finally:
         db.close()
@@ -2657,7 +4145,7 @@ def start_test():
     db = SessionLocal()
     try:
         u = current_user(db)
-        job_id = uuid.uuid4().hex[:16]
+        job_id = secrets.token_hex(8)
         job = Job(
             id=job_id,
             user_id=u.id,
@@ -2668,15 +4156,7 @@ def start_test():
         )
         db.add(job)
         db.commit()
-        def worker():
-            # Queue: wait for slot, then run; always release
-            _wait_for_job_slot(job_id)
-            try:
-                run_test_and_index(u.id, job_id)
-            finally:
-                _release_job_slot()
-        t = threading.Thread(target=worker, name=f"test-{job_id}", daemon=True)
-        t.start()
+        _submit_job(job_id, run_test_and_index, u.id, job_id)
         return redirect(url_for("dashboard"))
     finally:
         db.close()
@@ -2697,6 +4177,11 @@ def job_detail(job_id):
         is_session_job = job.user_id > 100000
         session_badge = "<span style='background:#4CAF50;color:white;font-size:12px;padding:4px 8px;border-radius:12px;margin-left:10px;'>Extension Job</span>" if is_session_job else ""
 
+        tail = _read_job_log_since(job.id)
+        # The poller continues from this byte offset; legacy DB logs are re-polled whole
+        log_offset = tail[1] if tail is not None else ""
+        # File text is kept unstripped so appended chunks continue on a fresh line
+        log_text = (tail[0] if tail is not None else _read_job_log(job.id, job.log).strip()) or '(no logs yet)'
         duo_html = f"<div class='duo'>DUO CODE: {job.duo_code}</div>" if (job.duo_code or "").strip() else ("<div class='badge'>No Duo code (extension job)</div>" if is_session_job else "<div class='badge'>No Duo code captured yet.</div>")
         # In job_detail(job_id), replace the body HTML with IDs and add the poller:
         body = f"""
@@ -2708,29 +4193,9 @@ def job_detail(job_id):
         </div>
         <div class="card">
           <h3>Logs</h3>
-          <pre id="job-log" class="mono" style="white-space:pre-wrap;">{sanitize_db_text(job.log or '').strip() or '(no logs yet)'}</pre>
+          <pre id="job-log" class="mono" style="white-space:pre-wrap;" data-job-id="{job.id}" data-log-offset="{log_offset}">{log_text}</pre>
         </div>
-        <script>
-        (function() {{
-          async function poll() {{
-            try {{
-              const r = await fetch('/job_state/{job.id}', {{ headers: {{ 'Cache-Control': 'no-cache' }} }});
-              if (!r.ok) return;
-              const data = await r.json();
-              const logEl = document.getElementById('job-log');
-              const statusEl = document.getElementById('job-status');
-              if (statusEl && typeof data.status === 'string') {{
-                statusEl.textContent = data.status;
-              }}
-              if (logEl && typeof data.log === 'string') {{
-                logEl.textContent = data.log.trim() || '(no logs yet)';
-              }}
-            }} catch (e) {{}}
-          }}
-          poll();
-          setInterval(poll, 1500);
-        }})();
-        </script>
+        <script src="{url_for('static', filename='job_poller.js')}" defer></script>
         """
         return ocean_layout("Job â€¢ Ocean Canvas Assistant", body)
     finally:
@@ -2739,6 +4204,273 @@ def job_detail(job_id):
 # Chat (always attach the entire compressed Document.content to each query)
 #   Updated: keep input box open; include last 2 user messages in request
 # -----------------------------------------------------------------------------
+def _load_chat_context(db, user_id: int, canvas_data_json: str = None) -> str:
+    """
+    Load context from extension's localStorage (preferred) or fallback to database.
+
+    Args:
+        db: Database session
+        user_id: The current user's ID
+        canvas_data_json: JSON string from extension's chrome.storage.local
+
+    Returns:
+        str: Combined course content text
+
+    Process:
+        1. If canvas_data provided from extension, parse and combine all courses
+        2. Fallback: Load from database (old method)
+    """
+    # Try loading from extension data first
+    if canvas_data_json:
+        try:
+            canvas_data = _json_loads(canvas_data_json)
+            courses = canvas_data.get('courses', {})
+
+            if courses:
+                # Collect pieces and join once; += on a multi-MB str reallocates every step
+                rule = "=" * 80
+                parts: List[str] = []
+                for course_id, course_info in courses.items():
+                    parts.append(f"\n\n{rule}\nCOURSE: {course_info.get('name', 'Unknown')} (ID: {course_id})\n{rule}\n\n")
+
+                    pages = course_info.get('pages', {})
+                    for page_name, page_data in pages.items():
+                        parts.append(f"\n--- {page_name.upper()} ---\n")
+                        parts.append(page_data.get('content', ''))
+                        parts.append("\n\n")
+
+                logger.info(f"[CHAT] Loaded {len(courses)} courses from extension localStorage")
+                return "".join(parts).strip()
+        except Exception as e:
+            logger.error(f"[CHAT] Failed to parse extension data: {e}")
+
+    # Fallback to database method
+    last_job = latest_job_for_user(db, user_id)
+    if last_job:
+        stream_path = _stream_file_path(user_id, last_job.id)
+        if os.path.exists(stream_path):
+            with open(stream_path, "r", encoding="utf-8", errors="ignore") as f:
+                s = f.read().strip()
+                if s:
+                    logger.info("[CHAT] Loaded context from stream file (database fallback)")
+                    return s
+    # fallback to DB-backed Document
+    doc_id = latest_document_id(db, user_id)
+    if doc_id:
+        row = db.query(Document).filter(Document.id == doc_id).first()
+        logger.info("[CHAT] Loaded context from Document table (database fallback)")
+        return (row.content or "").strip()
+
+    return ""
+
+def _chat_retrieve(question: str, rag_index_json: Optional[str], load_full_context: Callable[[], str],
+                   rag_index_key: Optional[str] = None) -> Tuple[str, Dict[str, any]]:
+    """
+    Select the chunks most relevant to a chat question and pack them as answer context.
+
+    Uses the extension's pre-computed RAG index when one is posted; otherwise
+    splits and embeds the full course context on the fly (slower).
+
+    Args:
+        question: User's question
+        rag_index_json: Posted RAG index JSON from the extension, or None
+        load_full_context: Returns the full course text (only called without an index)
+        rag_index_key: sha256 key of an index posted earlier (used when rag_index_json is absent)
+
+    Returns:
+        Tuple[str, Dict[str, any]]: Context text within the token budget, and the
+        debug info shown under the answer
+
+    Raises:
+        LookupError: With a user-facing message when there is nothing to search
+    """
+    logger.debug(f"[CHAT] Question: {question[:100]}...")
+    if rag_index_json or rag_index_key:
+        # Use pre-computed embeddings from extension
+        logger.info("[CHAT] Using pre-computed RAG index from extension")
+        if rag_index_json:
+            indexed_chunks, indexed_embeddings = _load_rag_index(rag_index_json)
+        else:
+            indexed_chunks, indexed_embeddings = _cached_rag_index(rag_index_key) or ([], None)
+        if not indexed_chunks:
+            raise Exception("RAG index is empty")
+        logger.info(f"[CHAT] Using {len(indexed_chunks)} pre-indexed chunks")
+
+        # 1. Embed the question only
+        question_embedding = openai_embed([question])
+        if not question_embedding:
+            raise Exception("Failed to embed question")
+
+        # 2-3. Cosine similarity against the pre-normalized matrix; top-k only
+        best, best_scores = _top_k_cosine(question_embedding[0], indexed_embeddings, TOP_K)
+        top_chunks = [indexed_chunks[i] for i in best]
+        top_scores = best_scores.tolist()
+        preview = 5
+    else:
+        # Fallback: Load context and compute embeddings on-the-fly (slower)
+        full_context = load_full_context()
+        if not full_context:
+            raise LookupError("No course data found. Please scrape your Canvas courses using the extension or start a scrape job.")
+        logger.info(f"[CHAT] Full context: {len(full_context)} chars (embeddings computed on-the-fly, cached per context)")
+
+        # 1. Chunks + embeddings for this exact context (split/embedded once, then cached)
+        text_chunks, unit_rows = _context_rag_index(full_context)
+        if not text_chunks:
+            raise LookupError("No content to search. Please try scraping again.")
+
+        # 2. Embed the question
+        question_embedding = openai_embed([question])
+        if not question_embedding:
+            raise Exception("Failed to embed question")
+
+        # 3. Cosine similarity in one vectorized pass; top-k only
+        best, _ = _top_k_cosine(question_embedding[0], unit_rows, TOP_K)
+        top_chunks = [text_chunks[i] for i in best]
+        top_scores = None
+        preview = 3
+
+    # Combine top chunks as context, truncated to fit within token budget
+    context_text = "\n\n".join(top_chunks)
+    context_budget = MODEL_CONTEXT_TOKENS - 3000
+    context_text = truncate_to_tokens(context_text, context_budget, CHAT_MODEL)
+    logger.info(f"[CHAT] Using top {len(top_chunks)} chunks ({len(context_text)} chars)")
+
+    # Store info for debug display
+    chunks = {
+        'count': len(top_chunks),
+        'total_chars': len(context_text),
+        'chunks': top_chunks[:preview]  # shortened for display by the template
+    }
+    if top_scores is not None:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[CHAT] Top similarities: {[f'{s:.3f}' for s in top_scores[:3]]}")
+        chunks['scores'] = top_scores[:5]
+    return context_text, chunks
+
+# Per-user answer cache, in memory with a TTL: an answer is reused only for the same retrieved
+# context and the same (or a near-duplicate, by question-embedding cosine) question. Entries are
+# dropped when the user's documents are re-indexed (_answer_cache_clear), and follow-ups that
+# lean on the previous turn or on the current date bypass the cache entirely.
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", "3600"))           # seconds; 0 disables
+ANSWER_CACHE_MIN_SIM = float(os.environ.get("ANSWER_CACHE_MIN_SIM", "0.95"))
+_ANSWER_CACHE: "OrderedDict[Tuple[int, bytes], List[Tuple[str, str, float]]]" = OrderedDict()
+_ANSWER_CACHE_MAX = 512
+_ANSWER_CACHE_LOCK = threading.Lock()
+_FOLLOW_UP_RE = re.compile(
+    r"^\s*(it|its|it's|that|this|these|those|they|them|their|he|she|and|also|what about|how about)\b",
+    re.IGNORECASE)
+_TIME_RELATIVE_RE = re.compile(
+    r"\b(today|tonight|tomorrow|yesterday|now|currently|soon|upcoming|overdue|"
+    r"(this|next|last) (week|weekend|month)|(mon|tues|wednes|thurs|fri|satur|sun)day)\b",
+    re.IGNORECASE)
+
+def _answer_cache_bypass(question: str, prev_user_messages: Optional[List[str]]) -> bool:
+    """
+    True when an answer depends on more than the question and context: a
+    pronoun-led follow-up to an earlier turn, or a question relative to now.
+    """
+    if _TIME_RELATIVE_RE.search(question):
+        return True
+    return bool(prev_user_messages) and bool(_FOLLOW_UP_RE.match(question))
+
+def _answer_cache_key(user_id: int, context_text: str) -> Tuple[int, bytes]:
+    return user_id, hashlib.blake2b(context_text.encode("utf-8", "ignore"), digest_size=16).digest()
+
+def _answer_cache_get(user_id: int, question: str, context_text: str) -> Optional[str]:
+    """
+    Return a cached answer for this question and context, or None.
+
+    Exact (case/whitespace-insensitive) question matches win; otherwise the best
+    prior question with cosine >= ANSWER_CACHE_MIN_SIM is used.
+    """
+    if ANSWER_CACHE_TTL <= 0:
+        return None
+    key = _answer_cache_key(user_id, context_text)
+    norm_q = " ".join(question.lower().split())
+    now = time.time()
+    with _ANSWER_CACHE_LOCK:
+        entries = [e for e in _ANSWER_CACHE.get(key, []) if now - e[2] <= ANSWER_CACHE_TTL]
+    if not entries:
+        return None
+    for q, answer, _ts in entries:
+        if q == norm_q:
+            return answer
+    # One batched call; stored questions are normally embedding-cache hits
+    try:
+        vecs = np.asarray(openai_embed([norm_q] + [e[0] for e in entries]), dtype=np.float32)
+    except Exception:
+        return None
+    vecs = _normalize_rows(vecs)
+    sims = vecs[1:] @ vecs[0]
+    best = int(np.argmax(sims))
+    return entries[best][1] if sims[best] >= ANSWER_CACHE_MIN_SIM else None
+
+def _answer_cache_put(user_id: int, question: str, context_text: str, answer: str):
+    # "[...]" answers are openai_chat's error placeholders; don't pin them
+    if ANSWER_CACHE_TTL <= 0 or not answer or answer.startswith("["):
+        return
+    key = _answer_cache_key(user_id, context_text)
+    entry = (" ".join(question.lower().split()), answer, time.time())
+    with _ANSWER_CACHE_LOCK:
+        entries = _ANSWER_CACHE.get(key, [])[-15:]
+        entries.append(entry)
+        _ANSWER_CACHE[key] = entries
+        _ANSWER_CACHE.move_to_end(key)
+        while len(_ANSWER_CACHE) > _ANSWER_CACHE_MAX:
+            _ANSWER_CACHE.popitem(last=False)
+
+def _answer_cache_clear(user_id: int):
+    """
+    Drop a user's cached answers (called when their documents are re-indexed).
+    """
+    with _ANSWER_CACHE_LOCK:
+        for key in [k for k in _ANSWER_CACHE if k[0] == user_id]:
+            del _ANSWER_CACHE[key]
+
+def _chat_error_message(e: Exception, rag_index_json: Optional[str]) -> str:
+    """
+    Log a chat retrieval/answer failure and return the message shown in place of the answer.
+    """
+    if rag_index_json:
+        logger.error(f"[CHAT] RAG with pre-computed index error: {e}")
+        log_exception("chat_rag_precomputed", e)
+        return f"Error using pre-computed index: {str(e)}. Try re-indexing your data."
+    logger.error(f"[CHAT] RAG error: {e}")
+    log_exception("chat_rag", e)
+    return f"Error processing question: {str(e)}. Try asking a simpler question or check if your courses are scraped."
+
+def _sse(obj) -> str:
+    return f"data: {_json_dumps(obj)}\n\n"
+
+def _push_chat_history(user_id: int, question: str) -> List[str]:
+    """
+    Append a question to the user's chat history file (last 20 kept).
+
+    History used to live in the session cookie, which re-signed and resent the
+    whole list on every question; any leftover cookie copy is dropped here.
+
+    Returns:
+        List[str]: The history before this question (prior turns for the prompt)
+    """
+    path = _chat_history_path(user_id)
+    try:
+        with open(path, "rb") as f:
+            hist = _json_loads(f.read())
+    except (OSError, ValueError):
+        hist = session.get("chat_history", [])
+    if not isinstance(hist, list):
+        hist = []
+    if "chat_history" in session:
+        session.pop("chat_history")
+    prev = hist[:]
+    hist.append(question)
+    del hist[:-20]
+    try:
+        _atomic_write_text(path, json.dumps(hist, ensure_ascii=False), fsync=False)
+    except Exception as e:
+        log_exception("chat_history_write", e)
+    return prev
+
 @app.route("/chat", methods=["GET", "POST"])
 @login_required
 def chat():
@@ -2747,61 +4479,7 @@ def chat():
         u = current_user(db)
 
         def _load_context_text(canvas_data_json: str = None) -> str:
-            """
-            Load context from extension's localStorage (preferred) or fallback to database.
-
-            Args:
-                canvas_data_json: JSON string from extension's chrome.storage.local
-
-            Returns:
-                str: Combined course content text
-
-            Process:
-                1. If canvas_data provided from extension, parse and combine all courses
-                2. Fallback: Load from database (old method)
-            """
-            # Try loading from extension data first
-            if canvas_data_json:
-                try:
-                    canvas_data = json.loads(canvas_data_json)
-                    courses = canvas_data.get('courses', {})
-
-                    if courses:
-                        combined_text = ""
-                        for course_id, course_info in courses.items():
-                            combined_text += f"\n\n{'='*80}\n"
-                            combined_text += f"COURSE: {course_info.get('name', 'Unknown')} (ID: {course_id})\n"
-                            combined_text += f"{'='*80}\n\n"
-
-                            pages = course_info.get('pages', {})
-                            for page_name, page_data in pages.items():
-                                combined_text += f"\n--- {page_name.upper()} ---\n"
-                                combined_text += page_data.get('content', '')
-                                combined_text += "\n\n"
-
-                        logger.info(f"[CHAT] Loaded {len(courses)} courses from extension localStorage")
-                        return combined_text.strip()
-                except Exception as e:
-                    logger.error(f"[CHAT] Failed to parse extension data: {e}")
-
-            # Fallback to database method
-            last_job = latest_job_for_user(db, u.id)
-            if last_job:
-                stream_path = _stream_file_path(u.id, last_job.id)
-                if os.path.exists(stream_path):
-                    with open(stream_path, "r", encoding="utf-8", errors="ignore") as f:
-                        s = f.read().strip()
-                        if s:
-                            logger.info("[CHAT] Loaded context from stream file (database fallback)")
-                            return s
-            # fallback to DB-backed Document
-            doc_id = latest_document_id(db, u.id)
-            if doc_id:
-                row = db.query(Document).filter(Document.id == doc_id).first()
-                logger.info("[CHAT] Loaded context from Document table (database fallback)")
-                return (row.content or "").strip()
-
-            return ""
+            return _load_chat_context(db, u.id, canvas_data_json)
 
         # 1) Load saved classes.json (if present)
         classes: List[str] = []
@@ -2850,10 +4528,12 @@ def chat():
                 if corpus:
                     if gen_mode == "practice":
                         practice = generate_practice_test(selected_course, corpus)
+                    elif gen_mode == "both":
+                        practice, flashcards = generate_bundle(selected_course, corpus)
                     else:
                         flashcards = generate_flashcards(selected_course, corpus)
 
-                inner = render_template(
+                return ocean_layout("Chat • Ocean Canvas Assistant", render_template(
                     "chat.html",
                     question="",
                     answer=None,
@@ -2863,152 +4543,33 @@ def chat():
                     practice=practice,
                     selected_course=selected_course,
                     gen_mode=gen_mode
-                )
-                return ocean_layout("Chat • Ocean Canvas Assistant", f"<div class='mathjax-target'>{inner}</div>")
+                ))
 
             # Normal Q&A flow
             question = (request.form.get("question") or "").strip()
             if question:
-                hist = session.get("chat_history", [])
-                if not isinstance(hist, list):
-                    hist = []
-                prev_user_msgs = hist[:]
+                prev_user_msgs = _push_chat_history(u.id, question)
 
                 # Check if pre-computed RAG index is provided from extension
                 rag_index_json = request.form.get("rag_index") or None
-
-                if rag_index_json:
-                    # Use pre-computed embeddings from extension
-                    try:
-                        logger.info(f"[CHAT] Using pre-computed RAG index from extension")
-                        rag_index = json.loads(rag_index_json)
-
-                        indexed_chunks = rag_index.get('chunks', [])
-                        indexed_embeddings = rag_index.get('embeddings', [])
-
-                        if not indexed_chunks or not indexed_embeddings:
-                            raise Exception("RAG index is empty")
-
-                        logger.info(f"[CHAT] Question: {question[:100]}...")
-                        logger.info(f"[CHAT] Using {len(indexed_chunks)} pre-indexed chunks")
-
-                        # 1. Embed the question only
-                        question_embedding = openai_embed([question])
-                        if not question_embedding:
-                            raise Exception("Failed to embed question")
-                        qvec = question_embedding[0]
-
-                        # 2. Calculate similarity with pre-computed embeddings
-                        scored_chunks = []
-                        for i, (chunk_text, chunk_emb) in enumerate(zip(indexed_chunks, indexed_embeddings)):
-                            similarity = cosine_sim(qvec, chunk_emb)
-                            scored_chunks.append((similarity, chunk_text))
-
-                        # 3. Sort by similarity and get top-k
-                        scored_chunks.sort(key=lambda x: x[0], reverse=True)
-                        top_chunks = [text for _, text in scored_chunks[:TOP_K]]
-                        top_scores = [score for score, _ in scored_chunks[:TOP_K]]
-
-                        # 4. Combine top chunks as context
-                        context_text = "\n\n".join(top_chunks)
-
-                        # 5. Truncate to fit within token budget
-                        context_budget = MODEL_CONTEXT_TOKENS - 3000
-                        context_text = truncate_to_tokens(context_text, context_budget, CHAT_MODEL)
-
-                        logger.info(f"[CHAT] Using top {len(top_chunks)} chunks ({len(context_text)} chars)")
-                        logger.info(f"[CHAT] Top similarities: {[f'{s:.3f}' for s in top_scores[:3]]}")
-
-                        # 6. Generate answer with retrieved context
+                try:
+                    context_text, chunks = _chat_retrieve(question, rag_index_json,
+                                                          lambda: _load_context_text(canvas_data_json))
+                    use_cache = not _answer_cache_bypass(question, prev_user_msgs)
+                    answer = _answer_cache_get(u.id, question, context_text) if use_cache else None
+                    if answer is None:
                         answer = answer_with_context(question, context_text, prev_user_messages=prev_user_msgs)
-
-                        # Store info for debug display
-                        chunks = {
-                            'count': len(top_chunks),
-                            'total_chars': len(context_text),
-                            'scores': top_scores[:5],
-                            'chunks': [chunk[:200] + '...' for chunk in top_chunks[:5]]
-                        }
-
-                    except Exception as e:
-                        logger.error(f"[CHAT] RAG with pre-computed index error: {e}")
-                        log_exception("chat_rag_precomputed", e)
-                        answer = f"Error using pre-computed index: {str(e)}. Try re-indexing your data."
-                        chunks = None
-
-                else:
-                    # Fallback: Load context and compute embeddings on-the-fly (slower)
-                    full_context = _load_context_text(canvas_data_json)
-
-                    if not full_context:
-                        answer = "No course data found. Please scrape your Canvas courses using the extension or start a scrape job."
-                        chunks = None
-                    else:
-                        try:
-                            # RAG: Use semantic search (compute embeddings on demand)
-                            logger.info(f"[CHAT] Question: {question[:100]}...")
-                            logger.info(f"[CHAT] Full context: {len(full_context)} chars (computing embeddings on-the-fly)")
-
-                            # 1. Split full context into chunks for embedding
-                            text_chunks = chunk_for_embeddings(full_context, EMBED_MODEL, RETRIEVAL_CHUNK_TOKENS)
-                            logger.info(f"[CHAT] Split into {len(text_chunks)} chunks")
-
-                            if not text_chunks:
-                                answer = "No content to search. Please try scraping again."
-                                chunks = None
-                            else:
-                                # 2. Embed the question
-                                question_embedding = openai_embed([question])
-                                if not question_embedding:
-                                    raise Exception("Failed to embed question")
-                                qvec = question_embedding[0]
-
-                                # 3. Embed all chunks (expensive!)
-                                logger.info(f"[CHAT] Generating embeddings for {len(text_chunks)} chunks...")
-                                chunk_embeddings = openai_embed(text_chunks)
-
-                                # 4. Calculate similarity scores
-                                scored_chunks = []
-                                for chunk_text, chunk_emb in zip(text_chunks, chunk_embeddings):
-                                    similarity = cosine_sim(qvec, chunk_emb)
-                                    scored_chunks.append((similarity, chunk_text))
-
-                                # 5. Sort by similarity and get top-k
-                                scored_chunks.sort(key=lambda x: x[0], reverse=True)
-                                top_chunks = [text for _, text in scored_chunks[:TOP_K]]
-
-                                # 6. Combine top chunks as context
-                                context_text = "\n\n".join(top_chunks)
-
-                                # 7. Truncate to fit within token budget
-                                context_budget = MODEL_CONTEXT_TOKENS - 3000
-                                context_text = truncate_to_tokens(context_text, context_budget, CHAT_MODEL)
-
-                                logger.info(f"[CHAT] Using top {len(top_chunks)} chunks: {len(context_text)} chars")
-
-                                # 8. Generate answer with retrieved context
-                                answer = answer_with_context(question, context_text, prev_user_messages=prev_user_msgs)
-
-                                # Store info for debug display
-                                chunks = {
-                                    'count': len(top_chunks),
-                                    'total_chars': len(context_text),
-                                    'chunks': [chunk[:200] + '...' for chunk in top_chunks[:3]]
-                                }
-
-                        except Exception as e:
-                            logger.error(f"[CHAT] RAG error: {e}")
-                            log_exception("chat_rag", e)
-                            answer = f"Error processing question: {str(e)}. Try asking a simpler question or check if your courses are scraped."
-                            chunks = None
-
-                hist.append(question)
-                if len(hist) > 20:
-                    hist = hist[-20:]
-                session["chat_history"] = hist
+                        if use_cache:
+                            _answer_cache_put(u.id, question, context_text, answer)
+                except LookupError as e:
+                    answer = str(e)
+                    chunks = None
+                except Exception as e:
+                    answer = _chat_error_message(e, rag_index_json)
+                    chunks = None
 
         # GET (or fallthrough)
-        inner = render_template(
+        return ocean_layout("Chat • Ocean Canvas Assistant", render_template(
             "chat.html",
             question=question,
             answer=answer,
@@ -3018,11 +4579,74 @@ def chat():
             practice=practice,
             selected_course=selected_course,
             gen_mode=gen_mode
-        )
-        return ocean_layout("Chat • Ocean Canvas Assistant", f"<div class='mathjax-target'>{inner}</div>")
+        ))
+    finally:
+        db.close()
+
+@app.route("/chat/stream", methods=["POST"])
+@login_required
+def chat_stream():
+    """
+    Answer a chat question as a server-sent event stream.
+
+    Same form fields and retrieval as /chat, but the answer is streamed as
+    {"delta": ...} events so the first tokens show up as soon as OpenAI emits
+    them. A {"chunks": ...} event precedes the answer; the stream ends with
+    {"done": true}, or {"error": ...} if retrieval or the model call fails.
+    """
+    question = (request.form.get("question") or "").strip()
+    if not question:
+        return jsonify({"error": "No question provided"}), 400
+    canvas_data_json = request.form.get("canvas_data") or None
+    rag_index_json = request.form.get("rag_index") or None
+    rag_index_key = request.form.get("rag_index_key") or None
+    if rag_index_key and not rag_index_json and _cached_rag_index(rag_index_key) is None:
+        # Unknown to this process: ask the page to resend with the full index
+        return jsonify({"error": "rag_index_unknown"}), 409
+    # Update history before streaming (it may drop the legacy cookie copy, and headers go out first)
+    prev_user_msgs = _push_chat_history(session["user_id"], question)
+    db = SessionLocal()
+    try:
+        uid = session["user_id"]
+        context_text, chunks = _chat_retrieve(question, rag_index_json,
+                                              lambda: _load_chat_context(db, uid, canvas_data_json),
+                                              rag_index_key=rag_index_key)
+        use_cache = not _answer_cache_bypass(question, prev_user_msgs)
+        cached = _answer_cache_get(uid, question, context_text) if use_cache else None
+        payload = _answer_payload(question, context_text, prev_user_msgs)
+    except LookupError as e:
+        chunks, payload, error = None, None, str(e)
+    except Exception as e:
+        chunks, payload, error = None, None, _chat_error_message(e, rag_index_json or rag_index_key)
     finally:
         db.close()
 
+    def gen():
+        if payload is None:
+            yield _sse({"error": error})
+            return
+        # the stream client only shows the counts; previews stay server-side
+        yield _sse({"chunks": {k: v for k, v in chunks.items() if k != "chunks"}})
+        if cached is not None:
+            yield _sse({"delta": cached})
+            yield _sse({"done": True})
+            return
+        parts: List[str] = []
+        try:
+            for delta in openai_chat_stream(payload):
+                parts.append(delta)
+                yield _sse({"delta": delta})
+        except Exception as e:
+            log_exception("chat_stream", e)
+            yield _sse({"error": f"Error generating answer: {str(e)}"})
+            return
+        if use_cache:
+            _answer_cache_put(uid, question, context_text, "".join(parts).strip())
+        yield _sse({"done": True})
+
+    return Response(stream_with_context(gen()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 
 # -----------------------------------------------------------------------------
 # Browser Extension API Endpoints
@@ -3039,12 +4663,9 @@ def api_session_login():
         return "", 200
     """Handle session-based login from browser extension"""
     try:
-        print("🔍 Session login endpoint called")
         data = request.get_json()
         if not data:
-            print("❌ No JSON data provided")
             return jsonify({"error": "No JSON data provided"}), 400
-        print(f"📦 Received data: {len(data.get('canvas_cookies', []))} cookies")
 
         canvas_cookies = data.get('canvas_cookies', [])
         canvas_url = data.get('canvas_url', '')
@@ -3077,7 +4698,7 @@ def api_session_login():
 
             # Try to find existing user session or create temporary mapping
             # This is a simplified approach for the demo
-            temp_user_id = hash(session_token) % 1000000  # Simple hash-based ID
+            temp_user_id = _temp_user_id(session_token)
 
             # Check if we have a user with this session
             auto_scrape = db.query(AutoScrape).filter(AutoScrape.id == str(temp_user_id)).first()
@@ -3102,7 +4723,7 @@ def api_session_login():
             db.commit()
 
             # Start a scraping job using the session cookies
-            job_id = uuid.uuid4().hex
+            job_id = secrets.token_hex(16)
             job = Job(
                 id=job_id,
                 user_id=temp_user_id,
@@ -3116,7 +4737,7 @@ def api_session_login():
             # Queue the session-based scraping job
             _enqueue_session_job(db, temp_user_id, cookies_json, job_id)
 
-            print(f"✅ Session-based job created: user_id={temp_user_id}, job_id={job_id}")
+            logger.info(f"Session-based job created: user_id={temp_user_id}, job_id={job_id}")
             return jsonify({
                 "success": True,
                 "message": "Canvas session captured successfully",
@@ -3129,10 +4750,7 @@ def api_session_login():
             db.close()
 
     except Exception as e:
-        print(f"💥 Session login error: {str(e)}")
-        print(f"💥 Error type: {type(e).__name__}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Session login failed")
         return jsonify({"error": f"Session login failed: {str(e)}"}), 500
 
 @app.route("/api/session-jobs", methods=["GET"])
@@ -3151,7 +4769,7 @@ def api_session_jobs():
                 "created_at": job.created_at.isoformat() if job.created_at else None,
                 "updated_at": job.updated_at.isoformat() if job.updated_at else None
             })
-        return jsonify({"jobs": result}), 200
+        return _json_response({"jobs": result})
     finally:
         db.close()
 
@@ -3162,13 +4780,16 @@ def api_upload_courses():
     For each course:
     1. Store in CourseDoc table (course metadata + full content)
     2. Store in Documents table (full scraped content)
-    3. Store in Chunks table (split content with embeddings for retrieval)
+    3. Store in Chunks table (split content with embeddings for retrieval) -- done by a
+       background embedding job; responds 202 with its job_id (poll /job_state/<job_id>)
     """
     if request.method == "OPTIONS":
         return "", 200
 
     try:
-        data = request.get_json()
+        # Course payloads run to megabytes of text; parse with orjson when available
+        raw = request.get_data()
+        data = _json_loads(raw) if raw else None
         if not data:
             return jsonify({"error": "No JSON data provided"}), 400
 
@@ -3197,10 +4818,15 @@ def api_upload_courses():
                 # Fallback: Generate temp user ID from session token
                 if not session_token:
                     return jsonify({"error": "No session token or user email provided"}), 400
-                user_id = hash(session_token) % 1000000 + 100000
+                user_id = _temp_user_id(session_token)
                 logger.info(f"Using temp user_id={user_id} (no OAuth email)")
 
             stored_courses = []
+            doc_ids = []
+            # Chunking and embeddings run in a background job; the request only stores documents
+            job_id = secrets.token_hex(16)
+            db.add(Job(id=job_id, user_id=user_id, status="embedding_queued",
+                       created_at=datetime.datetime.utcnow(), updated_at=datetime.datetime.utcnow()))
 
             for course in courses:
                 course_id = course.get('courseId')
@@ -3224,7 +4850,7 @@ def api_upload_courses():
                     action = "updated"
                 else:
                     course_doc = CourseDoc(
-                        id=uuid.uuid4().hex,
+                        id=secrets.token_hex(16),
                         user_id=user_id,
                         course_id=str(course_id),
                         course_name=course_name,
@@ -3236,52 +4862,37 @@ def api_upload_courses():
                     action = "created"
 
                 # 2. Store in Documents table (one document per course)
-                doc_id = uuid.uuid4().hex
+                doc_id = secrets.token_hex(16)
                 document = Document(
                     id=doc_id,
                     user_id=user_id,
-                    job_id=None,  # No job for extension scrapes
+                    job_id=job_id,  # the embedding job that indexes it
                     content=sanitize_db_text(content)
                 )
                 db.add(document)
-
-                # 3. Create chunks with embeddings for retrieval
-                chunks_created = 0
                 if content.strip():
-                    # Split content into chunks
-                    text_chunks = chunk_for_embeddings(content, EMBED_MODEL, RETRIEVAL_CHUNK_TOKENS)
-
-                    if text_chunks:
-                        # Generate embeddings for all chunks
-                        embeddings = openai_embed(text_chunks)
-
-                        # Store chunks with embeddings
-                        for i, (chunk_text, embedding) in enumerate(zip(text_chunks, embeddings)):
-                            chunk = Chunk(
-                                id=uuid.uuid4().hex,
-                                document_id=doc_id,
-                                chunk_index=i,
-                                text=sanitize_db_text(chunk_text),
-                                embedding=json.dumps(embedding)
-                            )
-                            db.add(chunk)
-                        chunks_created = len(text_chunks)
+                    doc_ids.append(doc_id)
 
                 stored_courses.append({
                     "course_id": course_id,
                     "course_name": course_name,
-                    "action": action,
-                    "chunks_created": chunks_created
+                    "action": action
                 })
 
             db.commit()
+            # 3. Retrieval chunks + embeddings, off the request thread
+            if doc_ids:
+                _enqueue_embed_job(job_id, doc_ids)
+            else:
+                _update_job(db, job_id, status="embedded", log_line="No course content to index")
 
-            return jsonify({
+            return _json_response({
                 "success": True,
-                "message": f"Stored {len(stored_courses)} courses",
+                "message": f"Stored {len(stored_courses)} courses; indexing in background",
                 "courses": stored_courses,
-                "user_id": user_id
-            }), 200
+                "user_id": user_id,
+                "job_id": job_id
+            }, 202)
 
         finally:
             db.close()
@@ -3293,46 +4904,83 @@ def api_upload_courses():
 # -----------------------------------------------------------------------------
 # Live Duo endpoint for newest job (JSON for polling)
 # -----------------------------------------------------------------------------
+def _poll_etag(*parts) -> str:
+    """
+    Build a short ETag for a polling response from the fields that drive its body.
+    """
+    return hashlib.blake2b("|".join(str(p) for p in parts).encode("utf-8", "ignore"), digest_size=8).hexdigest()
+
+def _poll_response(etag: str, build: Callable[[], dict]):
+    """
+    Answer a poll with 304 when the client's If-None-Match matches, else build the JSON body.
+
+    Args:
+        etag (str): ETag from _poll_etag()
+        build (Callable[[], dict]): Produces the payload; only called on a cache miss
+
+    Returns:
+        Response: 304 with no body, or 200 JSON tagged with the ETag
+    """
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    else:
+        resp = _json_response(build())
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
 @app.route("/latest_duo", methods=["GET"])
 @login_required
 def latest_duo():
-    db = SessionLocal()
+    db = ReadSession()
     try:
-        u = current_user(db)
-        if not u:
-            # session was present but user vanished; return empty payload
-            return jsonify({"job_id": "", "duo_code": "", "status": ""}), 200
-        job = db.query(Job).filter(Job.user_id == u.id).order_by(Job.created_at.desc()).first()
+        # login_required already vouched for the session user; no User row needed
+        uid = session["user_id"]
+        job = latest_job_for_user(db, uid)
         if not job:
             return jsonify({"job_id": "", "duo_code": "", "status": ""}), 200
         duo = (job.duo_code or "").strip()
-        return jsonify({"job_id": job.id, "duo_code": duo, "status": job.status or ""}), 200
+        status = job.status or ""
+        return _poll_response(_poll_etag(job.id, status, duo),
+                              lambda: {"job_id": job.id, "duo_code": duo, "status": status})
     finally:
         db.close()
 # Replace job_state() with file-backed log reading
 @app.route("/job_state/<job_id>", methods=["GET"])
 @login_required
 def job_state(job_id):
-    db = SessionLocal()
+    db = ReadSession()
     try:
-        u = current_user(db)
+        uid = session["user_id"]
         # First try to find job for current user
-        job = db.query(Job).filter(Job.id == job_id, Job.user_id == u.id).first()
+        job = db.query(Job).filter(Job.id == job_id, Job.user_id == uid).first()
         # If not found, check if it's a session-based job (allow access to session jobs)
         if not job:
             job = db.query(Job).filter(Job.id == job_id, Job.user_id > 100000).first()
         if not job:
             return jsonify({"status": "", "duo_code": "", "log": ""}), 404
+        status = job.status or ""
+        duo = (job.duo_code or "").strip()
+        since = request.args.get("since", type=int)
+        # Log size stands in for the log body so unchanged polls never read the file
         try:
-            with open(_job_log_path(job_id), "r", encoding="utf-8", errors="ignore") as f:
-                log_text = f.read()
-        except Exception:
-            log_text = sanitize_db_text(job.log or "")
-        return jsonify({
-            "status": job.status or "",
-            "duo_code": (job.duo_code or "").strip(),
-            "log": log_text
-        }), 200
+            log_size = os.path.getsize(_job_log_path(job_id))
+        except OSError:
+            log_size = len(job.log or "")
+
+        def build():
+            payload = {"status": status, "duo_code": duo}
+            tail = _read_job_log_since(job_id, since, JOB_LOG_TAIL_BYTES) if since is not None else None
+            if tail is None:
+                # No offset from the client, or no log file: send the whole log
+                payload["log"] = _read_job_log(job_id, job.log)
+                return payload
+            chunk, offset, size = tail
+            # reset: the file is shorter than the client's offset, so the chunk starts at 0
+            payload.update(log_chunk=chunk, offset=offset, truncated=offset < size,
+                           reset=since < 0 or since > size)
+            return payload
+        return _poll_response(_poll_etag(status, log_size, duo, since), build)
     finally:
         db.close()
 # -----------------------------------------------------------------------------
@@ -3356,7 +5004,19 @@ def download_stream(job_id):
         path = _stream_file_path(u.id, job.id)
         if not os.path.exists(path):
             return ocean_layout("Download", "<div class='card'>Stream file not found.</div>"), 404
-        return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+        name = os.path.basename(path)
+        if STREAM_ACCEL_PREFIX:
+            # nginx serves the bytes (sendfile + its own conditional GET); the worker is freed at once
+            return Response(headers={
+                "X-Accel-Redirect": STREAM_ACCEL_PREFIX.rstrip("/") + "/" + name,
+                "Content-Disposition": f'attachment; filename="{name}"',
+                "Content-Type": "text/plain; charset=utf-8",
+                "Cache-Control": "no-cache",
+            })
+        # Answers If-None-Match / If-Modified-Since with 304 and Range with 206; the body is a
+        # wsgi.file_wrapper, which gunicorn writes with sendfile(2)
+        return send_file(path, as_attachment=True, download_name=name, max_age=0,
+                         conditional=True, etag=True, last_modified=os.path.getmtime(path))
     finally:
         db.close()
 if __name__ == "__main__":
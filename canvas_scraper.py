@@ -1,20 +1,26 @@
 import os
 import re
+import io
+import csv
 import gc
 import time
 import json
-import hashlib
 import logging
 import traceback
 import tempfile
 import shutil
 import contextlib
 
+from collections import deque
 from pathlib import Path
-from typing import Callable, Dict, List, Set, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Set, Optional, Tuple
 from urllib.parse import urljoin, urlparse
+from email.message import Message
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -34,11 +40,27 @@ MIN_TEXT_LEN_TO_RECORD = int(os.environ.get("MIN_TEXT_LEN_TO_RECORD", "80"))
 # Hard caps to bound per-unit memory
 MAX_PAGE_CHARS = int(os.environ.get("MAX_PAGE_CHARS", "50000"))   # per Canvas page write cap
 MAX_FILE_CHARS = int(os.environ.get("MAX_FILE_CHARS", "200000"))  # per file write cap
+DOWNLOAD_CHUNK_BYTES = int(os.environ.get("DOWNLOAD_CHUNK_BYTES", str(256 * 1024)))  # file download read size
+PDF_USE_PDFIUM = os.environ.get("PDF_USE_PDFIUM", "1") == "1"  # try pypdfium2 before PyPDF2 when installed
+# Courses crawled at once, each in its own Chrome (memory grows with every extra browser)
+CANVAS_WORKERS = max(1, int(os.environ.get("CANVAS_WORKERS", "1")))
+# Files fetched + extracted at once within a course (plain HTTP; the browser stays single-threaded)
+FILE_DOWNLOAD_WORKERS = max(1, int(os.environ.get("FILE_DOWNLOAD_WORKERS", "8")))
 # --- Warm-session settings (read by app.py edits) ----------------------------
 REUSE_SESSION_ONLY = os.environ.get("OCEAN_REUSE_SESSION_ONLY", "0") == "1"
 PERSIST_SESSION_DIR = os.environ.get("OCEAN_PERSIST_SESSION_DIR", "")
 CHROME_PROFILE_DIR = os.environ.get("OCEAN_CHROME_PROFILE_DIR", "Default")
 
+# Patterns used per page/link, compiled once
+_WS_RE = re.compile(r"[ \t\r\f\v]+")
+_BLANKLINE_RE = re.compile(r"\n\s*\n+")
+_ALLWS_RE = re.compile(r"\s+")
+_COURSE_ID_RE = re.compile(r"/courses/(\d+)")
+_FILE_ID_RE = re.compile(r"/files/(\d+)")
+
+# Crawling churns through many short-lived strings/lists while long-lived state stays bounded,
+# so let generational GC run far less often instead of forcing gc.collect() every few pages
+gc.set_threshold(50000, 100, 100)
 
 
 def trace_exc(msg="Exception"):
@@ -50,8 +72,15 @@ def make_dir(p: Path) -> Path:
     return p
 
 
+# ASCII characters sanitize() replaces; translate() applies it in C
+_SANITIZE_TBL = {i: "_" for i in range(128) if not (chr(i).isalnum() or chr(i) in " _-")}
+
+
 def sanitize(name: str) -> str:
-    return "".join([c if c.isalnum() or c in " _-" else "_" for c in (name or "").strip()]) or "Course"
+    name = (name or "").strip()
+    if name.isascii():
+        return name.translate(_SANITIZE_TBL) or "Course"
+    return "".join([c if c.isalnum() or c in " _-" else "_" for c in name]) or "Course"
 
 
 def build_driver(headless: bool):
@@ -159,13 +188,52 @@ def try_expand_all(driver, timeout: int = 5):
         return False
 
 
-def scroll_to_bottom(driver, max_steps=20, pause=0.6):
-    last_h = 0
+# [scrollHeight, document loaded]. Resource-timing entries are only recorded once a fetch
+# has finished, so they can't reveal in-flight requests; readyState plus a stable height is the signal
+_PAGE_IDLE_JS = """
+return [document.body.scrollHeight, document.readyState === 'complete'];
+"""
+
+# [document loaded, module items + content links]: what try_expand_all's lazy loads add to
+_CONTENT_STATE_JS = """
+return [document.readyState === 'complete',
+        document.querySelectorAll('.context_module_item, #content a[href]').length];
+"""
+
+
+class _ContentSettled:
+    """WebDriverWait condition: true once the document is loaded and the number of module
+    items/content links has stayed the same for two consecutive polls."""
+
+    def __init__(self):
+        self.last = None
+        self.stable = 0
+
+    def __call__(self, drv):
+        loaded, count = drv.execute_script(_CONTENT_STATE_JS)
+        self.stable = self.stable + 1 if (loaded and count == self.last) else 0
+        self.last = count
+        return self.stable >= 2
+
+
+def wait_for_content(driver, timeout: float = 3):
+    """Wait until the content try_expand_all just opened (module items that load after
+    "Expand all") has stopped arriving, instead of a fixed sleep."""
+    with contextlib.suppress(Exception):
+        WebDriverWait(driver, timeout, poll_frequency=0.15).until(_ContentSettled())
+
+
+def scroll_to_bottom(driver, max_steps=20, pause=0.15):
+    """Scroll until the page stops growing: stop once the height is unchanged and the
+    page is idle on two consecutive short polls, rather than sleeping a fixed time per step."""
+    last_h = None
+    stable = 0
     for _ in range(max_steps):
         driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
         time.sleep(pause)
-        h = driver.execute_script("return document.body.scrollHeight;")
-        if h == last_h:
+        h, loaded = driver.execute_script(_PAGE_IDLE_JS)
+        stable = stable + 1 if (h == last_h and loaded) else 0
+        if stable >= 2:
             break
         last_h = h
 
@@ -178,8 +246,8 @@ def get_visible_text(driver) -> str:
         if not text:
             text = driver.find_element(By.TAG_NAME, "body").text
         # normalize whitespace
-        text = re.sub(r"[ \t\r\f\v]+", " ", text or "")
-        text = re.sub(r"\n\s*\n+", "\n\n", text)
+        text = _WS_RE.sub(" ", text or "")
+        text = _BLANKLINE_RE.sub("\n\n", text)
         return text.strip()
     except Exception:
         return ""
@@ -442,43 +510,45 @@ def login_canvas(driver, username, password, status_callback: Callable[[str, str
         status_callback("status", "logged_in")
 
 
+# Rows of a course-list table as {term, href}: the "Term" column (or any cell mentioning
+# Fall 2025) and the row's course link, gathered in the page instead of per-cell WebDriver calls
+_TERM_ROWS_JS = """
+const tbl = arguments[0];
+let termIdx = -1;
+tbl.querySelectorAll('thead th').forEach((th, i) => {
+  if ((th.innerText || '').trim().toLowerCase().includes('term')) termIdx = i;
+});
+const out = [];
+for (const row of tbl.querySelectorAll('tbody > tr')) {
+  const link = Array.from(row.querySelectorAll('a[href*="/courses/"]'))
+    .find(a => !a.getAttribute('href').includes('/users/'));
+  if (!link) continue;
+  const tds = row.querySelectorAll('td');
+  let term = (termIdx >= 0 && termIdx < tds.length) ? (tds[termIdx].innerText || '').trim() : '';
+  if (!term) {
+    for (const td of tds) {
+      const t = (td.innerText || '').trim();
+      if (t.toLowerCase().includes('fall') && t.includes('2025')) { term = t; break; }
+    }
+  }
+  out.push({term: term, href: link.href});
+}
+return out;
+"""
+
+
 def get_fall_2025_course_ids(driver) -> List[str]:
     ids: Set[str] = set()
 
     def _from_table(tbl) -> Set[str]:
+        # One script per table returns (term text, course href) for every row
+        rows = driver.execute_script(_TERM_ROWS_JS, tbl) or []
         out: Set[str] = set()
-        headers = tbl.find_elements(By.XPATH, ".//thead//th")
-        term_idx = -1
-        for i, th in enumerate(headers):
-            txt = (th.text or "").strip().lower()
-            if "term" in txt:
-                term_idx = i
-
-        rows = tbl.find_elements(By.XPATH, ".//tbody/tr")
         for row in rows:
-            try:
-                link = row.find_element(By.XPATH, ".//a[contains(@href, '/courses/') and not(contains(@href, '/users/'))]")
-            except Exception:
-                continue
-
-            term_text = ""
-            if term_idx >= 0:
-                tds = row.find_elements(By.XPATH, ".//td")
-                if term_idx < len(tds):
-                    term_text = (tds[term_idx].text or "").strip()
-            if not term_text:
-                with contextlib.suppress(Exception):
-                    cands = row.find_elements(By.XPATH, ".//td[contains(translate(., 'ABCDEFGHIJKLMNOPQRSTUVWXYZ','abcdefghijklmnopqrstuvwxyz'),'fall')]")
-                    for td in cands:
-                        txt = (td.text or "").strip()
-                        if "fall" in txt.lower() and "2025" in txt:
-                            term_text = txt
-                            break
+            term_text = (row.get("term") or "").strip()
             if not term_text or "fall" not in term_text.lower() or "2025" not in term_text:
                 continue
-
-            href = link.get_attribute("href") or ""
-            m = re.search(r"/courses/(\d+)", href)
+            m = _COURSE_ID_RE.search(row.get("href") or "")
             if m:
                 out.add(m.group(1))
         return out
@@ -501,12 +571,17 @@ def get_fall_2025_course_ids(driver) -> List[str]:
         cards = []
 
     cand_ids: Set[str] = set()
-    for a in cards:
+    hrefs: List[str] = []
+    if cards:
         with contextlib.suppress(Exception):
-            href = a.get_attribute("href") or ""
-            m = re.search(r"/courses/(\d+)", href)
-            if m:
-                cand_ids.add(m.group(1))
+            hrefs = driver.execute_script(
+                "return Array.from(document.querySelectorAll('a[href*=\"/courses/\"]'), a => a.href)"
+                ".filter(h => !h.includes('/users/'));"
+            ) or []
+    for href in hrefs:
+        m = _COURSE_ID_RE.search(href)
+        if m:
+            cand_ids.add(m.group(1))
 
     def _verify_term(cid: str) -> bool:
         with contextlib.suppress(Exception):
@@ -552,6 +627,83 @@ def collect_in_course_links(driver, course_id: str) -> Set[str]:
     return urls
 
 
+def collect_file_links(driver) -> List[str]:
+    """Return the page's Canvas file links (hrefs containing /files/), deduplicated in
+    page order, from one execute_script call instead of a get_attribute round-trip per anchor."""
+    hrefs: List[str] = []
+    with contextlib.suppress(Exception):
+        hrefs = driver.execute_script(
+            "return Array.from(document.querySelectorAll('a[href]'), a => a.href)"
+            ".filter(h => h.includes('/files/'));"
+        ) or []
+    return list(dict.fromkeys(hrefs))
+
+
+# One keep-alive connection pool for all file downloads; mounted on every job's Session so
+# TLS connections to Canvas are reused across files and courses while cookies stay per job
+_HTTP_ADAPTER = HTTPAdapter(pool_connections=16, pool_maxsize=32,
+                            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(502, 503, 504)))
+
+
+def new_http_session(driver=None) -> requests.Session:
+    session = requests.Session()
+    session.mount("https://", _HTTP_ADAPTER)
+    session.mount("http://", _HTTP_ADAPTER)
+    if driver is not None:
+        sync_cookies(driver, session)
+    return session
+
+
+def sync_cookies(driver, session: requests.Session) -> bool:
+    """Copy the browser's cookies into the download session (after login and
+    whenever Canvas rejects a download). Returns False, without touching the jar,
+    when the browser's cookies are the same as at the last sync."""
+    try:
+        cookies = driver.get_cookies()
+    except Exception:
+        return False
+    fingerprint = frozenset((c.get("name"), c.get("value"), c.get("domain")) for c in cookies)
+    if getattr(session, "_canvas_cookie_fp", None) == fingerprint:
+        return False
+    for cookie in cookies:
+        with contextlib.suppress(Exception):
+            session.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain"))
+    session._canvas_cookie_fp = fingerprint
+    return True
+
+
+def _download_filename(name: str, download_url: str) -> str:
+    """Local name for a download: the given name if it ends in an extension we extract,
+    else the URL's basename, else a timestamped .pdf. Only the stem goes through
+    sanitize() (which replaces dots), so notes.docx stays .docx instead of notes_docx.pdf."""
+    name = (name or "").strip()
+    if not name or not any(name.lower().endswith(ext) for ext in ALLOWED_EXT_FOR_EXTRACTION):
+        path_name = os.path.basename(urlparse(download_url).path)
+        if path_name and "." in path_name:
+            name = path_name
+        else:
+            name = f"file_{int(time.time())}.pdf"
+
+    stem, suf = os.path.splitext(name)
+    suf = suf.lower()
+    if suf not in ALLOWED_EXT_FOR_EXTRACTION:
+        return sanitize(name) + ".pdf"
+    return sanitize(stem) + suf
+
+
+def _save_response(resp: requests.Response, file_path: Path):
+    # Read straight from urllib3 into one reused buffer (no per-chunk generator/bytes objects)
+    resp.raw.decode_content = True
+    buf = bytearray(DOWNLOAD_CHUNK_BYTES)
+    view = memoryview(buf)
+    with open(file_path, "wb") as f:
+        while True:
+            n = resp.raw.readinto(buf)
+            if not n:
+                break
+            f.write(view[:n])
+
+
 def download_file_from_canvas(driver, file_url: str, download_dir: Path, session: requests.Session) -> Optional[Path]:
     driver.get(file_url)
     try_expand_all(driver, timeout=3)
@@ -576,76 +728,150 @@ def download_file_from_canvas(driver, file_url: str, download_dir: Path, session
     except Exception:
         filename = ""
 
-    if not filename or not any(filename.lower().endswith(ext) for ext in ALLOWED_EXT_FOR_EXTRACTION):
-        path_name = os.path.basename(urlparse(download_url).path)
-        if path_name and "." in path_name:
-            filename = path_name
-        else:
-            filename = f"file_{int(time.time())}.pdf"
+    file_path = download_dir / _download_filename(filename, download_url)
+
+    # Cookies were synced when the session was made; refresh them only if Canvas rejects us,
+    # and retry only if the browser's cookies actually changed (locked files stay 403)
+    resp = session.get(download_url, stream=True, timeout=60)
+    if resp.status_code in (401, 403) and sync_cookies(driver, session):
+        resp.close()
+        resp = session.get(download_url, stream=True, timeout=60)
+    with resp:
+        resp.raise_for_status()
+        _save_response(resp, file_path)
 
-    filename = sanitize(filename)
-    suf = os.path.splitext(filename)[1].lower()
-    if not any(suf.endswith(ext) for ext in ALLOWED_EXT_FOR_EXTRACTION):
-        filename += ".pdf"
+    return file_path
 
-    file_path = download_dir / filename
 
-    # Carry cookies over for authorized download
-    with contextlib.suppress(Exception):
-        for cookie in driver.get_cookies():
-            with contextlib.suppress(Exception):
-                session.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain"))
+_API_JSON_PREFIX = "while(1);"  # Canvas prepends this to cookie-authenticated API JSON
 
-    resp = session.get(download_url, stream=True, timeout=60)
-    resp.raise_for_status()
-    with open(file_path, "wb") as f:
-        for chunk in resp.iter_content(8192):
-            if not chunk:
-                continue
-            f.write(chunk)
 
+def fetch_file_meta(file_url: str, session: requests.Session) -> Optional[Dict]:
+    """Look a file link up through the Canvas REST API (GET /api/v1/courses/:id/files/:file_id,
+    or /api/v1/files/:file_id for links outside a course). The JSON carries the signed
+    download `url`, `display_name`, `filename` and `size`. Returns {} when Canvas says
+    the file doesn't exist (404) and None when the lookup can't be used for any other reason."""
+    m = _FILE_ID_RE.search(file_url or "")
+    if not m:
+        return None
+    course = _COURSE_ID_RE.search(file_url)
+    prefix = f"{START_URL}/api/v1/courses/{course.group(1)}" if course else f"{START_URL}/api/v1"
+    try:
+        resp = session.get(f"{prefix}/files/{m.group(1)}", headers={"Accept": "application/json"}, timeout=30)
+        with resp:
+            if resp.status_code == 404:
+                return {}
+            if resp.status_code != 200:
+                return None
+            body = resp.text
+        if body.startswith(_API_JSON_PREFIX):
+            body = body[len(_API_JSON_PREFIX):]
+        meta = json.loads(body)
+    except Exception:
+        return None
+    return meta if isinstance(meta, dict) else None
+
+
+def download_file_direct(file_url: str, download_dir: Path, session: requests.Session) -> Optional[Path]:
+    """Fetch a Canvas file over plain HTTP, without loading its preview page in the
+    browser: the REST API gives the signed download URL and display name, and
+    /files/{id}/download?download_frd=1 is used if the API lookup fails. Touches only
+    the session, so it is safe on worker threads. Returns None when the link has no
+    file id, the API answers 404, or Canvas responds with something other than the
+    file (login page, locked file), leaving the caller to fall back to
+    download_file_from_canvas."""
+    m = _FILE_ID_RE.search(file_url or "")
+    if not m:
+        return None
+    file_id = m.group(1)
+
+    meta = fetch_file_meta(file_url, session)
+    if meta == {}:
+        return None
+    if meta and meta.get("url"):
+        download_url = meta["url"]
+        # display_name is what Canvas shows (may be renamed); filename is the uploaded name
+        names = [meta.get("display_name") or "", meta.get("filename") or ""]
+        name = next((n for n in names if n.lower().endswith(tuple(ALLOWED_EXT_FOR_EXTRACTION))), names[0])
+    else:
+        course = _COURSE_ID_RE.search(file_url)
+        prefix = f"{START_URL}/courses/{course.group(1)}" if course else START_URL
+        download_url = f"{prefix}/files/{file_id}/download?download_frd=1"
+        name = ""
+
+    with session.get(download_url, stream=True, timeout=60) as resp:
+        if resp.status_code != 200 or "text/html" in resp.headers.get("Content-Type", ""):
+            return None
+        if not name:
+            disposition = Message()
+            disposition["Content-Disposition"] = resp.headers.get("Content-Disposition", "")
+            name = disposition.get_filename() or ""
+        # File id prefix: two links with the same display name must not share a path across threads
+        file_path = download_dir / f"{file_id}_{_download_filename(name, resp.url)}"
+        _save_response(resp, file_path)
     return file_path
 
 
-def _stream_pdf_to_file(pdf_path: Path, tmp_text_path: Path) -> int:
+def _write_capped_pages(pages, tmp_text_path: Path) -> int:
+    """Write page texts (an iterator, consumed lazily) until MAX_FILE_CHARS is reached."""
     written = 0
+    with open(tmp_text_path, "w", encoding="utf-8", errors="ignore") as out:
+        for txt in pages:
+            if not txt:
+                continue
+            if MAX_FILE_CHARS and written + len(txt) > MAX_FILE_CHARS:
+                txt = txt[: max(0, MAX_FILE_CHARS - written)]
+            out.write(txt + "\n")
+            written += len(txt)
+            if written >= MAX_FILE_CHARS:
+                break
+    return written
+
+
+def _pdfium_page_texts(pdf):
+    for i in range(len(pdf)):
+        page = pdf[i]
+        textpage = page.get_textpage()
+        try:
+            yield textpage.get_text_range() or ""
+        finally:
+            textpage.close()
+            page.close()
+
+
+def _pypdf2_page_texts(reader):
+    for page in reader.pages:
+        try:
+            yield page.extract_text() or ""
+        except Exception:
+            yield ""
+
+
+def _stream_pdf_to_file(pdf_path: Path, tmp_text_path: Path) -> int:
     # Prefer PyMuPDF (low memory) if available
     try:
         import fitz  # PyMuPDF
-        with fitz.open(str(pdf_path)) as doc, open(tmp_text_path, "w", encoding="utf-8", errors="ignore") as out:
-            for page in doc:
-                txt = page.get_text("text") or ""
-                if not txt:
-                    continue
-                if MAX_FILE_CHARS and written + len(txt) > MAX_FILE_CHARS:
-                    txt = txt[: max(0, MAX_FILE_CHARS - written)]
-                out.write(txt + "\n")
-                written += len(txt)
-                if written >= MAX_FILE_CHARS:
-                    break
-        return written
+        with fitz.open(str(pdf_path)) as doc:
+            return _write_capped_pages((page.get_text("text") or "" for page in doc), tmp_text_path)
     except Exception:
         pass
 
+    # Then pdfium (native, several times faster than PyPDF2's pure-Python text extraction)
+    if PDF_USE_PDFIUM:
+        try:
+            import pypdfium2 as pdfium
+            pdf = pdfium.PdfDocument(str(pdf_path))
+            try:
+                return _write_capped_pages(_pdfium_page_texts(pdf), tmp_text_path)
+            finally:
+                pdf.close()
+        except Exception:
+            pass
+
     # Fallback to PyPDF2, still stream page-by-page
     try:
         from PyPDF2 import PdfReader
-        reader = PdfReader(str(pdf_path))
-        with open(tmp_text_path, "w", encoding="utf-8", errors="ignore") as out:
-            for page in reader.pages:
-                try:
-                    txt = (page.extract_text() or "")
-                except Exception:
-                    txt = ""
-                if not txt:
-                    continue
-                if MAX_FILE_CHARS and written + len(txt) > MAX_FILE_CHARS:
-                    txt = txt[: max(0, MAX_FILE_CHARS - written)]
-                out.write(txt + "\n")
-                written += len(txt)
-                if written >= MAX_FILE_CHARS:
-                    break
-        return written
+        return _write_capped_pages(_pypdf2_page_texts(PdfReader(str(pdf_path))), tmp_text_path)
     except Exception:
         return 0
 
@@ -694,23 +920,35 @@ def _stream_pptx_to_file(pptx_path: Path, tmp_text_path: Path) -> int:
 
 
 def _stream_xlsx_to_file(xlsx_path: Path, tmp_text_path: Path) -> int:
-    # Use openpyxl read-only mode: constant memory
+    # Use openpyxl read-only mode: constant memory. Rows are formatted by the C csv writer
+    # into a small buffer that is flushed (and budget-capped) every 64 KiB.
     written = 0
     try:
         from openpyxl import load_workbook
         wb = load_workbook(str(xlsx_path), read_only=True, data_only=True)
-        with open(tmp_text_path, "w", encoding="utf-8", errors="ignore") as out:
-            for ws in wb.worksheets:
-                for row in ws.iter_rows(values_only=True):
-                    line = ",".join("" if v is None else str(v) for v in row)
-                    if MAX_FILE_CHARS and written + len(line) > MAX_FILE_CHARS:
-                        line = line[: max(0, MAX_FILE_CHARS - written)]
-                    out.write(line + "\n")
-                    written += len(line)
-                    if written >= MAX_FILE_CHARS:
-                        wb.close()
-                        return written
-        wb.close()
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")  # None cells are written as ""
+        try:
+            with open(tmp_text_path, "w", encoding="utf-8", errors="ignore") as out:
+                def flush() -> bool:
+                    nonlocal written
+                    chunk = buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+                    if MAX_FILE_CHARS and written + len(chunk) > MAX_FILE_CHARS:
+                        chunk = chunk[: max(0, MAX_FILE_CHARS - written)]
+                    out.write(chunk)
+                    written += len(chunk)
+                    return bool(MAX_FILE_CHARS) and written >= MAX_FILE_CHARS
+
+                for ws in wb.worksheets:
+                    for row in ws.iter_rows(values_only=True):
+                        writer.writerow(row)
+                        if buf.tell() >= 64 * 1024 and flush():
+                            return written
+                flush()
+        finally:
+            wb.close()
         return written
     except Exception:
         return 0
@@ -774,16 +1012,90 @@ def _push_snippet(status_callback: Callable[[str, str], None], kind: str, where:
     if not status_callback or not text:
         return
     # normalize whitespace and cap preview length
-    snippet = re.sub(r"\s+", " ", text).strip()
+    snippet = _ALLWS_RE.sub(" ", text).strip()
     if len(snippet) > 600:
         snippet = snippet[:600] + "..."
     status_callback("snippet", f"[{course}] {kind} {where}: {snippet}")
 
 
-def crawl_course(driver, course_id: str, input_txt_path: Path, status_callback: Callable[[str, str], None]):
+def _extract_download(p: Path) -> Tuple[Path, int]:
+    """Extract a downloaded file into a fresh temp text file; returns (temp path, chars written)."""
+    with tempfile.NamedTemporaryFile("w+", delete=False, encoding="utf-8") as tmpf:
+        tmp_txt_path = Path(tmpf.name)
+    try:
+        return tmp_txt_path, stream_extract_file_to_temp(p, tmp_txt_path)
+    except Exception:
+        with contextlib.suppress(Exception):
+            tmp_txt_path.unlink()
+        raise
+
+
+def _record_file(input_txt_path: Path, course_name: str, p: Path, tmp_txt_path: Path, written: int,
+                 href: str, status_callback: Callable[[str, str], None], tag: str = "file"):
+    """Append an extracted file to input.txt, log it and push a live snippet, then
+    delete the temp text file."""
+    try:
+        if written >= MIN_TEXT_LEN_TO_RECORD:
+            append_header_and_streamed_file(input_txt_path, course_name, tmp_txt_path, f"FILE: {p.name} ({href})")
+            if status_callback:
+                status_callback("log", f"[{tag}] saved {p.name} ({written} chars) from {href}")
+            # Send live content snippet for real-time updates (the preview is capped at 600 chars,
+            # so the head of the file is enough)
+            try:
+                with open(tmp_txt_path, "r", encoding="utf-8", errors="ignore") as r:
+                    content = r.read(2048)
+                _push_snippet(status_callback, "FILE", p.name, content, course_name)
+                del content
+            except Exception:
+                pass
+    finally:
+        with contextlib.suppress(Exception):
+            tmp_txt_path.unlink()
+
+
+def _fetch_and_extract(href: str, course_dir: Path, session: requests.Session):
+    # Worker-thread half of harvest_files: HTTP only, never the driver
+    try:
+        p = download_file_direct(href, course_dir, session)
+        if p and p.exists():
+            return (p,) + _extract_download(p)
+    except Exception:
+        pass
+    return None
+
+
+def harvest_files(driver, hrefs: List[str], course_dir: Path, course_name: str, input_txt_path: Path,
+                  session: requests.Session, status_callback: Callable[[str, str], None], tag: str = "file"):
+    """Download and extract a batch of file links. Fetch + extraction run on
+    FILE_DOWNLOAD_WORKERS threads; results are appended to input.txt here, in link
+    order, so the output matches a serial crawl. Links the direct download can't
+    serve are retried through the browser afterwards, one at a time."""
+    fallback: List[str] = []
+    with ThreadPoolExecutor(max_workers=FILE_DOWNLOAD_WORKERS) as ex:
+        for href, res in zip(hrefs, ex.map(lambda h: _fetch_and_extract(h, course_dir, session), hrefs)):
+            if res is None:
+                fallback.append(href)
+                continue
+            p, tmp_txt_path, written = res
+            with contextlib.suppress(Exception):
+                _record_file(input_txt_path, course_name, p, tmp_txt_path, written, href, status_callback, tag)
+
+    for href in fallback:
+        with contextlib.suppress(Exception):
+            p = download_file_from_canvas(driver, href, course_dir, session)
+            if p and p.exists():
+                tmp_txt_path, written = _extract_download(p)
+                _record_file(input_txt_path, course_name, p, tmp_txt_path, written, href, status_callback, tag)
+
+
+def crawl_course(driver, course_id: str, input_txt_path: Path, status_callback: Callable[[str, str], None],
+                 session: Optional[requests.Session] = None, course_name: Optional[str] = None,
+                 harvested_files: Optional[Set[str]] = None):
     """The core BFS crawler that systematically visits all course pages
     (including announcements) and extracts content, with deduplication and live
-    updates."""
+    updates. A caller that already opened the course and harvested the modules
+    page (run_course_crawl) passes course_name and the file URLs it fetched, so
+    neither the navigation nor those downloads are repeated."""
 
     # Define course URLs and essential pages to crawl
     base = f"{START_URL}/courses/{course_id}"
@@ -796,78 +1108,54 @@ def crawl_course(driver, course_id: str, input_txt_path: Path, status_callback:
         f"{base}/announcements",             # Course announcements (includes new ones)
     ]
 
-    # Navigate to course home and expand any collapsible content
-    driver.get(base)
-    try_expand_all(driver, 5)
-    time.sleep(1.0)
+    if course_name is None:
+        # Navigate to course home and expand any collapsible content
+        driver.get(base)
+        try_expand_all(driver, 5)
+        wait_for_content(driver)
 
-    # Get course name and create directory for downloaded files
-    course_name = get_course_title(driver)
+        # Get course name
+        course_name = get_course_title(driver)
+
+    # Directory for downloaded files
     course_dir = input_txt_path.parent / sanitize(course_name)
     make_dir(course_dir)
 
-    session = requests.Session()
+    if session is None:
+        session = new_http_session(driver)
 
-    # Initial file harvest from modules page
-    with contextlib.suppress(Exception):
-        driver.get(f"{base}/modules")
-        try_expand_all(driver, 5)
-        time.sleep(1.0)
-
-        # Find all downloadable files in modules
-        links = driver.find_elements(By.XPATH, "//a[contains(@href, '/files/') or contains(@href, '.pdf') or contains(@href, '.docx') or contains(@href, '.pptx') or contains(@href, '.xlsx') or contains(@href, '.csv')]")
-        seen_files: Set[str] = set()
-        for a in links:
-            href = a.get_attribute("href") or ""
-            if "/files/" in href and href not in seen_files:
-                seen_files.add(href)
-                with contextlib.suppress(Exception):
-                    # Download and extract text from file
-                    p = download_file_from_canvas(driver, href, course_dir, session)
-                    if p and p.exists():
-                        # Create temporary file for text extraction
-                        with tempfile.NamedTemporaryFile("w+", delete=False, encoding="utf-8") as tmpf:
-                            tmp_txt_path = Path(tmpf.name)
-                        try:
-                            # Extract text content from downloaded file
-                            written = stream_extract_file_to_temp(p, tmp_txt_path)
-                            if written >= MIN_TEXT_LEN_TO_RECORD:
-                                # Add extracted text to main input file
-                                append_header_and_streamed_file(input_txt_path, course_name, tmp_txt_path, f"FILE: {p.name} ({href})")
-                                if status_callback:
-                                    status_callback("log", f"[file] saved {p.name} ({written} chars) from {href}")
-                                # Send live content snippet for real-time updates
-                                try:
-                                    with open(tmp_txt_path, "r", encoding="utf-8", errors="ignore") as r:
-                                        content = r.read(MAX_PAGE_CHARS)
-                                    _push_snippet(status_callback, "FILE", p.name, content, course_name)
-                                except Exception:
-                                    pass
-                        finally:
-                            # Clean up temporary text file
-                            with contextlib.suppress(Exception):
-                                tmp_txt_path.unlink()
+    # Initial file harvest from modules page (skipped when the caller already did it)
+    seen_files: Set[str] = harvested_files if harvested_files is not None else set()
+    if harvested_files is None:
+        with contextlib.suppress(Exception):
+            driver.get(f"{base}/modules")
+            try_expand_all(driver, 5)
+            wait_for_content(driver)
+
+            # Find all downloadable files in modules
+            hrefs = [h for h in collect_file_links(driver) if h not in seen_files]
+            seen_files.update(hrefs)
+            harvest_files(driver, hrefs, course_dir, course_name, input_txt_path, session, status_callback)
 
     # Initialize BFS crawling state
-    visited_pages_h: Set[bytes] = set()    # Track visited pages by MD5 hash
-    visited_files_h: Set[bytes] = set()    # Track visited files by MD5 hash
-    queue: List[str] = list(seeds)         # Queue for BFS traversal
+    visited_pages: Set[str] = set()        # Track visited page URLs
+    visited_files: Set[str] = {normalize_link(h, course_id) or h for h in seen_files}  # Track visited file URLs
+    queue: deque = deque(seeds)            # Queue for BFS traversal (O(1) popleft)
     steps = 0
 
     # Breadth-First Search crawling of course pages
-    while queue and len(visited_pages_h) < MAX_LINKS_PER_COURSE:
-        url = queue.pop(0)
-        # Use MD5 hash to avoid revisiting same page
-        h = hashlib.md5(url.encode("utf-8")).digest()
-        if h in visited_pages_h:
+    while queue and len(visited_pages) < MAX_LINKS_PER_COURSE:
+        url = queue.popleft()
+        # Avoid revisiting same page
+        if url in visited_pages:
             continue
-        visited_pages_h.add(h)
+        visited_pages.add(url)
 
         try:
             driver.get(url)
             try_expand_all(driver, 5)
-            time.sleep(0.6)
-            scroll_to_bottom(driver, 12, 0.3)
+            wait_for_content(driver)
+            scroll_to_bottom(driver)
 
             # Page text with cap
             page_text = get_visible_text(driver)
@@ -892,6 +1180,7 @@ def crawl_course(driver, course_id: str, input_txt_path: Path, status_callback:
 
             # Discover links
             links = collect_in_course_links(driver, course_id)
+            page_files: List[str] = []
             for link in links:
                 is_file = (
                     ("/files/" in link)
@@ -899,49 +1188,32 @@ def crawl_course(driver, course_id: str, input_txt_path: Path, status_callback:
                     or "/download" in link.lower()
                 )
                 if is_file:
-                    hf = hashlib.md5(link.encode("utf-8")).digest()
-                    if hf in visited_files_h:
+                    if link in visited_files:
                         continue
-                    visited_files_h.add(hf)
-                    with contextlib.suppress(Exception):
-                        p = download_file_from_canvas(driver, link, course_dir, session)
-                        if p and p.exists():
-                            with tempfile.NamedTemporaryFile("w+", delete=False, encoding="utf-8") as tmpf:
-                                tmp_txt_path = Path(tmpf.name)
-                            try:
-                                written = stream_extract_file_to_temp(p, tmp_txt_path)
-                                if written >= MIN_TEXT_LEN_TO_RECORD:
-                                    append_header_and_streamed_file(input_txt_path, course_name, tmp_txt_path, f"FILE: {p.name} ({link})")
-                                    if status_callback:
-                                        status_callback("log", f"[file] saved {p.name} ({written} chars) from {link}")
-                                    # Snippet for file content
-                                    try:
-                                        with open(tmp_txt_path, "r", encoding="utf-8", errors="ignore") as r:
-                                            content = r.read(MAX_PAGE_CHARS)
-                                        _push_snippet(status_callback, "FILE", p.name, content, course_name)
-                                    except Exception:
-                                        pass
-                            finally:
-                                with contextlib.suppress(Exception):
-                                    tmp_txt_path.unlink()
+                    visited_files.add(link)
+                    page_files.append(link)
                 else:
-                    if len(visited_pages_h) + len(queue) < MAX_LINKS_PER_COURSE:
+                    if len(visited_pages) + len(queue) < MAX_LINKS_PER_COURSE:
                         queue.append(link)
 
+            # Files linked from this page, fetched together
+            if page_files:
+                harvest_files(driver, page_files, course_dir, course_name, input_txt_path, session, status_callback)
+
         except Exception:
             pass
 
         steps += 1
         if steps % 10 == 0:
-            gc.collect()
             if status_callback:
-                status_callback("log", f"Crawled {len(visited_pages_h)} pages and {len(visited_files_h)} file endpoints in course {course_id}")
+                status_callback("log", f"Crawled {len(visited_pages)} pages and {len(visited_files)} file endpoints in course {course_id}")
 
     if status_callback:
-        status_callback("log", f"[course done] {course_id}: {len(visited_pages_h)} pages, {len(visited_files_h)} file endpoints")
+        status_callback("log", f"[course done] {course_id}: {len(visited_pages)} pages, {len(visited_files)} file endpoints")
 
 
-def run_course_crawl(driver, course_id: str, input_txt_path: Path, status_callback: Callable[[str, str], None]):
+def run_course_crawl(driver, course_id: str, input_txt_path: Path, status_callback: Callable[[str, str], None],
+                     session: Optional[requests.Session] = None):
     """Pre-processor that harvests files from the modules page before
     calling the comprehensive crawler."""
     
@@ -949,7 +1221,7 @@ def run_course_crawl(driver, course_id: str, input_txt_path: Path, status_callba
     base = f"{START_URL}/courses/{course_id}"
     driver.get(base)
     try_expand_all(driver, timeout=5)
-    time.sleep(1.0)
+    wait_for_content(driver)
 
     # Extract course name and create directory for downloaded files
     course_name = get_course_title(driver)
@@ -957,47 +1229,95 @@ def run_course_crawl(driver, course_id: str, input_txt_path: Path, status_callba
     make_dir(course_dir)
 
     # Pre-harvest files from modules page before full crawling
-    session = requests.Session()
+    if session is None:
+        session = new_http_session(driver)
+    harvested: Set[str] = set()  # handed to crawl_course so these files aren't fetched again
     with contextlib.suppress(Exception):
         # Visit modules page to find downloadable files
         driver.get(f"{base}/modules")
         try_expand_all(driver, 5)
-        time.sleep(1.0)
-
-        # Find all file links (PDFs, Word docs, PowerPoint, Excel, CSV)
-        links = driver.find_elements(By.XPATH, "//a[contains(@href, '/files/') or contains(@href, '.pdf') or contains(@href, '.docx') or contains(@href, '.pptx') or contains(@href, '.xlsx') or contains(@href, '.csv')]")
-        for a in links:
-            href = a.get_attribute("href") or ""
-            if "/files/" in href:
-                with contextlib.suppress(Exception):
-                    # Download file to course directory
-                    p = download_file_from_canvas(driver, href, course_dir, session)
-                    if p and p.exists():
-                        # Create temporary file for text extraction
-                        with tempfile.NamedTemporaryFile("w+", delete=False, encoding="utf-8") as tmpf:
-                            tmp_txt_path = Path(tmpf.name)
-                        try:
-                            # Extract text content from downloaded file
-                            written = stream_extract_file_to_temp(p, tmp_txt_path)
-                            if written >= MIN_TEXT_LEN_TO_RECORD:
-                                # Append extracted text to main input file
-                                append_header_and_streamed_file(input_txt_path, course_name, tmp_txt_path, f"FILE: {p.name} ({href})")
-                                if status_callback:
-                                    status_callback("log", f"[file-prefetch] saved {p.name} ({written} chars) from {href}")
-                                # Send live snippet for real-time updates
-                                try:
-                                    with open(tmp_txt_path, "r", encoding="utf-8", errors="ignore") as r:
-                                        content = r.read(MAX_PAGE_CHARS)
-                                    _push_snippet(status_callback, "FILE", p.name, content, course_name)
-                                except Exception:
-                                    pass
-                        finally:
-                            # Clean up temporary text file
-                            with contextlib.suppress(Exception):
-                                tmp_txt_path.unlink()
+        wait_for_content(driver)
+
+        # Find all Canvas file links (PDFs, Word docs, PowerPoint, Excel, CSV)
+        hrefs = collect_file_links(driver)
+        harvested.update(hrefs)
+        harvest_files(driver, hrefs, course_dir, course_name, input_txt_path, session, status_callback,
+                      tag="file-prefetch")
 
     # Perform comprehensive BFS crawling of all course pages
-    crawl_course(driver, course_id, input_txt_path, status_callback)
+    crawl_course(driver, course_id, input_txt_path, status_callback, session,
+                 course_name=course_name, harvested_files=harvested)
+
+
+def _apply_session_cookies(driver, cookies: List[Dict]):
+    """Load cookies exported with driver.get_cookies() from a logged-in browser
+    into a fresh one, so it shares that Canvas session without logging in. Cookies
+    for other hosts (e.g. the SSO domain) are skipped rather than re-scoped to Canvas."""
+    host = (urlparse(START_URL).hostname or "").lower()
+    driver.get(START_URL)
+    for c in cookies:
+        domain = (c.get("domain") or "").lower().lstrip(".")
+        if domain and host != domain and not host.endswith("." + domain):
+            continue
+        cookie = {k: c[k] for k in ("name", "value", "domain", "path", "secure", "httpOnly", "expiry") if k in c}
+        with contextlib.suppress(Exception):
+            driver.add_cookie(cookie)
+    driver.refresh()
+
+
+def crawl_courses(driver, course_ids: List[str], input_txt_path: Path, headless: bool,
+                  status_callback: Callable[[str, str], None]):
+    """Crawl every course into input_txt_path. With CANVAS_WORKERS > 1 the courses
+    are split across that many extra browsers sharing the logged-in session; each
+    writes its own file and the files are appended in course order at the end."""
+    workers = min(CANVAS_WORKERS, len(course_ids))
+    # All courses share one logged-in session, so one cookie sync serves every download
+    session = new_http_session(driver)
+    if workers <= 1:
+        for cid in course_ids:
+            if status_callback:
+                status_callback("log", f"Processing course {cid}")
+            run_course_crawl(driver, cid, input_txt_path, status_callback, session)
+        return
+
+    # WebDriver sessions can't be shared between threads; every worker gets its own browser
+    cookies = driver.get_cookies()
+    part_paths = [input_txt_path.parent / f"course_{cid}.part.txt" for cid in course_ids]
+
+    def crawl_one(cid: str, part_path: Path):
+        if status_callback:
+            status_callback("log", f"Processing course {cid}")
+        part_path.write_text("", encoding="utf-8")
+        worker_driver = build_driver(headless=headless)
+        try:
+            _apply_session_cookies(worker_driver, cookies)
+            run_course_crawl(worker_driver, cid, part_path, status_callback, session)
+        finally:
+            with contextlib.suppress(Exception):
+                worker_driver.quit()
+
+    first_error: Optional[BaseException] = None
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="course") as pool:
+        futures = [pool.submit(crawl_one, cid, p) for cid, p in zip(course_ids, part_paths)]
+        for cid, fut in zip(course_ids, futures):
+            try:
+                fut.result()
+            except Exception as e:
+                trace_exc(f"course {cid} crawl failed")
+                if first_error is None:
+                    first_error = e
+
+    # Merge per-course output (partial files included) in the original order
+    with open(input_txt_path, "a", encoding="utf-8", errors="ignore") as out_f:
+        for part_path in part_paths:
+            if not part_path.exists():
+                continue
+            with open(part_path, "r", encoding="utf-8", errors="ignore") as in_f:
+                shutil.copyfileobj(in_f, out_f, length=64 * 1024)
+            with contextlib.suppress(Exception):
+                part_path.unlink()
+    if first_error is not None:
+        raise first_error
 
 
 def run_canvas_scrape_job(username: str, password: str, headless: bool, status_callback: Callable[[str, str], None]) -> Dict:
@@ -1045,11 +1365,8 @@ def run_canvas_scrape_job(username: str, password: str, headless: bool, status_c
         if status_callback:
             status_callback("log", f"Found {len(course_ids)} Fall 2025 courses: {course_ids}")
 
-        # Scrape each course individually
-        for cid in course_ids:
-            if status_callback:
-                status_callback("log", f"Processing course {cid}")
-            run_course_crawl(driver, cid, input_txt, status_callback)
+        # Scrape each course (CANVAS_WORKERS at a time)
+        crawl_courses(driver, course_ids, input_txt, headless, status_callback)
 
         # Mark job as completed
         if status_callback:
@@ -1192,11 +1509,8 @@ def run_canvas_scrape_job_with_cookies(cookies: List[Dict], headless: bool = Tru
         if status_callback:
             status_callback("log", f"Found {len(course_ids)} courses: {course_ids}")
 
-        # Scrape each course individually
-        for cid in course_ids:
-            if status_callback:
-                status_callback("log", f"Processing course {cid}")
-            run_course_crawl(driver, cid, input_txt, status_callback)
+        # Scrape each course (CANVAS_WORKERS at a time)
+        crawl_courses(driver, course_ids, input_txt, headless, status_callback)
 
         # Mark job as completed
         if status_callback:
@@ -1,6 +1,6 @@
 import datetime
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, String, DateTime, Text, Integer, ForeignKey
+from sqlalchemy import Column, String, DateTime, Text, Integer, ForeignKey, Index
 
 Base = declarative_base()
 
@@ -27,6 +27,9 @@ class Job(Base):
     log = Column(Text)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+    __table_args__ = (
+        Index("ix_job_user_created", "user_id", created_at.desc()),  # dashboard: newest jobs per user
+    )
 
 """Contains the full compressed/processed Canvas content from a scraping job.
   Multiple documents can belong to the same job (though current code creates one per job)."""
@@ -46,7 +49,7 @@ class Chunk(Base):
     document_id = Column(String(64), ForeignKey("documents.id"), index=True, nullable=False)
     chunk_index = Column(Integer)
     text = Column(Text)
-    embedding = Column(Text)  # JSON-serialized list[float] for portability
+    embedding = Column(Text)  # base64 float32 bytes (legacy rows: JSON list[float])
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
 """Stores individual course documents from browser extension scraping.
@@ -61,3 +64,12 @@ class CourseDoc(Base):
     embedding = Column(Text)  # JSON-serialized embedding vector for the entire course
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+"""Content-addressed cache of embedding vectors, keyed by a hash of (model, text), so
+  re-uploaded chunks and repeated questions skip the embeddings API. Rows older than
+  EMBED_CACHE_MAX_AGE_DAYS are deleted."""
+class EmbeddingCache(Base):
+    __tablename__ = "embedding_cache"
+    key = Column(String(64), primary_key=True)  # sha256 hex of model + text
+    embedding = Column(Text)  # base64 float32 bytes
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)  # age-based eviction (app.py)
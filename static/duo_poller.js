@@ -0,0 +1,21 @@
+// Dashboard: show the latest Duo code for the signed-in user while a scrape is logging in.
+(function() {
+  const container = document.getElementById('duo-container');
+  const banner = document.getElementById('duo-banner');
+  if (!container || !banner) return;
+  async function poll() {
+    try {
+      const r = await fetch('/latest_duo', { cache: 'no-cache' });
+      if (!r.ok) return;
+      const data = await r.json();
+      if (data && data.duo_code && data.duo_code.trim() !== '') {
+        container.style.display = 'block';
+        banner.textContent = 'DUO CODE: ' + data.duo_code.trim();
+      } else {
+        container.style.display = 'none';
+      }
+    } catch (e) {}
+  }
+  poll();
+  setInterval(poll, 1500);
+})();
@@ -0,0 +1,37 @@
+// Job detail: refresh status and log for the job named by #job-log[data-job-id].
+// The log is fetched incrementally from data-log-offset; only new bytes cross the wire.
+(function() {
+  const logEl = document.getElementById('job-log');
+  const statusEl = document.getElementById('job-status');
+  const jobId = logEl && logEl.dataset.jobId;
+  if (!jobId) return;
+  let offset = logEl.dataset.logOffset === '' ? null : Number(logEl.dataset.logOffset || 0);
+  let hasLog = offset !== null && offset > 0;
+  async function poll() {
+    try {
+      let url = '/job_state/' + encodeURIComponent(jobId);
+      if (offset !== null) url += '?since=' + offset;
+      const r = await fetch(url, { cache: 'no-cache' });
+      if (!r.ok) return;
+      const data = await r.json();
+      if (statusEl && typeof data.status === 'string') {
+        statusEl.textContent = data.status;
+      }
+      if (typeof data.log_chunk === 'string') {
+        if (data.reset || !hasLog) logEl.textContent = '';
+        if (data.log_chunk) {
+          logEl.append(data.log_chunk);
+          hasLog = true;
+        } else if (!hasLog) {
+          logEl.textContent = '(no logs yet)';
+        }
+        offset = data.offset;
+        if (data.truncated) setTimeout(poll, 0);  // more backlog to catch up on
+      } else if (typeof data.log === 'string') {
+        logEl.textContent = data.log.trim() || '(no logs yet)';
+      }
+    } catch (e) {}
+  }
+  poll();
+  setInterval(poll, 1500);
+})();